@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""get_sequence_from_GTF.pl genemark.gtf seq, writes prot_seq.faa and nuc_seq.fna"""
+import os
+import re
+import sys
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from stubcommon import latency, protein
+
+gtf, fasta = sys.argv[1:3]
+nre = re.compile(r'gene_id "([0-9]+_g)"')
+cds = {}
+with open(gtf) as fin:
+    for line in fin:
+        l = line.split("\t")
+        if len(l) < 9 or l[2] != "CDS":
+            continue
+        gene = nre.search(l[8]).group(1)
+        cds[gene] = cds.get(gene, 0) + int(l[4]) - int(l[3]) + 1
+latency(sum(cds.values()))
+with open("prot_seq.faa", "w") as faa, open("nuc_seq.fna", "w") as fna:
+    for gene, bp in cds.items():
+        faa.write(">{}\n{}\n".format(gene, protein(gene, bp // 3)))
+        fna.write(">{}\n{}\n".format(gene, "ATG" * (bp // 3)))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+gmes_petap.pl --ES|--predict_with model --cores n [--min_contig n] --sequence seq
+
+Self-training fails if the contigs of at least min_contig bp hold less
+than PYGMES_BENCH_MIN_TRAIN bp (default 100000), like GeneMark-ES does
+for small genomes.
+"""
+import os
+import sys
+import shutil
+import zlib
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from stubcommon import read_fasta, latency, genes
+
+MODEL = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..",
+                     "pygmes", "data", "models", "GCA_000409445.2.mod")
+
+a = sys.argv[1:]
+seqs = read_fasta(a[a.index("--sequence") + 1])
+latency(sum(len(s) for s in seqs.values()))
+for d in ["run", "info", "data", "output/data", "output/gmhmm"]:
+    os.makedirs(d, exist_ok=True)
+step = 2000
+if "--ES" in a:
+    mincontig = int(a[a.index("--min_contig") + 1]) if "--min_contig" in a else 50000
+    trainbp = sum(len(s) for s in seqs.values() if len(s) >= mincontig)
+    if trainbp < int(os.environ.get("PYGMES_BENCH_MIN_TRAIN", 100000)):
+        sys.stderr.write("error, not enough sequence for training: {}\n".format(trainbp))
+        sys.exit(1)
+    shutil.copy(MODEL, os.path.join("output", "gmhmm.mod"))
+else:
+    # models differ in how many genes they find
+    model = os.path.basename(a[a.index("--predict_with") + 1])
+    step = 1500 + zlib.crc32(model.encode()) % 1000
+g = 0
+with open("genemark.gtf", "w") as fout:
+    for contig, seq in seqs.items():
+        for start, end in genes(contig, len(seq), step, 600):
+            g += 1
+            attr = 'gene_id "{}_g"; transcript_id "{}_t";'.format(g, g)
+            fout.write("{}\tGeneMark.hmm\tstart_codon\t{}\t{}\t.\t+\t0\t{}\n".format(contig, start, start + 2, attr))
+            fout.write("{}\tGeneMark.hmm\tCDS\t{}\t{}\t.\t+\t0\t{}\n".format(contig, start, start + 299, attr))
+            fout.write("{}\tGeneMark.hmm\tintron\t{}\t{}\t.\t+\t.\t{}\n".format(contig, start + 300, start + 399, attr))
+            fout.write("{}\tGeneMark.hmm\tCDS\t{}\t{}\t.\t+\t0\t{}\n".format(contig, start + 400, end, attr))
+            fout.write("{}\tGeneMark.hmm\tstop_codon\t{}\t{}\t.\t+\t0\t{}\n".format(contig, end - 2, end, attr))
@@ -0,0 +1,51 @@
+"""
+Shared helpers of the stub tools. They read sequences, sleep for the
+configured latency and write deterministic but realistic looking output.
+
+PYGMES_BENCH_LATENCY         seconds every call sleeps (default 0)
+PYGMES_BENCH_LATENCY_PER_MB  seconds per Mb of input (default 0)
+"""
+import os
+import time
+import random
+import zlib
+
+AMINOACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def read_fasta(path):
+    seqs = {}
+    name = None
+    parts = []
+    with open(path) as fin:
+        for line in fin:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    seqs[name] = "".join(parts)
+                name = line[1:].split()[0]
+                parts = []
+            elif name is not None:
+                parts.append(line)
+    if name is not None:
+        seqs[name] = "".join(parts)
+    return seqs
+
+
+def latency(nbp):
+    seconds = float(os.environ.get("PYGMES_BENCH_LATENCY", 0))
+    seconds += float(os.environ.get("PYGMES_BENCH_LATENCY_PER_MB", 0)) * nbp / 1e6
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def protein(name, length):
+    rng = random.Random(zlib.crc32(name.encode()))
+    return "M" + "".join(rng.choice(AMINOACIDS) for i in range(length - 1))
+
+
+def genes(name, length, step=2000, genelen=900):
+    """
+    start and end (1 based) of the genes of a contig
+    """
+    return [(s, s + genelen - 1) for s in range(1, length - genelen, step)]
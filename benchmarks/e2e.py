@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark of the pygmes orchestration.
+
+GeneMark-ES, Prodigal and Diamond are replaced by the stubs in
+benchmarks/bin and the NCBI taxonomy by a tiny local one, so only the
+time pygmes itself spends is measured (plus the configured stub latency).
+For every bin set size, pygmes --meta runs over all bins and pygmes runs
+on single bins. Per stage the wall time, the CPU time of pygmes and the
+number of file system operations are reported, taken from timings.jsonl
+and from an audit hook in the pygmes process.
+
+    python benchmarks/e2e.py --bins 10 100 1000 -o results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import synthetic  # noqa: E402
+import taxonomy  # noqa: E402
+
+# audit events that touch the file system
+FSEVENTS = ["open", "os.listdir", "os.scandir", "os.mkdir", "os.rmdir", "os.remove", "os.rename",
+            "os.link", "os.symlink", "os.truncate", "os.utime", "os.chmod", "shutil.copyfile",
+            "shutil.copymode", "shutil.move", "shutil.rmtree", "glob.glob", "sqlite3.connect"]
+
+
+def child(report, argv):
+    """
+    run pygmes in this process, counting file system operations per stage
+    """
+    sys.path.insert(0, ROOT)
+    import atexit
+    from pygmes import timings
+    from pygmes.api import main
+    counts = defaultdict(lambda: defaultdict(int))
+    events = set(FSEVENTS)
+
+    def hook(event, args):
+        if event in events:
+            s = getattr(timings._current, "stage", None)
+            counts[s.name if s is not None else "other"][event] += 1
+
+    def write():
+        with open(report, "w") as fout:
+            json.dump({"cpu": time.process_time(), "fsops": counts}, fout)
+
+    atexit.register(write)
+    sys.addaudithook(hook)
+    sys.argv = ["pygmes"] + argv
+    main()
+
+
+def models_source(workdir):
+    """
+    a local model source with the bundled models and lineages that are in
+    the tiny taxonomy
+    """
+    source = os.path.join(workdir, "models_source")
+    if os.path.exists(source):
+        return source
+    os.makedirs(os.path.join(source, "models"))
+    bundled = os.path.join(ROOT, "pygmes", "data", "models")
+    lineages = [taxonomy.lineage(4932), taxonomy.lineage(4930), taxonomy.lineage(4751), taxonomy.lineage(33208)]
+    with open(os.path.join(source, "info.csv"), "w") as fout:
+        for i, f in enumerate(sorted([f for f in os.listdir(bundled) if f.endswith(".mod")])):
+            shutil.copy(os.path.join(bundled, f), os.path.join(source, "models", f))
+            lng = "-".join([str(t) for t in lineages[i % len(lineages)]])
+            fout.write("{},benchmark,{}\n".format(f[:-4], lng))
+    return source
+
+
+def run(args, workdir, options, env):
+    """
+    run pygmes with args in a child process, returns the measurements
+    """
+    report = os.path.join(workdir, "report.{}.json".format(time.time()))
+    before = os.times()
+    start = time.time()
+    p = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", report, "--"] + args,
+                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    wall = time.time() - start
+    after = os.times()
+    if p.returncode != 0:
+        sys.stderr.write(p.stderr.decode()[-3000:])
+        raise RuntimeError("pygmes failed: {}".format(" ".join(args)))
+    with open(report) as fin:
+        r = json.load(fin)
+    outdir = args[args.index("-o") + 1]
+    stages = defaultdict(lambda: {"wall": 0.0, "cpu": 0.0, "childcpu": 0.0, "n": 0, "fsops": 0})
+    with open(os.path.join(outdir, "timings.jsonl")) as fin:
+        for line in fin:
+            t = json.loads(line)
+            if t.get("parent") is not None:
+                continue
+            s = stages[t["stage"]]
+            s["n"] += 1
+            for key in ["wall", "cpu", "childcpu"]:
+                s[key] += t[key]
+    for stage, ops in r["fsops"].items():
+        stages[stage]["fsops"] += sum(ops.values())
+    return {"wall": wall,
+            "cpu": r["cpu"],
+            "toolcpu": (after.children_user + after.children_system - before.children_user
+                        - before.children_system) - r["cpu"],
+            "fsops": sum([sum(ops.values()) for ops in r["fsops"].values()]),
+            "stages": stages}
+
+
+def merge(results):
+    total = {"wall": 0.0, "cpu": 0.0, "toolcpu": 0.0, "fsops": 0,
+             "stages": defaultdict(lambda: {"wall": 0.0, "cpu": 0.0, "childcpu": 0.0, "n": 0, "fsops": 0})}
+    for r in results:
+        for key in ["wall", "cpu", "toolcpu", "fsops"]:
+            total[key] += r[key]
+        for stage, s in r["stages"].items():
+            for key, value in s.items():
+                total["stages"][stage][key] += value
+    return total
+
+
+def report(name, nbins, r):
+    print("{} on {} bins: {:.1f}s wall, {:.1f}s pygmes CPU, {:.1f}s tool CPU, {} fs ops".format(
+          name, nbins, r["wall"], r["cpu"], r["toolcpu"], r["fsops"]))
+    print("  {:<14} {:>6} {:>10} {:>10} {:>10} {:>8}".format("stage", "n", "wall", "cpu", "tool cpu", "fs ops"))
+    for stage, s in sorted(r["stages"].items(), key=lambda x: -x[1]["wall"]):
+        print("  {:<14} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}".format(
+              stage, s["n"], s["wall"], s["cpu"], s["childcpu"], s["fsops"]))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        return child(sys.argv[2], sys.argv[4:])
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of pygmes with stub tools")
+    parser.add_argument("--bins", type=int, nargs="+", default=[10, 100],
+                        help="Sizes of the synthetic bin sets (default: 10 100)")
+    parser.add_argument("--mode", choices=["meta", "single", "both"], default="both")
+    parser.add_argument("--single-max", dest="singlemax", type=int, default=10,
+                        help="Run single mode on at most this many bins of each set")
+    parser.add_argument("-n", "--ncores", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Seconds every stub call sleeps")
+    parser.add_argument("--latency-per-mb", dest="latencypermb", type=float, default=0,
+                        help="Seconds every stub call sleeps per Mb of input")
+    parser.add_argument("--mean-bp", dest="meanbp", type=int, default=300000,
+                        help="Mean size of the synthetic bins")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=None, help="Keep all files in this folder")
+    parser.add_argument("-o", "--output", default=None, help="Write the results as JSON")
+    parser.add_argument("extra", nargs=argparse.REMAINDER,
+                        help="Further pygmes options after --")
+    options = parser.parse_args()
+    extra = options.extra[1:] if options.extra[:1] == ["--"] else options.extra
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix="pygmes_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    taxdb = taxonomy.build(os.path.join(workdir, "taxonomy"))
+    source = models_source(workdir)
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(HERE, "bin") + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYGMES_BENCH_LATENCY"] = str(options.latency)
+    env["PYGMES_BENCH_LATENCY_PER_MB"] = str(options.latencypermb)
+    common = ["--db", os.path.join(workdir, "stub.dmnd"), "-n", str(options.ncores), "--taxdb", taxdb,
+              "--models-repo", os.path.join(workdir, "models_repo"), "--models-source", source] + extra
+
+    results = []
+    for nbins in options.bins:
+        bindir = os.path.join(workdir, "bins_{}".format(nbins))
+        if not os.path.exists(bindir):
+            synthetic.make_bins(bindir, nbins, options.seed, meanbp=options.meanbp)
+        if options.mode in ["meta", "both"]:
+            outdir = os.path.join(workdir, "meta_{}".format(nbins))
+            shutil.rmtree(outdir, ignore_errors=True)
+            r = run(["-i", bindir, "-o", outdir, "--meta"] + common, workdir, options, env)
+            report("pygmes --meta", nbins, r)
+            results.append({"mode": "meta", "bins": nbins, "result": r})
+        if options.mode in ["single", "both"]:
+            runs = []
+            for f in sorted(os.listdir(bindir))[:options.singlemax]:
+                outdir = os.path.join(workdir, "single_{}".format(nbins), f)
+                shutil.rmtree(outdir, ignore_errors=True)
+                runs.append(run(["-i", os.path.join(bindir, f), "-o", outdir] + common, workdir, options, env))
+            r = merge(runs)
+            report("pygmes", len(runs), r)
+            results.append({"mode": "single", "bins": len(runs), "result": r})
+    if options.output is not None:
+        with open(options.output, "w") as fout:
+            json.dump({"options": vars(options), "results": results}, fout, indent=2)
+    if options.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Seeded generators for the inputs of the pygmes hot paths: genomes,
+GeneMark-ES GTFs with their proteins, Prodigal proteins and Diamond
+tables. The same seed always gives the same files.
+"""
+import random
+
+from taxonomy import NODES
+
+AMINOACIDS = "ACDEFGHIKLMNPQRSTVWY"
+SPECIES = [taxid for taxid, parent, rank, name in NODES if rank == "species"]
+
+
+def writelines(path, lines, chunk=100000):
+    """
+    write an iterator of lines in chunks, so large files are fast to make
+    """
+    with open(path, "w") as fout:
+        buf = []
+        for line in lines:
+            buf.append(line)
+            if len(buf) >= chunk:
+                fout.write("".join(buf))
+                buf = []
+        fout.write("".join(buf))
+    return path
+
+
+def protein(rng, length):
+    return "M" + "".join(rng.choices(AMINOACIDS, k=length - 1))
+
+
+def genome(path, ncontigs, meanlen=2000, seed=1, duplicates=0.01):
+    """
+    fasta with ncontigs contigs. Headers carry a description and a
+    fraction duplicates of the names is repeated, as clean_fasta expects
+    """
+    rng = random.Random(seed)
+    block = "".join(rng.choices("ACGT", k=10000))
+
+    def lines():
+        for i in range(ncontigs):
+            name = "contig{}".format(i if rng.random() >= duplicates or i == 0 else rng.randrange(i))
+            length = max(200, int(rng.expovariate(1 / meanlen)))
+            offset = rng.randrange(len(block) - 1000)
+            seq = (block[offset:] + block) * (length // len(block) + 1)
+            yield ">{} length={} cov=12.5\n".format(name, length)
+            for j in range(0, length, 60):
+                yield seq[j:j + 60] + "\n"
+    return writelines(path, lines())
+
+
+def gtf(path, faa, ncontigs, genes=3, seed=1):
+    """
+    GeneMark-ES GTF with genes genes per contig, each with two exons, and
+    the matching proteins named like get_sequence_from_GTF.pl does
+    """
+    rng = random.Random(seed)
+    prots = {}
+
+    def lines():
+        g = 0
+        for c in range(ncontigs):
+            start = 1
+            for i in range(genes):
+                g += 1
+                start += rng.randrange(100, 2000)
+                e1 = rng.randrange(90, 600)
+                e2 = rng.randrange(90, 600)
+                attr = 'gene_id "{}_g"; transcript_id "{}_t";\n'.format(g, g)
+                yield "contig{}\tGeneMark.hmm\tCDS\t{}\t{}\t.\t+\t0\t{}".format(c, start, start + e1 - 1, attr)
+                yield "contig{}\tGeneMark.hmm\tCDS\t{}\t{}\t.\t+\t0\t{}".format(
+                    c, start + e1 + 100, start + e1 + 99 + e2, attr)
+                prots["{}_g".format(g)] = (e1 + e2) // 3
+                start += e1 + e2 + 100
+    writelines(path, lines())
+    rng = random.Random(seed + 1)
+    writelines(faa, (">{}\n{}\n".format(name, protein(rng, length)) for name, length in prots.items()))
+    return path, faa
+
+
+def prodigal_faa(path, ncontigs, genes=3, seed=1, prefix="contig"):
+    """
+    Prodigal protein file with genes proteins per contig
+    """
+    rng = random.Random(seed)
+
+    def lines():
+        for c in range(ncontigs):
+            start = 1
+            for i in range(1, genes + 1):
+                start += rng.randrange(10, 500)
+                length = rng.randrange(60, 600)
+                strand = rng.choice(["1", "-1"])
+                yield ">{}{}_{} # {} # {} # {} # ID={}_{};partial=00;start_type=ATG\n{}\n".format(
+                    prefix, c, i, start, start + 3 * length - 1, strand, c, i, protein(rng, length))
+                start += 3 * length
+    return writelines(path, lines())
+
+
+def diamond_tsv(path, nbins, nhits, hits=3, seed=1):
+    """
+    multidiamond result table with nhits lines over nbins bins, each
+    protein with hits hits. Most hits of a bin agree on the species
+    """
+    rng = random.Random(seed)
+    binspecies = [rng.choice(SPECIES) for b in range(nbins)]
+
+    def lines():
+        for q in range(nhits // hits):
+            b = q % nbins
+            name = "bin{}_binseperator_contig{}_{}".format(b, q // 50, q % 50)
+            for h in range(hits):
+                taxid = binspecies[b] if rng.random() < 0.8 else rng.choice(SPECIES)
+                yield "{}\tref{}\t{:.1f}\t{:.1e}\t{:.1f}\t{}\n".format(
+                    name, rng.randrange(10 ** 6), rng.uniform(30, 100), 10 ** -rng.randrange(20, 100),
+                    rng.uniform(50, 500), taxid)
+    return writelines(path, lines())
+
+
+def lineages(n, seed=1):
+    """
+    n lineages (lists of taxids) that mostly agree
+    """
+    from taxonomy import lineage
+    rng = random.Random(seed)
+    main = rng.choice(SPECIES)
+    return [lineage(main if rng.random() < 0.7 else rng.choice(SPECIES)) for i in range(n)]
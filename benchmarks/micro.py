@@ -0,0 +1,319 @@
+"""
+Microbenchmarks of the pure Python hot paths of pygmes.
+
+Every benchmark runs at increasing scales on inputs made by generate.py
+with a fixed seed. The best of --repeat runs is reported together with
+the time per item and the peak memory of a separate run traced with
+tracemalloc. Larger scales of a benchmark are skipped once a run takes
+longer than --budget seconds.
+
+    python benchmarks/micro.py --levels 1 2 3 -o micro.json
+    python benchmarks/micro.py --levels 1 2 3 --compare micro.json
+
+Level 4 reaches 1e6 contigs and 1e7 Diamond hits.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+import generate  # noqa: E402
+import taxonomy  # noqa: E402
+
+
+def contigs(level):
+    return 10 ** (level + 2)
+
+
+def hits(level):
+    return 10 ** (level + 3)
+
+
+class fake:
+    """
+    stands in for a finished gmes or prodigal run
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def check_success(self):
+        return True
+
+
+def new(cls, **kwargs):
+    """
+    an instance of cls without running its tools in __init__
+    """
+    obj = cls.__new__(cls)
+    obj.__dict__.update(kwargs)
+    return obj
+
+
+def index(faa):
+    from pyfaidx import Fasta
+    Fasta(faa)
+
+
+# Each benchmark is a function of (workdir, level) doing the untimed setup.
+# It returns the number of items and a function doing the timed work,
+# which is called repeatedly and must clean up after itself.
+
+def bench_clean_fasta(workdir, level):
+    from pygmes.api import pygmes
+    n = contigs(level)
+    fasta = generate.genome(os.path.join(workdir, "genome.fa"), n, meanlen=500)
+    p = new(pygmes)
+
+    def run():
+        out = os.path.join(workdir, "clean")
+        p.clean_fasta(fasta, out)
+        shutil.rmtree(out)
+    return n, run
+
+
+def gmes_inputs(workdir, level):
+    n = contigs(level)
+    gtf, faa = generate.gtf(os.path.join(workdir, "genemark.gtf"), os.path.join(workdir, "prot_seq.faa"), n)
+    index(faa)
+    return n, gtf, faa
+
+
+def bench_parse_gtf(workdir, level):
+    from pygmes.exec import gmes
+    n, gtf, faa = gmes_inputs(workdir, level)
+    g = new(gmes)
+    return n, lambda: g.parse_gtf(gtf)
+
+
+def bench_gtf2bed(workdir, level):
+    from pygmes.exec import gmes
+    n, gtf, faa = gmes_inputs(workdir, level)
+    g = new(gmes)
+    bed = os.path.join(workdir, "genes.bed")
+
+    def run():
+        g.gtf2bed(gtf, bed)
+        os.remove(bed)
+    return n, run
+
+
+def bench_rename_for_CAT(workdir, level):
+    from pygmes.exec import gmes
+    n, gtf, faa = gmes_inputs(workdir, level)
+    g = new(gmes, outdir=workdir, protfaa=faa, gtf=gtf)
+
+    def run():
+        g.rename_for_CAT()
+        os.remove(g.finalfaa)
+        os.remove(g.bedfile)
+    return n, run
+
+
+def bench_make_bed(workdir, level):
+    from pygmes.prodigal import prodigal
+    n = contigs(level)
+    faa = generate.prodigal_faa(os.path.join(workdir, "prot.faa"), n)
+    p = new(prodigal, outdir=workdir, faa=faa)
+    return n, p.make_bed
+
+
+def bench_parse_results(workdir, level):
+    from pygmes.diamond import multidiamond
+    n = hits(level)
+    tsv = generate.diamond_tsv(os.path.join(workdir, "diamond.result"), max(10, n // 10000), n)
+    d = new(multidiamond)
+    return n, lambda: d.parse_results(tsv)
+
+
+def bench_vote_bins(workdir, level):
+    from pygmes.diamond import multidiamond
+    n = hits(level)
+    tsv = generate.diamond_tsv(os.path.join(workdir, "diamond.result"), max(10, n // 10000), n)
+    d = new(multidiamond)
+    result = d.parse_results(tsv)
+
+    def run():
+        d.lineages = {}
+        d.vote_bins(result)
+    return n, run
+
+
+def bench_majorityvote(workdir, level):
+    from pygmes.diamond import majorityvote
+    n = contigs(level)
+    lngs = generate.lineages(n)
+    return n, lambda: majorityvote(lngs)
+
+
+def bench_make_hybrid_faa(workdir, level):
+    from pygmes.api import bin
+    n = contigs(level)
+    # GeneMark-ES misses a fifth of the contigs, which prodigal fills in
+    gfaa = generate.prodigal_faa(os.path.join(workdir, "gmes.faa"), n * 4 // 5, seed=1)
+    pfaa = generate.prodigal_faa(os.path.join(workdir, "prodigal.faa"), n, seed=2)
+    for faa in [gfaa, pfaa]:
+        index(faa)
+        with open(faa) as fin, open(faa + ".bed", "w") as fout:
+            for line in fin:
+                if line.startswith(">"):
+                    name = line[1:].split()[0]
+                    fout.write("{}\t1\t100\t+\t{}\n".format(name.rsplit("_", 1)[0], name))
+    b = new(bin, name="bench", outdir=workdir, status={}, hybridfaa=None, hybridbed=None,
+            gmes=fake(finalfaa=gfaa, bedfile=gfaa + ".bed"),
+            prodigal=fake(faa=pfaa, bed=pfaa + ".bed"))
+
+    def run():
+        b.make_hybrid_faa()
+        shutil.rmtree(os.path.join(workdir, "hybrid"))
+    return n, run
+
+
+def lineage_lookups(ncbi, level):
+    n = hits(level)
+    taxids = [generate.SPECIES[i % len(generate.SPECIES)] for i in range(n)]
+
+    def run():
+        for taxid in taxids:
+            ncbi.get_lineage(taxid)
+    return n, run
+
+
+def bench_lineage_sqlite(workdir, level):
+    from ete3 import NCBITaxa
+    return lineage_lookups(NCBITaxa(dbfile=taxonomy.build(TAXONOMY)), level)
+
+
+def bench_lineage_snapshot(workdir, level):
+    from pygmes.taxonomy import snapshot
+    return lineage_lookups(snapshot(taxonomy.build_snapshot(TAXONOMY)), level)
+
+
+def bench_write_lngs(workdir, level):
+    from pygmes.printlngs import write_lngs
+    n = contigs(level)
+    lngs = {"bin{}".format(i): {"lng": lng, "n": 10} for i, lng in enumerate(generate.lineages(n))}
+    out = os.path.join(workdir, "lineages.tsv")
+    return n, lambda: write_lngs(lngs, out)
+
+
+def bench_single_fasta(workdir, level):
+    from pygmes.api import single_fasta
+    n = contigs(level)
+    nfiles = 100
+    faas = [generate.prodigal_faa(os.path.join(workdir, "bin{}.faa".format(i)), max(1, n // nfiles), 1, seed=i)
+            for i in range(nfiles)]
+    names = ["bin{}".format(i) for i in range(nfiles)]
+    out = os.path.join(workdir, "cat.faa")
+    return n, lambda: single_fasta(faas, names, out)
+
+
+BENCHMARKS = {
+    "clean_fasta": bench_clean_fasta,
+    "parse_gtf": bench_parse_gtf,
+    "gtf2bed": bench_gtf2bed,
+    "rename_for_CAT": bench_rename_for_CAT,
+    "make_bed": bench_make_bed,
+    "parse_results": bench_parse_results,
+    "vote_bins": bench_vote_bins,
+    "majorityvote": bench_majorityvote,
+    "make_hybrid_faa": bench_make_hybrid_faa,
+    "write_lngs": bench_write_lngs,
+    "single_fasta": bench_single_fasta,
+    "lineage_sqlite": bench_lineage_sqlite,
+    "lineage_snapshot": bench_lineage_snapshot,
+}
+
+# folder of the tiny taxonomy, set in main
+TAXONOMY = None
+
+
+def measure(func, repeat):
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def compare(results, path, threshold):
+    with open(path) as fin:
+        old = {(r["name"], r["level"]): r for r in json.load(fin)["results"]}
+    print("\nCompared to {}:".format(path))
+    for r in results:
+        o = old.get((r["name"], r["level"]))
+        if o is None:
+            continue
+        ratio = r["seconds"] / o["seconds"] if o["seconds"] > 0 else float("inf")
+        mem = r["peak"] / o["peak"] if o["peak"] > 0 else float("inf")
+        flag = "  REGRESSION" if ratio > threshold or mem > threshold else ""
+        print("  {:<16} level {}  time x{:.2f}  memory x{:.2f}{}".format(r["name"], r["level"], ratio, mem, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the pygmes hot paths")
+    parser.add_argument("names", nargs="*", help="Benchmarks to run (default: all): {}".format(
+                        ", ".join(BENCHMARKS.keys())))
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3],
+                        help="Scales to run, level k has 10^(k+2) contigs and 10^(k+3) hits")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=60,
+                        help="Skip larger levels of a benchmark once a run takes longer (seconds)")
+    parser.add_argument("-o", "--output", default=None, help="Write the results as JSON")
+    parser.add_argument("--compare", default=None, help="Results of an earlier run to compare to")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Flag time or memory ratios above this as regressions")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    workroot = tempfile.mkdtemp(prefix="pygmes_micro_")
+    from pygmes.taxonomy import set_dbfile
+    global TAXONOMY
+    TAXONOMY = os.path.join(workroot, "taxonomy")
+    set_dbfile(taxonomy.build(TAXONOMY))
+    results = []
+    print("{:<16} {:>5} {:>10} {:>10} {:>12} {:>10}".format("benchmark", "level", "n", "seconds", "ns/item", "peak MB"))
+    try:
+        for name in options.names or BENCHMARKS.keys():
+            for level in sorted(options.levels):
+                workdir = os.path.join(workroot, "{}_{}".format(name, level))
+                os.makedirs(workdir)
+                n, func = BENCHMARKS[name](workdir, level)
+                seconds, peak = measure(func, options.repeat)
+                shutil.rmtree(workdir)
+                r = {"name": name, "level": level, "n": n, "seconds": seconds,
+                     "nsperitem": seconds / n * 1e9, "peak": peak}
+                results.append(r)
+                print("{:<16} {:>5} {:>10} {:>10.4f} {:>12.0f} {:>10.1f}".format(
+                      name, level, n, seconds, r["nsperitem"], peak / 1e6))
+                if seconds > options.budget:
+                    print("{:<16} skipping larger levels, over the budget of {:.0f}s".format(name, options.budget))
+                    break
+    finally:
+        shutil.rmtree(workroot, ignore_errors=True)
+    if options.output is not None:
+        with open(options.output, "w") as fout:
+            json.dump({"python": sys.version, "results": results}, fout, indent=2)
+    if options.compare is not None:
+        compare(results, options.compare, options.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Startup time budget of pygmes.
+
+Imports pygmes.api in fresh interpreters with python -X importtime and
+fails if the import takes longer than the budget or loads one of the
+heavy dependencies, which must only be imported when their stage runs.
+Also times `pygmes --version` end to end.
+
+    python benchmarks/startup.py --budget-ms 100
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# modules that must not be imported by `import pygmes.api`
+HEAVY = ["ete3", "numpy", "pyfaidx", "asyncio", "urllib.request", "sqlite3", "concurrent.futures"]
+
+
+def importtime(module, env):
+    """
+    cumulative import time of module in microseconds and the imported modules
+    """
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                       env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True)
+    modules = {}
+    for line in p.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+        except ValueError:
+            continue
+    return modules[module][1], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of pygmes")
+    parser.add_argument("--budget-ms", dest="budget", type=float, default=100,
+                        help="Maximal import time of pygmes.api in ms (default: 100)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Show the slowest modules")
+    options = parser.parse_args()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+
+    runs = [importtime("pygmes.api", env) for i in range(options.repeat)]
+    best = min([r[0] for r in runs]) / 1000
+    modules = runs[-1][1]
+    print("import pygmes.api: {:.1f} ms (best of {})".format(best, options.repeat))
+    print("slowest modules (self time):")
+    for name, (own, cumulative) in sorted(modules.items(), key=lambda x: -x[1][0])[:options.top]:
+        print("  {:<40} {:>8.1f} ms".format(name, own / 1000))
+
+    start = time.time()
+    subprocess.run([sys.executable, "-c", "from pygmes.api import main; main()", "--version"],
+                   env=env, stdout=subprocess.DEVNULL, check=True)
+    print("pygmes --version: {:.1f} ms".format((time.time() - start) * 1000))
+
+    failed = False
+    heavy = [m for m in HEAVY if m in modules]
+    if len(heavy) > 0:
+        print("FAIL: heavy modules imported at startup: {}".format(", ".join(heavy)))
+        failed = True
+    if best > options.budget:
+        print("FAIL: import takes {:.1f} ms, over the budget of {:.0f} ms".format(best, options.budget))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Synthetic bin sets for the benchmarks. Bins are named prokNNNNN.fa or
+eukNNNNN.fa and so are their contigs, which is what the stub tools use to
+decide the lineage. Everything is generated from a seed.
+"""
+import os
+import random
+
+
+def contig_lengths(rng, totalbp, meancontig):
+    lengths = []
+    while sum(lengths) < totalbp:
+        lengths.append(max(500, int(rng.lognormvariate(0, 0.8) * meancontig)))
+    return lengths
+
+
+def write_bin(path, name, lengths, rng):
+    with open(path, "w") as fout:
+        for i, length in enumerate(lengths):
+            fout.write(">{}_c{}\n".format(name, i))
+            seq = "".join(rng.choice("ACGT") for j in range(min(length, 1000)))
+            # repeat a random block, generating every base is too slow for large sets
+            seq = (seq * (length // len(seq) + 1))[:length]
+            for j in range(0, length, 80):
+                fout.write(seq[j:j + 80])
+                fout.write("\n")
+
+
+def make_bins(outdir, n, seed=1, eukfraction=0.3, meanbp=300000, meancontig=20000):
+    """
+    write n bins to outdir, a fraction eukfraction of them eukaryotic.
+    Bin sizes vary around meanbp. Returns the list of paths
+    """
+    rng = random.Random(seed)
+    os.makedirs(outdir, exist_ok=True)
+    paths = []
+    for i in range(n):
+        kind = "euk" if rng.random() < eukfraction else "prok"
+        name = "{}{:05d}".format(kind, i)
+        path = os.path.join(outdir, "{}.fa".format(name))
+        lengths = contig_lengths(rng, int(meanbp * rng.uniform(0.3, 2)), meancontig)
+        write_bin(path, name, lengths, rng)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a synthetic bin set")
+    parser.add_argument("outdir")
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--euk-fraction", dest="eukfraction", type=float, default=0.3)
+    parser.add_argument("--mean-bp", dest="meanbp", type=int, default=300000)
+    options = parser.parse_args()
+    make_bins(options.outdir, options.n, options.seed, options.eukfraction, options.meanbp)
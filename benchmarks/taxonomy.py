@@ -0,0 +1,79 @@
+"""
+A tiny NCBI taxonomy with the lineages the stub tools report, built into
+an ete3 taxa.sqlite or a pygmes taxonomy snapshot so the benchmarks need
+neither the network nor the full NCBI dump.
+"""
+import os
+import tarfile
+import contextlib
+
+# taxid, parent, rank, name
+NODES = [
+    (1, 1, "no rank", "root"),
+    (131567, 1, "no rank", "cellular organisms"),
+    (2, 131567, "superkingdom", "Bacteria"),
+    (1224, 2, "phylum", "Proteobacteria"),
+    (1236, 1224, "class", "Gammaproteobacteria"),
+    (91347, 1236, "order", "Enterobacterales"),
+    (543, 91347, "family", "Enterobacteriaceae"),
+    (561, 543, "genus", "Escherichia"),
+    (562, 561, "species", "Escherichia coli"),
+    (2157, 131567, "superkingdom", "Archaea"),
+    (2759, 131567, "superkingdom", "Eukaryota"),
+    (33154, 2759, "no rank", "Opisthokonta"),
+    (33208, 33154, "kingdom", "Metazoa"),
+    (4751, 33154, "kingdom", "Fungi"),
+    (4890, 4751, "phylum", "Ascomycota"),
+    (4891, 4890, "class", "Saccharomycetes"),
+    (4892, 4891, "order", "Saccharomycetales"),
+    (4893, 4892, "family", "Saccharomycetaceae"),
+    (4930, 4893, "genus", "Saccharomyces"),
+    (4932, 4930, "species", "Saccharomyces cerevisiae"),
+]
+
+
+def lineage(taxid):
+    parents = {t: p for t, p, rank, name in NODES}
+    lng = [taxid]
+    while lng[-1] != 1:
+        lng.append(parents[lng[-1]])
+    return lng[::-1]
+
+
+def build(outdir):
+    """
+    write the taxdump and build taxa.sqlite in outdir, returns its path
+    """
+    from ete3 import NCBITaxa
+    os.makedirs(outdir, exist_ok=True)
+    dbfile = os.path.join(outdir, "taxa.sqlite")
+    if os.path.exists(dbfile):
+        return dbfile
+    with open(os.path.join(outdir, "nodes.dmp"), "w") as fout:
+        for taxid, parent, rank, name in NODES:
+            fout.write("{}\t|\t{}\t|\t{}\t|\n".format(taxid, parent, rank))
+    with open(os.path.join(outdir, "names.dmp"), "w") as fout:
+        for taxid, parent, rank, name in NODES:
+            fout.write("{}\t|\t{}\t|\t\t|\tscientific name\t|\n".format(taxid, name))
+    open(os.path.join(outdir, "merged.dmp"), "w").close()
+    dump = os.path.join(outdir, "taxdump.tar.gz")
+    with tarfile.open(dump, "w:gz") as tar:
+        for f in ["nodes.dmp", "names.dmp", "merged.dmp"]:
+            tar.add(os.path.join(outdir, f), arcname=f)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        NCBITaxa(dbfile=dbfile, taxdump_file=dump)
+    return dbfile
+
+
+def build_snapshot(outdir):
+    """
+    build the taxonomy snapshot of pygmes in outdir/snapshot from the same
+    taxdump, returns its path
+    """
+    from pygmes.taxonomy import build as build_taxonomy
+    path = os.path.join(outdir, "snapshot")
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        build(outdir)
+        build_taxonomy(os.path.join(outdir, "taxdump.tar.gz"), path)
+    return path
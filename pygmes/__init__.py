@@ -1 +1,10 @@
-from pygmes.api import pygmes
+def __getattr__(name):
+    # the library API is imported on first use, so importing a submodule
+    # such as pygmes.version does not load the whole pipeline
+    if name in ["pygmes", "predict_genome", "predict_bins"]:
+        from pygmes import api
+        return getattr(api, name)
+    if name == "binresult":
+        from pygmes.results import binresult
+        return binresult
+    raise AttributeError("module 'pygmes' has no attribute '{}'".format(name))
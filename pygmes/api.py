@@ -1,29 +1,86 @@
 import os 
+import sys
 import logging
 import argparse
 from pygmes.exec import gmes
-from pygmes.diamond import multidiamond
+from pygmes.diamond import multidiamond, diamond_blocksize
 import shutil
 import gzip
 from glob import glob
-from pyfaidx import Fasta
 import pygmes.version  as version
-from pygmes.exec import create_dir
-from pygmes.printlngs import write_lngs
+from pygmes.exec import create_dir, delete_folder, PygmesError
+from pygmes.printlngs import write_lngs, read_lngs
+from pygmes.manifest import manifest
 from pygmes.prodigal import prodigal
+from pygmes.modelrepo import modelrepo
+from pygmes.modelcluster import representative_models
+from pygmes.triage import length_index, triage
+from pygmes.composition import read_fasta
+from pygmes.results import binresult
+from pygmes.scheduler import scheduler, costmodel, job
+from pygmes import jobs
+from pygmes import timings
+from pygmes import profiling
+from pygmes import events
+from pygmes import taxonomy
+import pygmes.modelindex as modelindex
 
 this_dir, this_filename = os.path.split(__file__)
 MODELS_PATH = os.path.join(this_dir, "data", "models")
+METADATA_KEYS = ["name", "path", "software", "nprot", "lng", "triage", "trainbp", "n50"]
 
 
 
 class bin:
-    def __init__(self, path, outdir):
+    def __init__(self, path, outdir, scratch = None, timeouts = None):
         self.fasta = os.path.abspath(path)
+        self.scratch = scratch
+        self.timeouts = timeouts
         self.name = os.path.basename(path)
         self.outdir = os.path.join(os.path.abspath(outdir), self.name)
         create_dir(self.outdir)
         self.hybridfaa = None
+        # outcome of each stage, kept for the metadata and the result store
+        self.status = {}
+        self.contiglengths = None
+        self.triageinfo = None
+        # GeneMark-ES runs on all contigs unless contigs are routed
+        self.gmesfasta = self.fasta
+        self.gmescontigs = None
+
+    def lengths(self):
+        """
+        contig lengths of the bin, indexed once per bin
+        """
+        if self.contiglengths is None:
+            self.contiglengths = length_index(self.fasta, self.outdir)
+        return self.contiglengths
+
+    def size(self, routed = False):
+        """
+        bp and number of contigs of the bin, or of the contigs routed to
+        GeneMark-ES
+        """
+        lengths = self.lengths()
+        if routed and self.gmescontigs is not None:
+            lengths = {c: l for c, l in lengths.items() if c in self.gmescontigs}
+        return sum(lengths.values()), len(lengths)
+
+    def job(self, stage, func, routed = False, **kwargs):
+        """
+        job running func(self, **kwargs). func must be a module level
+        function returning the bin, so the job can run on a worker of a
+        distributed run
+        """
+        bp, ncontigs = self.size(routed)
+        return job(stage, self.name, bp, ncontigs, lambda: func(self, **kwargs),
+                   task = (func, (self,), kwargs), done = self.update)
+
+    def update(self, other):
+        """
+        take over the state of a copy of this bin processed by a worker
+        """
+        self.__dict__.update(other.__dict__)
     
     def get_best_faa(self):
         if self.kingdom is not None and self.kingdom in ["bacteria", "archaea"]:
@@ -45,16 +102,59 @@ class bin:
         logging.debug("No final faa for bin: %s" % self.name)
         return(None, None, self.name, None)
 
-    def gmes_training(self, ncores = 1):
+    def route_contigs(self, contiglngs, minproteins = 2):
+        """
+        given the lineages of the contigs, write all contigs that are not
+        clearly prokaryotic to a reduced fasta used for GeneMark-ES.
+        Prokaryotic contigs are then only annotated by prodigal and end up
+        in the hybrid proteome
+        """
+        prok = set()
+        for contig, v in contiglngs.items():
+            if v['n'] >= minproteins and (2 in v['lng'] or 2157 in v['lng']):
+                prok.add(contig)
+        lengths = self.lengths()
+        keep = [c for c in lengths.keys() if c not in prok]
+        if len(prok) == 0 or len(keep) == 0:
+            self.status["routing"] = "all contigs"
+            return
+        self.gmescontigs = set(keep)
+        self.gmesfasta = os.path.join(self.outdir, "gmes_input.fa")
+        tmp = "{}.tmp".format(self.gmesfasta)
+        with open(tmp, "w") as fout:
+            for name, seq in read_fasta(self.fasta):
+                if name in self.gmescontigs:
+                    fout.write(">{}\n{}\n".format(name, seq))
+        os.replace(tmp, self.gmesfasta)
+        keepbp = sum([lengths[c] for c in keep])
+        logging.debug("Routing %d of %d contigs (%d of %d bp) of bin %s to GeneMark-ES" %
+                      (len(keep), len(lengths), keepbp, sum(lengths.values()), self.name))
+        self.status["routing"] = "{} of {} contigs".format(len(keep), len(lengths))
+
+    def gmes_training(self, ncores = 1, triageargs = None):
         outdir = os.path.join(self.outdir, "gmes_training")
-        self.gmes = gmes(self.fasta, outdir, ncores)
+        self.gmes = gmes(self.gmesfasta, outdir, ncores, scratch = self.scratch, timeouts = self.timeouts)
+        if triageargs is not None:
+            lengths = self.lengths()
+            if self.gmescontigs is not None:
+                lengths = {c: l for c, l in lengths.items() if c in self.gmescontigs}
+            trainable, self.triageinfo = triage(lengths, **triageargs)
+            if not trainable and not os.path.exists(self.gmes.gtf):
+                logging.info("Skipping self-training of bin %s: %s" % (self.name, self.triageinfo['triage']))
+                self.status["selftraining"] = "skipped"
+                return
         self.gmes.selftraining()
+        if self.gmes.timedout:
+            self.status["selftraining"] = "timeout"
+        else:
+            self.status["selftraining"] = "ok" if self.gmes.check_success() else "failed"
     
     def run_prodigal(self, ncores = 1, outdir=None):
         if outdir is None:
             outdir = os.path.join(self.outdir, "prodigal")
             create_dir(outdir)
-        self.prodigal = prodigal(self.fasta,  outdir, ncores)
+        self.prodigal = prodigal(self.fasta,  outdir, ncores, scratch = self.scratch, timeouts = self.timeouts)
+        self.status["prodigal"] = "ok" if self.prodigal.check_success() else "failed"
 
     def make_hybrid_faa(self, gmesfirst = True):
         logging.debug("Making a hybrid of bin %s" % self.name)
@@ -68,6 +168,8 @@ class bin:
         self.hybridfaa = os.path.join(outdir, "gmes_prodigal_merged.faa")
         self.hybridbed = os.path.join(outdir, "gmes_prodigal_merged.bed")
 
+        from pyfaidx import Fasta
+
         def sane_faa(faa):
             if os.stat(faa).st_size == 0:
                 return False
@@ -77,8 +179,7 @@ class bin:
                     return fa
                 return False
             except Exception as e:
-                print(e)
-                logging.debug("Fasta has no entries: %s" % faa)
+                logging.debug("Fasta has no entries: %s\n%s" % (faa, e))
                 return False
 
         def chromname(s):
@@ -112,8 +213,10 @@ class bin:
         contigs1 = getchroms(fa1)
         contigs2 = getchroms(fa2)
         leftover = contigs2 - contigs1
+        self.status["hybrid"] = "none"
         if len(leftover) > 0:
             logging.debug("We found possible bacterial proteins in this proteome")
+            self.status["hybrid"] = "merged"
             # write prot from fa1
             with open(self.hybridfaa, "w") as fout:
                 for seq in fa1:
@@ -131,6 +234,29 @@ class bin:
                     if line.split("\t")[0] in leftover:
                         fout.write(line)
 
+def prodigal_task(b, ncores = 1):
+    b.run_prodigal(ncores = ncores)
+    return b
+
+
+def selftraining_task(b, modeldir, ncores = 1, triageargs = None):
+    b.gmes_training(ncores = ncores, triageargs = triageargs)
+    expectedmodel = os.path.join(b.gmes.outdir, "output","gmhmm.mod")
+    if os.path.exists(expectedmodel):
+        shutil.copy(expectedmodel, os.path.join(modeldir, "{}.mod".format(b.name)))
+    return b
+
+
+def premodel_task(b, modeldir, premodelargs = None):
+    b.gmes.premodel(modeldir, **(premodelargs or {}))
+    b.status["premodel"] = "failed"
+    # if successfull, overwrite the gmes, with the successfull gmes
+    if b.gmes.bestpremodel is not False and b.gmes.bestpremodel.check_success():
+        b.gmes = b.gmes.bestpremodel
+        b.status["premodel"] = b.gmes.modelname
+    return b
+
+
 class pygmes:
     """
     Main class exposing the functionality
@@ -146,22 +272,38 @@ class pygmes:
     **clean:** bool indicating if faster needs cleaning of headers
 
     **ncores:** number of threads to use
+
+    **scratch:** node local folder in which the external tools are run.
+    Only the files pygmes needs are moved to outdir
+
+    **repo:** modelrepo to take the pretrained models from
+
+    **premodelargs:** dict of options for gmes.premodel, such as topk or
+    tournament
+
+    **timeouts:** jobs.timeouts with the wall clock budgets of the tools
     """
-    def __init__(self, fasta, outdir, db,  clean = True, ncores = 1):
+    def __init__(self, fasta, outdir, db,  clean = True, ncores = 1, scratch = None, repo = None,
+                 premodelargs = None, timeouts = None):
         self.fasta = fasta
         self.outdir = outdir
         self.ncores = ncores
 
+        create_dir(self.outdir)
+        recorder = timings.configure(os.path.join(self.outdir, "timings.jsonl"))
+        events.emit("run", bins = 1, outdir = os.path.abspath(self.outdir))
         if clean:
             # copy and clean file
-            self.cleanfasta = self.clean_fasta(self.fasta, self.outdir)
+            with timings.stage("clean"):
+                self.cleanfasta = self.clean_fasta(self.fasta, self.outdir)
         else:
             self.cleanfasta = self.fasta
 
         logging.info("Launching GeneMark-ES")
-        g = gmes(self.cleanfasta, outdir, ncores)
+        g = gmes(self.cleanfasta, outdir, ncores, scratch = scratch, repo = repo, timeouts = timeouts)
         logging.debug("Run complete launch")
-        g.run_complete(MODELS_PATH, db)
+        with timings.stage("gmes"):
+            g.run_complete(MODELS_PATH, db, **(premodelargs or {}))
         if g.finalfaa:
             logging.debug("Copying final faa from: %s" % g.finalfaa)
             shutil.copy(g.finalfaa, os.path.join(self.outdir, "predicted_proteins.faa"))
@@ -170,7 +312,14 @@ class pygmes:
             shutil.copy(g.bedfile, os.path.join(self.outdir, "predicted_proteins.bed"))
         else:
             logging.debug("Could not find bed file")
-        print(g.bedfile)
+        recorder.summary()
+        logging.debug("Bed file: %s" % g.bedfile)
+        self.result = binresult(os.path.basename(self.fasta), "GeneMark-ES" if g.finalfaa else None,
+                                faa = os.path.join(self.outdir, "predicted_proteins.faa") if g.finalfaa else None,
+                                bed = os.path.join(self.outdir, "predicted_proteins.bed") if g.bedfile else None,
+                                lineage = g.tax, support = g.support, fasta = self.cleanfasta)
+        events.emit("bin", bin = self.result.name, software = self.result.software,
+                    nprot = len(self.result.proteins), lng = "-".join([str(x) for x in g.tax]))
 
     def clean_fasta(self, fastaIn, folder):
         create_dir(folder)
@@ -225,8 +374,66 @@ class metapygmes(pygmes):
     to predict proteins in the remaining bins
     and choose the protein prediction with the largest
     number of AA. We then infer the lineage of each bin
+
+    If store is set, final proteins, bed files, lineages and the
+    status of each stage are written to a single SQLite file
+    (pygmes.sqlite) and the per bin working folders are removed
+
+    If clustermodels is set (markov or lineage), the self trained models
+    are clustered and only one representative per cluster is used in
+    the premodel step
+
+    If triageargs is set (a dict of options for triage.triage), bins that
+    have too little sequence in long contigs to train GeneMark-ES skip the
+    self-training and go straight to the premodel step
+
+    If routecontigs is set, contigs of eukaryotic or unassigned bins with
+    at least routecontigs proteins voting for a prokaryotic lineage are
+    left to prodigal and GeneMark-ES only runs on the remaining contigs
+
+    Bins are processed in parallel with jobcores cores per job, largest
+    predicted runtime first. The runtime model is calibrated from the
+    timings of previous runs in costhistory (default: timings.jsonl)
+
+    maxmemory (GB) caps the summed predicted peak memory of the bins that
+    run at once and limits the Diamond block size
+
+    queue (workqueue.workqueue) runs the per bin stages and the Diamond
+    searches as tasks of a work queue on a shared file system instead of
+    in this process, so 'pygmes worker' processes on other nodes do the work
+
+    timeouts (jobs.timeouts) limits the wall clock time of the tools. A bin
+    whose self-training runs out of time falls back to the premodel step,
+    if GeneMark-ES fails entirely the prodigal proteins are used
+
+    Every run records its input bins in manifest.json. With incremental
+    only bins that are new or changed since then are processed, using the
+    models already in gmes_models/ for the premodel step. Their results
+    are merged into metadata.tsv, lineages.tsv and the CAT files, bins
+    that are gone from bindir are removed from them
+
+    metapygmes.iterate takes the same arguments and yields a
+    results.binresult for each bin as soon as it is done: prokaryotic
+    bins right after the first lineage estimation, all others once
+    GeneMark-ES and the second lineage estimation are done
     """
-    def __init__(self, bindir, outdir, db, clean = True, ncores = 1, infertaxonomy = True, fill_bac_gaps = True):
+    def __init__(self, *args, **kwargs):
+        for name in self.stream(*args, results = False, **kwargs):
+            pass
+
+    @classmethod
+    def iterate(cls, *args, **kwargs):
+        """
+        generator running pygmes in metagenomic mode, yielding the
+        results.binresult of each finished bin
+        """
+        return cls.__new__(cls).stream(*args, **kwargs)
+
+    def stream(self, bindir, outdir, db, clean = True, ncores = 1, infertaxonomy = True, fill_bac_gaps = True,
+                 store = False, scratch = None, premodelargs = None, clustermodels = None,
+                 clusterthreshold = 0.15, triageargs = None, routecontigs = None, jobcores = None,
+                 costhistory = None, maxmemory = None, timeouts = None, incremental = False, queue = None,
+                 results = True):
         # find all files and 
         outdir = os.path.abspath(outdir)
         self.outdir = outdir
@@ -240,30 +447,94 @@ class metapygmes(pygmes):
         files = [os.path.abspath(f) for f in files]
         names = [os.path.basename(f) for f  in files]
         if len(names) != len(set(names)):
-            logging.warning("Bin files need to have unique names")
-            exit(1)
+            raise PygmesError("Bin files need to have unique names")
 
         #outdirs = [os.path.join(outdir, name) for name in names]
         #proteinfiles = []
         #proteinnames = []
         # if needed, we clean the fasta files
     
+        # time and resources of every stage
+        create_dir(outdir)
+        recorder = timings.configure(os.path.join(outdir, "timings.jsonl"))
+        # final rows of the bins that are done
+        self.metadata = {}
+        self.finalfaas = {}
+        self.lngs = {}
+
+        # an incremental run only processes the bins that are new or
+        # changed since the run recorded in the manifest
+        mf = manifest(os.path.join(outdir, "manifest.json"))
+        previous = None
+        removed = []
+        if incremental and mf.exists:
+            new, changed, unchanged, removed = mf.changes(files)
+            logging.info("Incremental run: %d new, %d changed, %d unchanged and %d removed bins" %
+                         (len(new), len(changed), len(unchanged), len(removed)))
+            if len(new) + len(changed) + len(removed) == 0:
+                mf.write()
+                logging.info("All bins are up to date")
+                return
+            stale = [os.path.basename(f) for f in changed] + removed
+            for name in stale:
+                self.remove_outputs(name)
+            # the pooled Diamond searches are only done for the new bins
+            delete_folder(os.path.join(outdir, "diamond"))
+            previous = {"names": set(mf.bins.keys()), "drop": set(stale),
+                        "lngs": read_lngs(os.path.join(outdir, "lineages.tsv"))}
+            files = new + changed
+        else:
+            if incremental:
+                logging.info("No manifest of a previous run in %s, processing all bins" % outdir)
+            mf.bins = {}
+        inputs = files
+
         if clean:
             logging.info("Cleaning input fastas")
             cleanfastadir = os.path.join(outdir, "fasta_clean")
-            files = [self.clean_fasta(f, cleanfastadir) for f in files ]
+            cleaned = []
+            for f in files:
+                with timings.stage("clean", os.path.basename(f)):
+                    cleaned.append(self.clean_fasta(f, cleanfastadir))
+            files = cleaned
 
 
         # bin list to keep all the bins and handle all the operations
         binlst = []
         bindirs = os.path.join(outdir, "bins")
+        if store and scratch is not None and queue is None:
+            # the store keeps all results, so the bin folders with their many
+            # small files stay on node local scratch and only pygmes.sqlite
+            # reaches the shared file system. The folder is named after
+            # outdir, so a rerun resumes where the last one stopped. Workers
+            # of a distributed run need the folders in outdir
+            import hashlib
+            digest = hashlib.sha256(os.path.abspath(outdir).encode()).hexdigest()[:16]
+            bindirs = os.path.join(scratch, "pygmes_bins_{}".format(digest))
+            logging.info("Working in %s" % bindirs)
         for path in files:
-            binlst.append(bin(path, bindirs))
+            binlst.append(bin(path, bindirs, scratch = scratch, timeouts = timeouts))
+        events.emit("run", bins = len(binlst), outdir = outdir)
+
+        # bins run in parallel, longest predicted runtime first
+        if jobcores is None:
+            jobcores = ncores
+        if costhistory is None:
+            costhistory = os.path.join(outdir, "timings.jsonl")
+        costs = costmodel(costhistory)
+        if maxmemory is not None:
+            maxmemory = maxmemory * 1e9
+        if queue is not None:
+            from pygmes.workqueue import distributed
+            sched = prodsched = distributed(queue, costs)
+        else:
+            sched = scheduler(ncores, jobcores, costs, maxmemory = maxmemory)
+            prodsched = scheduler(ncores, 1, costs, maxmemory = maxmemory)
+        blocksize = diamond_blocksize(maxmemory)
 
-        # run prodigal
+        # run prodigal, which uses a single core per bin
         logging.info("Running prodigal on all bins")
-        for b in binlst:
-            b.run_prodigal(ncores = ncores)
+        prodsched.run([b.job("prodigal", prodigal_task, ncores = 1) for b in binlst])
         
         # now we can already get a first lineage estimation
         # diamond is faster when using more sequences
@@ -273,16 +544,21 @@ class metapygmes(pygmes):
         logging.info("Predicting the lineage")
         proteinfiles = [b.prodigal.faa for b in binlst if b.prodigal.check_success()]
         proteinnames = [b.name for b in binlst if b.prodigal.check_success()]
-        dmnd_1 = multidiamond(proteinfiles, proteinnames, diamonddir, db = db, ncores = ncores)
-        logging.debug("Ran diamond and inferred lineages")
+        firstlngs = {}
+        if len(proteinfiles) > 0:
+            with timings.stage("diamond_1", nbins = len(proteinfiles)):
+                dmnd_1 = sched.call("diamond_1", multidiamond, proteinfiles, proteinnames, diamonddir, db = db,
+                                    ncores = ncores, scratch = scratch, blocksize = blocksize, timeouts = timeouts)
+            firstlngs = dmnd_1.lngs
+            logging.debug("Ran diamond and inferred lineages")
         # assign a taxonomic kingdom based on the first lineage estimation
         anyeuks = False
         for b in binlst:
             b.first_lng_estimation = None
             b.kingdom = None
-            if b.name in dmnd_1.lngs.keys():
+            if b.name in firstlngs.keys():
                 # as no lng was infered for this bin, we could try prodigal
-                b.first_lng_estimation = dmnd_1.lngs[b.name]
+                b.first_lng_estimation = firstlngs[b.name]
                 if 2 in b.first_lng_estimation['lng']:
                     b.kingdom = "bacteria"
                 elif 2759 in b.first_lng_estimation['lng']:
@@ -292,6 +568,35 @@ class metapygmes(pygmes):
                     b.kingdom = "archaea"
                 else:
                     anyeuks = True
+            else:
+                # no lineage, e.g. because prodigal failed: GeneMark-ES may still work
+                anyeuks = True
+            b.status["diamond_1"] = b.kingdom if b.kingdom is not None else "unassigned"
+
+        # the first search only holds a sample of the proteins of each bin,
+        # too few to vote for single contigs. Bins that may be routed get a
+        # search with all their proteins
+        routed = [b for b in binlst if (b.kingdom is None or b.kingdom == "eukaryote") and
+                  b.prodigal.check_success()]
+        if routecontigs is not None and len(routed) > 0:
+            logging.info("Searching all proteins of %d bins to route their contigs" % len(routed))
+            routingdir = os.path.join(outdir, "diamond", "routing")
+            create_dir(routingdir)
+            with timings.stage("diamond_routing", nbins = len(routed)):
+                dmnd_r = sched.call("diamond_routing", multidiamond, [b.prodigal.faa for b in routed],
+                                    [b.name for b in routed], routingdir, db = db, ncores = ncores,
+                                    nsample = None, scratch = scratch, blocksize = blocksize, timeouts = timeouts)
+            for b in routed:
+                b.route_contigs(dmnd_r.vote_contigs(b.name), minproteins = routecontigs)
+
+        # prokaryotic bins keep their prodigal proteins and lineage, so they
+        # are done now
+        for b in binlst:
+            if b.kingdom in ["bacteria", "archaea"]:
+                with timings.stage("final", b.name):
+                    self.finish_bin(b, store)
+                if results:
+                    yield self.result(b)
 
         if anyeuks == False:
             logging.info("All bins are prokaryotes, we can skip the GeneMark-ES steps")
@@ -300,34 +605,43 @@ class metapygmes(pygmes):
             # we try GeneMark-ES in a two step mode
             modeldir = os.path.join(outdir, "gmes_models")
             create_dir(modeldir)
-            nmodels = 0
             logging.info("Running GeneMark-ES in self training")
-            for b in binlst:
-                if b.kingdom is None or b.kingdom == "eukaryote":
-                    # run self training
-                    b.gmes_training(ncores = ncores)
-                    expectedmodel = os.path.join(b.gmes.outdir, "output","gmhmm.mod")
-                    if os.path.exists(expectedmodel):
-                        shutil.copy(expectedmodel, os.path.join(modeldir, "{}.mod".format(b.name)))
-                        nmodels += 1
+            candidates = [b for b in binlst if b.kingdom is None or b.kingdom == "eukaryote"]
+            sched.run([b.job("selftraining", selftraining_task, routed = True, modeldir = modeldir,
+                             ncores = jobcores, triageargs = triageargs) for b in candidates])
+            trained = [b for b in candidates if os.path.exists(os.path.join(b.gmes.outdir, "output", "gmhmm.mod"))]
+            nmodels = len(trained)
             # check if any bins were not predicted, if so we can use the models
             # from other bins to get a better estimate
             # if thats not possible, we could still run pygmes in non metagenomic 
             # on each bin, but that should be decied by the user
-            if nmodels == 0:
+            # an incremental run also uses the models of the previous bins
+            if nmodels == 0 and len(glob(os.path.join(modeldir, "*.mod"))) == 0:
                 logging.debug("No models were successfully trained")
             else:
-                for b in binlst:
-                    if b.kingdom is None or b.kingdom == "eukaryote":
-                        if b.gmes.check_success() is False:
-                            b.gmes.premodel(modeldir)
-                            # if successfull, overwrite the gmes, with the successfull gmes
-                            if b.gmes.bestpremodel is not False and b.gmes.bestpremodel.check_success():
-                                b.gmes = b.gmes.bestpremodel
+                if clustermodels is not None:
+                    # models of larger bins are preferred as representatives
+                    trained.sort(key = lambda b: (-os.path.getsize(b.fasta), b.name))
+                    order = [os.path.join(modeldir, "{}.mod".format(b.name)) for b in trained]
+                    lineages = {m: b.first_lng_estimation['lng'] for m, b in zip(order, trained)
+                                if b.first_lng_estimation is not None}
+                    for m in sorted(glob(os.path.join(modeldir, "*.mod"))):
+                        if m not in order:
+                            order.append(m)
+                            name = os.path.basename(m)[:-len(".mod")]
+                            if previous is not None and name in previous["lngs"]:
+                                lineages[m] = previous["lngs"][name]['lng']
+                    modeldir = os.path.join(modeldir, "representatives")
+                    representative_models(os.path.dirname(modeldir), modeldir, method = clustermodels,
+                                          threshold = clusterthreshold, order = order, lineages = lineages)
+                sched.run([b.job("premodel", premodel_task, routed = True, modeldir = modeldir,
+                                 premodelargs = premodelargs) for b in binlst
+                           if (b.kingdom is None or b.kingdom == "eukaryote") and b.gmes.check_success() is False])
             # now we have proteins predicted for all
             # we can now give each bin the chance to merge prodigal and Gmes predictions
             for b in binlst:
-                b.make_hybrid_faa()
+                with timings.stage("hybrid", b.name):
+                    b.make_hybrid_faa()
 
             # now we update the lineages using the new proteins
             # and then we can create a final set of protein files
@@ -342,7 +656,9 @@ class metapygmes(pygmes):
                     proteinnames.append(name)
             if len(proteinfiles) > 0:
                 logging.info("Predicting the lineage using the results from GeneMark-ES")
-                dmnd_2 = multidiamond(proteinfiles, proteinnames, diamonddir, db = db, ncores = ncores)
+                with timings.stage("diamond_2", nbins = len(proteinfiles)):
+                    dmnd_2 = sched.call("diamond_2", multidiamond, proteinfiles, proteinnames, diamonddir, db = db,
+                                        ncores = ncores, scratch = scratch, blocksize = blocksize, timeouts = timeouts)
                 for b in binlst:
                     if b.name in dmnd_2.lngs.keys():
                         # as no lng was infered for this bin, we could try prodigal
@@ -353,98 +669,403 @@ class metapygmes(pygmes):
                             b.kingdom = "eukaryote"
                         elif 2157 in b.first_lng_estimation['lng']:
                             b.kingdom = "archaea"
+                        b.status["diamond_2"] = b.kingdom
             else:
                 logging.info("No changes after applying GeneMark-ES")
 
-        # now we can make a final FAA folder:
+        # all other bins are done now, before the aggregates are written
+        for b in binlst:
+            if b.name not in self.metadata:
+                with timings.stage("final", b.name):
+                    self.finish_bin(b, store)
+                if results:
+                    yield self.result(b)
+
+        with timings.stage("final"):
+            # now we can make a final FAA folder:
+            # in store mode the final files are kept in the bin folders until
+            # they have been written to the store
+            finaloutdir = os.path.join(self.outdir, "predicted_proteomes")
+            storefile = os.path.join(self.outdir, "pygmes.sqlite")
+            if not store:
+                create_dir(os.path.join(finaloutdir, "bed"))
+            # rows in the order of the bins
+            metadata = {b.name: self.metadata[b.name] for b in binlst}
+            lngs = {b.name: self.lngs[b.name] for b in binlst if b.name in self.lngs}
+            finalfaas = self.finalfaas
+            metadataf = os.path.join(self.outdir, "metadata.tsv")
+            lngfile = os.path.join(outdir, "lineages.tsv")
+            if previous is not None:
+                # keep the results of the bins that were not processed again
+                processed = set(metadata.keys())
+                keep = lambda name: name not in previous["drop"] and name not in processed
+                oldmetadata = read_metadata(metadataf)
+                metadata = {**{k: v for k, v in oldmetadata.items() if keep(k)}, **metadata}
+                lngs = {**{k: v for k, v in previous["lngs"].items() if keep(k)}, **lngs}
+            logging.debug("Copied files, now writing lineages")
+            write_lngs(lngs, lngfile)
+            # write metadata to disk
+            logging.debug("Writing metadata")
+            with open(metadataf, "w") as fout:
+                fout.write("\t".join(METADATA_KEYS))
+                fout.write("\n")
+                for k,v in metadata.items():
+                    l = []
+                    for key in METADATA_KEYS:
+                        l.append(str(v[key]))
+                    fout.write("\t".join(l))
+                    fout.write("\n")
+        
+            # make massive protein file for CAT:
+            catdir = os.path.join(outdir, "CAT")
+            create_dir(catdir)
+            catfaa = os.path.join(catdir, "cat.faa")
+            catfna = os.path.join(catdir, "cat.fna")
+            names = list(finalfaas.keys())
+            names.sort()
+            faas = [finalfaas[name]['faa'] for name in names]
+            fnas = [finalfaas[name]['fasta'] for name in names]
+            if previous is not None and os.path.exists(catfna) and os.path.exists(catfaa):
+                # update the aggregates in place: drop changed and removed bins
+                # and append the new results
+                if len(previous["drop"]) > 0:
+                    drop_bins(catfna, previous["drop"], previous["names"])
+                    drop_bins(catfaa, previous["drop"], previous["names"])
+                if len(names) > 0:
+                    single_fasta(fnas, names, catfna, mode = "a")
+                    single_fasta(faas, names, catfaa, mode = "a")
+            else:
+                single_fasta(fnas, names, catfna)
+                single_fasta(faas, names, catfaa)
+
+            if store:
+                logging.info("Writing results to %s" % storefile)
+                from pygmes.store import resultstore
+                with resultstore(storefile) as rs:
+                    for b in binlst:
+                        result = finalfaas.get(b.name, {})
+                        rs.add_bin(b.name, fasta=b.fasta, faa=result.get("faa"), bed=result.get("bed"),
+                                   software=b.software, nprot=metadata[b.name]['nprot'],
+                                   lng=lngs.get(b.name), status=b.status)
+                    for name in removed:
+                        rs.remove(name)
+                # the store holds everything needed, so the bin folders can go
+                if bindirs != os.path.join(outdir, "bins"):
+                    delete_folder(bindirs)
+                else:
+                    for b in binlst:
+                        delete_folder(b.outdir)
+            mf.update(inputs, removed)
+            mf.write()
+        recorder.summary()
+        logging.info("Successfully ran pygmes --meta")
+
+    def finish_bin(self, b, store):
+        """
+        copy the final proteins and bed of a bin that is done to
+        predicted_proteomes (or keep them in place for the store) and
+        collect its metadata and lineage
+        """
+        from pyfaidx import Fasta
         finaloutdir = os.path.join(self.outdir, "predicted_proteomes")
         finalbeddir = os.path.join(finaloutdir, "bed")
-        create_dir(finaloutdir)
-        create_dir(finalbeddir)
-        lngs = {}
-        metadataf = os.path.join(self.outdir, "metadata.tsv")
-        metadata = {}
-        finalfaas = {}
-        for b in binlst:
-            t =  os.path.join(finaloutdir, "{}.faa".format(b.name))
-            bt = os.path.join(finalbeddir, "{}.bed".format(b.name))
-            path, bedpath, name, software = b.get_best_faa()
-            b.software = software
-            metadata[b.name] = {"path": path, 
-                             "software": software, 
-                             "nprot": None,
-                             "lng": [],
-                             "name": b.name}
-            if path is not None:
+        storefile = os.path.join(self.outdir, "pygmes.sqlite")
+        t =  os.path.join(finaloutdir, "{}.faa".format(b.name))
+        bt = os.path.join(finalbeddir, "{}.bed".format(b.name))
+        path, bedpath, name, software = b.get_best_faa()
+        b.software = software
+        metadata = {"path": path,
+                    "software": software,
+                    "nprot": None,
+                    "lng": [],
+                    "name": b.name,
+                    "triage": "NA",
+                    "trainbp": "NA",
+                    "n50": "NA"}
+        self.metadata[b.name] = metadata
+        if b.triageinfo is not None:
+            metadata.update(b.triageinfo)
+        b.status["final"] = software
+        if path is not None:
+            if store:
+                t = path
+                bt = bedpath
+                metadata['path'] = "{}:{}".format(storefile, b.name)
+            else:
+                create_dir(finalbeddir)
                 shutil.copy(path, t)
                 shutil.copy(bedpath, bt)
-                metadata[b.name]['path'] = t
-                finalfaas[b.name] = {"faa": t, "fasta": b.fasta}
-                try:
-                    fa = Fasta(t)
-                    metadata[b.name]['nprot'] = len(fa.keys())
-                except Exception as e:
-                    print(e)
-                    metadata[b.name]['nprot'] = 0
-            if b.first_lng_estimation is not None:
-                lngs[b.name] = {}
-                lngs[b.name]['lng'] = b.first_lng_estimation['lng']
-                lngs[b.name]['n'] = b.first_lng_estimation['n']
-                metadata[b.name]['lng'] = "-".join([str(x) for x in b.first_lng_estimation['lng']])
-        logging.debug("Copied files, now writing lineages")
-        lngfile = os.path.join(outdir, "lineages.tsv")
-        write_lngs(lngs, lngfile)
-        # write metadata to disk
-        logging.debug("Writing metadata")
-        with open(metadataf, "w") as fout:
-            keys = ['name', "path", "software", "nprot", "lng"] 
-            fout.write("\t".join(keys))
-            fout.write("\n")
-            for k,v in metadata.items():
-                l = []
-                for key in keys:
-                    l.append(str(v[key]))
-                fout.write("\t".join(l))
-                fout.write("\n")
-        
-        # make a single file for CAT, including a prefix so CAT will not get confused
-        def single_fasta(fastas, names, output, sep = "_"):
-            if len(fastas) != len(names):
-                logging.warning("Number of Fastas does not match names")
-                exit(1)
-            nseqs = 0
-            with open (output, "w") as fout:
-                for fasta, name in zip(fastas, names):
-                    with open(fasta) as fin:
-                        for line in fin:
-                            if line.startswith(">"):
-                                line = line.strip().split()[0][1:]
-                                line = ">{}{}{}\n".format(name, sep, line)
-                                nseqs += 1
-                            fout.write(line)
-            if nseqs == 0:
-                logging.warning("No sequence in aggregate")
+                metadata['path'] = t
+            self.finalfaas[b.name] = {"faa": t, "bed": bt, "fasta": b.fasta}
+            try:
+                fa = Fasta(t)
+                metadata['nprot'] = len(fa.keys())
+            except Exception as e:
+                logging.warning("Could not index %s: %s" % (t, e))
+                metadata['nprot'] = 0
+        if b.first_lng_estimation is not None:
+            lng = {'lng': b.first_lng_estimation['lng'], 'n': b.first_lng_estimation['n']}
+            self.lngs[b.name] = lng
+            metadata['lng'] = "-".join([str(x) for x in lng['lng']])
+        events.emit("bin", bin = b.name, software = software, nprot = metadata['nprot'], lng = metadata['lng'])
+
+    def result(self, b):
+        """
+        results.binresult of a bin finish_bin is done with, read from its
+        final files
+        """
+        final = self.finalfaas.get(b.name, {})
+        lng = self.lngs.get(b.name)
+        return binresult(b.name, b.software, faa = final.get("faa"), bed = final.get("bed"),
+                         lineage = lng['lng'] if lng is not None else None,
+                         support = lng['n'] if lng is not None else 0,
+                         status = b.status, fasta = b.fasta)
+
+    def remove_outputs(self, name):
+        """
+        delete what an earlier run left of a bin, so it is processed again
+        """
+        for path in [os.path.join(self.outdir, "fasta_clean", name),
+                     os.path.join(self.outdir, "gmes_models", "{}.mod".format(name)),
+                     os.path.join(self.outdir, "predicted_proteomes", "{}.faa".format(name)),
+                     os.path.join(self.outdir, "predicted_proteomes", "{}.faa.fai".format(name)),
+                     os.path.join(self.outdir, "predicted_proteomes", "bed", "{}.bed".format(name))]:
+            if os.path.exists(path):
+                os.remove(path)
+        delete_folder(os.path.join(self.outdir, "bins", name))
+
+
+def read_metadata(path):
+    """
+    rows of a metadata.tsv by bin name
+    """
+    metadata = {}
+    if not os.path.exists(path):
+        return metadata
+    with open(path) as fin:
+        header = fin.readline().rstrip("\n").split("\t")
+        for line in fin:
+            row = dict(zip(header, line.rstrip("\n").split("\t")))
+            metadata[row['name']] = {key: row.get(key, "NA") for key in METADATA_KEYS}
+    return metadata
+
+
+def drop_bins(fasta, drop, known, sep = "_"):
+    """
+    remove the sequences of the bins in drop from a file written by
+    single_fasta. known are all bin names in the file, a sequence
+    belongs to the longest of them its name starts with
+    """
+    tmp = fasta + ".tmp"
+    keep = True
+    with open(fasta) as fin, open(tmp, "w") as fout:
+        for line in fin:
+            if line.startswith(">"):
+                owner = None
+                i = line.find(sep, 1)
+                while i != -1:
+                    if line[1:i] in known:
+                        owner = line[1:i]
+                    i = line.find(sep, i + 1)
+                keep = owner not in drop
+            if keep:
+                fout.write(line)
+    os.replace(tmp, fasta)
+
+
+def single_fasta(fastas, names, output, sep = "_", mode = "w"):
+    """
+    concatenate fastas into a single file for CAT, prefixing each
+    sequence name with the name of its file so CAT will not get confused
+    """
+    if len(fastas) != len(names):
+        raise PygmesError("Number of Fastas does not match names")
+    nseqs = 0
+    with open (output, mode) as fout:
+        for fasta, name in zip(fastas, names):
+            with open(fasta) as fin:
+                for line in fin:
+                    if line.startswith(">"):
+                        line = line.strip().split()[0][1:]
+                        line = ">{}{}{}\n".format(name, sep, line)
+                        nseqs += 1
+                    fout.write(line)
+    if nseqs == 0:
+        raise PygmesError("No sequence in aggregate")
+
+
+def predict_genome(fasta, outdir, db, **kwargs):
+    """
+    predict the proteins and lineage of a single genome. Takes the
+    options of pygmes and returns a results.binresult
+    """
+    return pygmes(fasta, outdir, db, **kwargs).result
+
+
+def predict_bins(bindir, outdir, db, **kwargs):
+    """
+    predict the proteins and lineages of all bins in bindir. Takes the
+    options of metapygmes and yields a results.binresult per bin as soon
+    as it is done
+    """
+    return metapygmes.iterate(bindir, outdir, db, **kwargs)
+
+
+def setup_logging(quiet = False, debug = False):
+    logLevel = logging.INFO
+    if quiet:
+        logLevel = logging.WARNING
+    elif debug:
+        logLevel = logging.DEBUG
+    logging.basicConfig(
+        format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %H:%M:%S: ", level=logLevel,
+    )
+
+
+def extract(argv):
+    """
+    pygmes extract: get single bins out of a result store
+    """
+    parser = argparse.ArgumentParser(prog="pygmes extract", description="Extract bins from a pygmes result store")
+    parser.add_argument("store", type=str, help="Path to the pygmes.sqlite file")
+    parser.add_argument("bins", type=str, nargs="*", help="Names of the bins to extract. All bins if none are given")
+    parser.add_argument("--output", "-o", type=str, default=".", help="Path to the output folder")
+    parser.add_argument("--list", "-l", dest="list", action="store_true", default=False,
+            help="List the bins in the store with their status and exit")
+    parser.add_argument("--quiet", "-q", dest="quiet", action="store_true", default=False, help="Silcence most output")
+    options = parser.parse_args(argv)
+    setup_logging(options.quiet)
+
+    from pygmes.store import resultstore
+    with resultstore(options.store, readonly=True) as rs:
+        names = options.bins if len(options.bins) > 0 else rs.names()
+        if options.list:
+            for name in names:
+                info = rs.get(name)
+                if info is None:
+                    continue
+                status = ",".join(["{}={}".format(k, v) for k, v in info['status'].items()])
+                print("{}\t{}\t{}\t{}".format(name, info['software'], info['nprot'], status))
+            return
+        for name in names:
+            if not rs.extract(name, options.output):
                 exit(1)
-        
-        # make massive protein file:
-        catdir = os.path.join(outdir, "CAT")
-        create_dir(catdir)
-        catfaa = os.path.join(catdir, "cat.faa")
-        catfna = os.path.join(catdir, "cat.fna")
-        names = list(finalfaas.keys())
-        names.sort()
-        faas = [finalfaas[name]['faa'] for name in names]
-        fnas = [finalfaas[name]['fasta'] for name in names]
-        single_fasta(fnas, names, catfna)
-        single_fasta(faas, names, catfaa)
+        logging.info("Extracted %d bins to %s" % (len(names), options.output))
+
+
+def models(argv):
+    """
+    pygmes models: manage the local repository of pretrained models
+    """
+    parser = argparse.ArgumentParser(prog="pygmes models", description="Manage the local model repository")
+    parser.add_argument("action", choices=["sync", "list"],
+            help="sync: fetch the model table and all models. list: show the models in the repository")
+    parser.add_argument("--repo", type=str, default=None,
+            help="Path to the local model repository (default: $PYGMES_MODELS or ~/.cache/pygmes/models)")
+    parser.add_argument("--source", type=str, default=None, help="URL or folder to fetch the models from")
+    parser.add_argument("--threads", "-t", type=int, default=8, help="Number of concurrent downloads")
+    parser.add_argument("--quiet", "-q", dest="quiet", action="store_true", default=False, help="Silcence most output")
+    options = parser.parse_args(argv)
+    setup_logging(options.quiet)
 
+    if options.action == "sync":
+        repo = modelrepo(options.repo, options.source, threads = options.threads)
+        repo.sync()
+    else:
+        repo = modelrepo(options.repo, options.source, offline = True)
+        infomap, quality = modelindex.parse_info(repo.info())
+        for name, lng in infomap.items():
+            state = "local" if repo.object(name) is not None else "missing"
+            print("{}\t{}\t{}".format(name, state, "-".join(lng)))
 
 
+def taxonomy_command(argv):
+    """
+    pygmes taxonomy: build a snapshot of the NCBI taxonomy
+    """
+    parser = argparse.ArgumentParser(prog="pygmes taxonomy", description="Manage the taxonomy snapshot")
+    parser.add_argument("action", choices=["build", "lineage"],
+            help="build: convert a NCBI taxdump into a snapshot. lineage: print the lineage of taxids")
+    parser.add_argument("args", nargs="*",
+            help="build: taxdump.tar.gz or folder with nodes.dmp, names.dmp and merged.dmp. lineage: taxids")
+    parser.add_argument("--output", "-o", type=str, default=None,
+            help="Folder of the snapshot (default: $PYGMES_TAXONOMY or ~/.cache/pygmes/taxonomy)")
+    parser.add_argument("--quiet", "-q", dest="quiet", action="store_true", default=False, help="Silcence most output")
+    options = parser.parse_args(argv)
+    setup_logging(options.quiet)
 
-        logging.info("Successfully ran pygmes --meta")
+    path = options.output
+    if path is None:
+        path = taxonomy.SNAPSHOT if taxonomy.SNAPSHOT is not None else taxonomy.DEFAULT_SNAPSHOT
+    if options.action == "build":
+        if len(options.args) != 1:
+            parser.error("build needs the path to the taxdump")
+        taxonomy.build(options.args[0], path)
+    else:
+        ncbi = taxonomy.snapshot(path)
+        for taxid in options.args:
+            try:
+                lng = ncbi.get_lineage(taxid)
+            except ValueError:
+                logging.warning("Taxid %s not found" % taxid)
+                continue
+            names = ncbi.get_taxid_translator(lng)
+            ranks = ncbi.get_rank(lng)
+            print("; ".join(["{} ({})".format(names.get(t, "unnamed"), ranks[t]) for t in lng]))
+
+
+def worker(argv):
+    """
+    pygmes worker: run the tasks of a distributed run
+    """
+    parser = argparse.ArgumentParser(prog="pygmes worker",
+            description="Run tasks of a distributed pygmes --meta --queue run, on any node that sees the queue")
+    parser.add_argument("queue", type=str, help="Path to the work queue given to --queue")
+    parser.add_argument("--slots", type=int, default=1,
+            help="Number of tasks to run at once, each uses the cores the coordinator chose (default: 1)")
+    parser.add_argument("--idle", type=float, default=None,
+            help="Exit after this many seconds without a task (default: wait until the run is done)")
+    parser.add_argument("--lease", type=float, default=None,
+            help="Seconds after which the task of a worker without heartbeat is given to another worker (default: 300)")
+    parser.add_argument("--max-jobs", dest="maxjobs", type=int, default=None,
+            help="Number of external tools that may run at the same time (default: no limit)")
+    parser.add_argument("--profile", type=str, default=None,
+            help="Profile the Python side of the tasks this worker runs into this folder")
+    parser.add_argument("--quiet", "-q", dest="quiet", action="store_true", default=False, help="Silcence most output")
+    options = parser.parse_args(argv)
+    setup_logging(options.quiet)
+
+    from pygmes.workqueue import workqueue, wait_for_queue, LEASE
+    from pygmes.workqueue import worker as queueworker
+    lease = options.lease if options.lease is not None else LEASE
+    # array jobs often start before the coordinator created the queue
+    if not os.path.exists(options.queue):
+        logging.info("Waiting up to %.0fs for the coordinator to create %s" % (lease, options.queue))
+    if not wait_for_queue(options.queue, lease):
+        logging.warning("Work queue %s was not created within %.0fs" % (options.queue, lease))
+        exit(1)
+    if options.maxjobs is not None:
+        jobs.shared().limit(options.maxjobs)
+    queue = workqueue(options.queue, lease = lease)
+    if options.profile is not None:
+        profiling.configure(options.profile)
+    try:
+        queueworker(queue, slots = options.slots, idle = options.idle).run()
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, stopping all running tools")
+        jobs.shared().cancel()
+        sys.exit(130)
+    finally:
+        profiling.finish()
+
+
+# subcommands have their own parsers, everything else is a prediction run
+subcommands = {"extract": extract, "models": models, "taxonomy": taxonomy_command, "worker": worker}
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        return subcommands[sys.argv[1]](sys.argv[2:])
     parser = argparse.ArgumentParser(description="Evaluate completeness and contamination of a MAG.")
     parser.add_argument("--input", "-i", type=str, help="path to the fasta file, or in metagenome mode path to bin folder")
     parser.add_argument("--output", "-o", type=str, required=True, help="Path to the output folder")
@@ -453,6 +1074,66 @@ def main():
     parser.add_argument("--ncores", "-n", type=int, required=False, default = 1,
             help="Number of threads to use with GeneMark-ES and Diamond")
     parser.add_argument("--meta", dest="meta", action = "store_true", default=False, help = "Run in metaegnomic mode")
+    parser.add_argument("--premodel-topk", dest="topk", type=int, default=None,
+            help = "Rank the pretrained or bin models by trinucleotide composition and only predict with the k closest")
+    parser.add_argument("--premodel-score", dest="score", choices=["aa", "genes", "density"], default="aa",
+            help = "Score to choose the best pretrained or bin model: amino acids, number of genes or coding density (default: aa)")
+    parser.add_argument("--tournament", dest="tournament", type=int, default=None,
+            help = "Run all candidate models on a subsample of the contigs first and only this number of finalists on the full genome")
+    parser.add_argument("--tournament-bp", dest="tournamentbp", type=int, default=2000000,
+            help = "Size of the tournament subsample in bp (default: 2000000)")
+    parser.add_argument("--tournament-validate", dest="tournamentvalidate", action="store_true", default=False,
+            help = "Still run all models on the full genome and report if the tournament chose the same model")
+    parser.add_argument("--cluster-models", dest="clustermodels", choices=["markov", "lineage"], default=None,
+            help = "In metagenomic mode cluster the self trained models by their hexamer tables (markov) or by the lineage of their bins and use one model per cluster")
+    parser.add_argument("--cluster-threshold", dest="clusterthreshold", type=float, default=0.15,
+            help = "Maximal L1 distance of the hexamer tables of models in the same cluster (default: 0.15)")
+    parser.add_argument("--triage", dest="triage", action = "store_true", default=False,
+            help = "In metagenomic mode skip the GeneMark-ES self-training for bins with too little sequence in contigs >= 5 kb")
+    parser.add_argument("--triage-min-bp", dest="triageminbp", type=int, default=1000000,
+            help = "Minimal bp in contigs >= 5 kb to attempt self-training (default: 1000000)")
+    parser.add_argument("--triage-min-n50", dest="triageminn50", type=int, default=2000,
+            help = "Minimal N50 to attempt self-training (default: 2000)")
+    parser.add_argument("--contig-routing", dest="routecontigs", type=int, nargs="?", const=2, default=None,
+            help = "In metagenomic mode run GeneMark-ES only on contigs of a bin that are not clearly prokaryotic. Optionally the number of proteins needed to call a contig prokaryotic (default: 2)")
+    parser.add_argument("--incremental", dest="incremental", action = "store_true", default=False,
+            help = "In metagenomic mode only process bins that are new or changed since the last run into the output folder and update its results")
+    parser.add_argument("--queue", dest="queue", type=str, default=None,
+            help = "In metagenomic mode put the work into a queue file on a shared file system and let 'pygmes worker <queue>' processes on any node run it")
+    parser.add_argument("--jobcores", dest="jobcores", type=int, default=None,
+            help = "In metagenomic mode use this many cores per GeneMark-ES job and run ncores/jobcores bins in parallel, largest first (default: ncores)")
+    parser.add_argument("--cost-history", dest="costhistory", type=str, default=None,
+            help = "Timings of previous runs used to predict the runtime of each bin, new timings are appended (default: outdir/timings.jsonl)")
+    parser.add_argument("--max-memory", dest="maxmemory", type=float, default=None,
+            help = "In metagenomic mode only start bins whose predicted peak memory fits into this many GB, also limits the Diamond block size (default: no limit)")
+    parser.add_argument("--max-jobs", dest="maxjobs", type=int, default=None,
+            help = "Number of external tools that may run at the same time (default: no limit)")
+    parser.add_argument("--timeout", dest="timeouts", action="append", default=None, metavar="STAGE=DURATION",
+            help = "Wall clock budget of a tool (stages: selftraining, prediction, prodigal, diamond), e.g. selftraining=4h. Can be given several times")
+    parser.add_argument("--timeout-per-mb", dest="timeoutspermb", action="append", default=None, metavar="STAGE=DURATION",
+            help = "Budget added per Mb of input sequence, e.g. selftraining=10m")
+    parser.add_argument("--models-repo", dest="modelsrepo", type=str, default=None,
+            help = "Local repository of pretrained models (default: $PYGMES_MODELS or ~/.cache/pygmes/models). Fill it with 'pygmes models sync'")
+    parser.add_argument("--models-source", dest="modelssource", type=str, default=None,
+            help = "URL or folder to fetch models missing in the local repository from")
+    parser.add_argument("--offline", dest="offline", action = "store_true", default=False,
+            help = "Never use the network, only models in the local repository are used")
+    parser.add_argument("--taxdb", dest="taxdb", type=str, default=None,
+            help = "NCBI taxonomy database of ete3 (taxa.sqlite) to use (default: $PYGMES_TAXDB or the ete3 default)")
+    parser.add_argument("--taxonomy", dest="taxonomy", type=str, default=None,
+            help = "Taxonomy snapshot made with 'pygmes taxonomy build' to use instead of ete3 (default: $PYGMES_TAXONOMY or ~/.cache/pygmes/taxonomy if it exists and --taxdb is not given)")
+    parser.add_argument("--scratch", type=str, required=False, default = None,
+            help = "Node local folder (tmpfs/SSD) to run GeneMark-ES, Prodigal and Diamond in. Only the needed files are moved to the output folder")
+    parser.add_argument("--profile", dest="profile", action = "store_true", default=False,
+            help = "Profile the Python side of every stage: one cProfile file per stage (CPU time only) and sampled stacks for flame graphs in outdir/profile")
+    parser.add_argument("--events", dest="events", type=str, default=None,
+            help = "Write stage, queue and bin events as JSON lines to this file, or to a listening UNIX socket given as unix:<path>")
+    parser.add_argument("--metrics", dest="metrics", type=str, default=None,
+            help = "Keep the progress of the run in this Prometheus textfile collector file (.prom)")
+    parser.add_argument("--metrics-interval", dest="metricsinterval", type=float, default=15.0,
+            help = "Seconds between two updates of the metrics file (default: 15)")
+    parser.add_argument("--store", dest="store", action = "store_true", default=False,
+            help = "In metagenomic mode write all final results into a single SQLite file (pygmes.sqlite) instead of per bin files. Use 'pygmes extract' to get single bins")
     parser.add_argument(
         "--quiet", "-q", dest="quiet", action="store_true", default=False, help="Silcence most output",
     )
@@ -463,14 +1144,7 @@ def main():
     options = parser.parse_args()
 
     # define logging
-    logLevel = logging.INFO
-    if options.quiet:
-        logLevel = logging.WARNING
-    elif options.debug:
-        logLevel = logging.DEBUG
-    logging.basicConfig(
-        format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %H:%M:%S: ", level=logLevel,
-    )
+    setup_logging(options.quiet, options.debug)
 
     # check if input is readable
     if not os.path.exists(options.input):
@@ -480,10 +1154,65 @@ def main():
     logging.debug("Using fasta: %s" % options.input)
     logging.debug("Using %d threads" % options.ncores)
 
-    if not options.meta:
-        pygmes(options.input, options.output, options.db, clean = options.noclean,
-            ncores = options.ncores)
-    else:
-        metapygmes(options.input, options.output, options.db, clean = options.noclean,
-            ncores = options.ncores)
+    premodelargs = {"topk": options.topk,
+                    "tournament": options.tournament,
+                    "tournament_bp": options.tournamentbp,
+                    "validate": options.tournamentvalidate,
+                    "score": options.score}
+    try:
+        budgets = jobs.timeouts.from_options(options.timeouts, options.timeoutspermb)
+    except ValueError as e:
+        parser.error(str(e))
+    if options.maxjobs is not None:
+        jobs.shared().limit(options.maxjobs)
+    if options.taxdb is not None:
+        taxonomy.set_dbfile(options.taxdb)
+    if options.taxonomy is not None:
+        taxonomy.set_snapshot(options.taxonomy)
+    triageargs = None
+    if options.triage:
+        triageargs = {"min_bp": options.triageminbp, "min_n50": options.triageminn50}
+    queue = None
+    if options.queue is not None:
+        if not options.meta:
+            parser.error("--queue needs --meta")
+        from pygmes.workqueue import workqueue
+        queue = workqueue(options.queue)
+        # workers take the taxonomy from the coordinator
+        queue.reset({"taxdb": taxonomy.DBFILE, "taxonomy": taxonomy.snapshot_path()})
+        logging.info("Waiting for 'pygmes worker %s' processes to run the tasks" % queue.path)
+    if options.profile:
+        profiling.configure(os.path.join(options.output, "profile"))
+    if options.events is not None or options.metrics is not None:
+        try:
+            events.configure(options.events, options.metrics, options.metricsinterval)
+        except OSError as e:
+            parser.error("Could not open the event stream: %s" % e)
+    try:
+        if not options.meta:
+            repo = modelrepo(options.modelsrepo, options.modelssource, offline = options.offline)
+            pygmes(options.input, options.output, options.db, clean = options.noclean,
+                ncores = options.ncores, scratch = options.scratch, repo = repo, premodelargs = premodelargs,
+                timeouts = budgets)
+        else:
+            metapygmes(options.input, options.output, options.db, clean = options.noclean,
+                ncores = options.ncores, store = options.store, scratch = options.scratch,
+                premodelargs = premodelargs, clustermodels = options.clustermodels,
+                clusterthreshold = options.clusterthreshold, triageargs = triageargs,
+                routecontigs = options.routecontigs, jobcores = options.jobcores,
+                costhistory = options.costhistory, maxmemory = options.maxmemory, timeouts = budgets,
+                incremental = options.incremental, queue = queue)
+    except PygmesError as e:
+        logging.error(str(e))
+        exit(1)
+    except KeyboardInterrupt:
+        # stop the tools still running for other bins
+        logging.warning("Interrupted, stopping all running tools")
+        jobs.shared().cancel()
+        sys.exit(130)
+    finally:
+        events.finish()
+        profiling.finish()
+        if queue is not None:
+            queue.close()
 
@@ -0,0 +1,219 @@
+import os
+import json
+import gzip
+import logging
+import threading
+import hashlib
+from itertools import product
+from collections import Counter
+
+# all trinucleotides, the order of every profile vector
+KMERS = ["".join(p) for p in product("ACGT", repeat=3)]
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+def revcomp(s):
+    return s.translate(COMPLEMENT)[::-1]
+
+
+def read_fasta(fasta):
+    """
+    yield name, sequence of each record. Sequences are upper case
+    """
+    openMethod = gzip.open if fasta.endswith(".gz") else open
+    name = None
+    seq = []
+    with openMethod(fasta, "rt") as f:
+        for line in f:
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq).upper()
+                name = line[1:].strip().split()[0]
+                seq = []
+            else:
+                seq.append(line.strip())
+    if name is not None:
+        yield name, "".join(seq).upper()
+
+
+def contig_lengths(fasta):
+    """
+    dict of contig name to length
+    """
+    lengths = {}
+    openMethod = gzip.open if fasta.endswith(".gz") else open
+    name = None
+    with openMethod(fasta, "rt") as f:
+        for line in f:
+            if line.startswith(">"):
+                name = line[1:].strip().split()[0]
+                lengths[name] = 0
+            elif name is not None:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def normalize(counts):
+    """
+    strand symmetric trinucleotide frequencies from a dict of counts
+    """
+    sym = [counts.get(k, 0) + counts.get(revcomp(k), 0) for k in KMERS]
+    total = sum(sym)
+    if total == 0:
+        return [0.0] * len(KMERS)
+    return [v / total for v in sym]
+
+
+def gc(profile):
+    # GC of a profile is the GC of the middle base of all trinucleotides
+    return sum(p for k, p in zip(KMERS, profile) if k[1] in "GC")
+
+
+def sequence_profile(fasta, maxbp=5000000, window=10000):
+    """
+    trinucleotide profile of a genome. For large genomes evenly spaced
+    windows adding up to about maxbp are used
+    """
+    total = sum(contig_lengths(fasta).values())
+    stride = max(1, total // maxbp)
+    counts = Counter()
+    i = 0
+    for name, seq in read_fasta(fasta):
+        for start in range(0, len(seq), window):
+            i += 1
+            if i % stride != 0:
+                continue
+            w = seq[start:start + window]
+            counts.update(map("".join, zip(w, w[1:], w[2:])))
+    return normalize(counts)
+
+
+def read_markov(modfile):
+    """
+    the $MARKOV block of a GeneMark model: dict of hexamer to the
+    probabilities in the three coding phases and the non coding state
+    """
+    markov = {}
+    with open(modfile) as f:
+        inblock = False
+        for line in f:
+            if line.startswith("$"):
+                if inblock:
+                    break
+                inblock = line.strip() == "$MARKOV"
+                continue
+            if inblock:
+                l = line.split()
+                if len(l) >= 5:
+                    markov[l[0]] = [float(x) for x in l[1:5]]
+    return markov
+
+
+def model_profile(modfile):
+    """
+    expected trinucleotide profile of a genome the model was trained on,
+    from the coding and non coding hexamer frequencies
+    """
+    counts = Counter()
+    for hexamer, p in read_markov(modfile).items():
+        # average of the coding phases and the non coding state
+        counts[hexamer[:3]] += (p[0] + p[1] + p[2]) / 3 + p[3]
+    return normalize(counts)
+
+
+def distance(p1, p2):
+    return sum(abs(a - b) for a, b in zip(p1, p2))
+
+
+def model_profiles(modelfiles, cachedir=None):
+    """
+    profiles of all model files. Profiles are cached in profiles.json in
+    cachedir (by default the folder of the models) by checksum of the model
+    """
+    if len(modelfiles) == 0:
+        return {}
+    if cachedir is None:
+        cachedir = os.path.dirname(modelfiles[0])
+    cachefile = os.path.join(cachedir, "profiles.json")
+    cache = {}
+    if os.path.exists(cachefile):
+        try:
+            with open(cachefile) as fin:
+                cache = json.load(fin)
+        except ValueError:
+            cache = {}
+    profiles = {}
+    changed = False
+    for modfile in modelfiles:
+        with open(modfile, "rb") as fin:
+            digest = hashlib.sha1(fin.read()).hexdigest()
+        if digest not in cache:
+            cache[digest] = model_profile(modfile)
+            changed = True
+        profiles[modfile] = cache[digest]
+    if changed:
+        try:
+            tmp = "{}.{}.{}".format(cachefile, os.getpid(), threading.get_ident())
+            with open(tmp, "w") as fout:
+                json.dump(cache, fout)
+            os.replace(tmp, cachefile)
+        except OSError as e:
+            logging.debug("Could not cache model profiles: %s" % e)
+    return profiles
+
+
+def rank_models(fasta, modelfiles, cachedir=None):
+    """
+    rank model files by the distance of their profile to the
+    profile of the genome. Returns a sorted list of
+    (distance, gc of the model, model file) and the gc of the genome
+    """
+    profile = sequence_profile(fasta)
+    ranking = []
+    for modfile, mprofile in model_profiles(modelfiles, cachedir).items():
+        ranking.append((distance(profile, mprofile), gc(mprofile), modfile))
+    ranking.sort()
+    return ranking, gc(profile)
+
+
+def stratified_subsample(fasta, output, maxbp=2000000, strata=5):
+    """
+    write a subsample of the contigs of fasta to output. Contigs are
+    split into length strata and taken alternately from each stratum,
+    evenly spaced within it, until maxbp is reached.
+    Returns the number of bp written
+    """
+    lengths = contig_lengths(fasta)
+    names = sorted(lengths.keys(), key=lambda n: (lengths[n], n))
+    size = max(1, -(-len(names) // strata))
+    groups = [names[i:i + size] for i in range(0, len(names), size)]
+
+    # order each stratum so that the first picks are spread over it
+    def spread(group):
+        order = []
+        seen = set()
+        step = len(group)
+        while step >= 1:
+            for i in range(0, len(group), step):
+                if i not in seen:
+                    seen.add(i)
+                    order.append(group[i])
+            step = step // 2
+        return order
+
+    queues = [spread(g)[::-1] for g in groups]
+    chosen = set()
+    total = 0
+    while total < maxbp and any(queues):
+        for queue in queues:
+            if len(queue) > 0 and total < maxbp:
+                name = queue.pop()
+                chosen.add(name)
+                total += lengths[name]
+    with open(output, "w") as fout:
+        for name, seq in read_fasta(fasta):
+            if name in chosen:
+                fout.write(">{}\n".format(name))
+                for i in range(0, len(seq), 60):
+                    fout.write("{}\n".format(seq[i:i + 60]))
+    return total
@@ -1,10 +1,11 @@
 import logging
 import os
 import subprocess
-from pyfaidx import Fasta
+from pygmes import jobs
 from random import sample
 from collections import defaultdict
-from ete3 import NCBITaxa
+from pygmes.taxonomy import get_ncbi
+from pygmes.scratch import staging
 
 
 
@@ -37,12 +38,30 @@ def majorityvote(lngs, fraction=0.6):
     return lng
 
 
+def diamond_blocksize(maxmemory):
+    """
+    largest Diamond block size (billions of letters) for a memory budget
+    in bytes. Diamond uses about 6 GB per unit of block size, None keeps
+    the Diamond default
+    """
+    if maxmemory is None:
+        return None
+    blocksize = round(maxmemory / 6e9, 1)
+    if blocksize >= 2.0:
+        return None
+    return max(0.1, blocksize)
+
+
 class diamond:
-    def __init__(self, faa, outdir, db, ncores=1, sample=100):
+    def __init__(self, faa, outdir, db, ncores=1, sample=100, scratch=None, blocksize=None, timeouts=None):
         self.faa = faa
         self.outdir = outdir
         self.db = db
         self.ncores = ncores
+        self.scratch = scratch
+        # diamond needs about 6 GB per billion letters of block size
+        self.blocksize = blocksize
+        self.timeouts = timeouts if timeouts is not None else jobs.timeouts()
         self.outfile = os.path.join(self.outdir, "diamond.results.tsv")
         self.log = os.path.join(self.outdir, "diamond.log")
         self.lineages = {}
@@ -62,37 +81,52 @@ class diamond:
         logging.debug("Inferring the lineage")
         proteinlngs = self.lineage_infer_protein(self.result)
         self.lineage  = self.vote_bin(proteinlngs)
+        # number of proteins the lineage was voted from
+        self.support = len(proteinlngs)
         logging.debug("Finished the diamond step")
 
     def search(self, outfile, query):
         if not os.path.exists(outfile) or os.stat(outfile).st_size == 0:
             logging.info("Running diamond now")
-            lst = [
-                "diamond",
-                "blastp",
-                "--db",
-                self.db,
-                "-q",
-                query,
-                "-p",
-                str(self.ncores),
-                "--evalue",
-                str(1e-20),
-                "--max-target-seqs",
-                "3",
-                "--outfmt",
-                "6",
-                "qseqid",
-                "sseqid",
-                "pident",
-                "evalue",
-                "bitscore",
-                "staxids",
-                "-o",
-                outfile,
-            ]
-            with open(self.log , "w") as fout:
-                subprocess.run(lst, stderr = fout, stdout = fout)
+            name = os.path.basename(outfile)
+            with open(self.log , "w") as fout, \
+                    staging(os.path.dirname(outfile), self.scratch, [name]) as workdir:
+                lst = [
+                    "diamond",
+                    "blastp",
+                    "--db",
+                    self.db,
+                    "-q",
+                    query,
+                    "-p",
+                    str(self.ncores),
+                    "--evalue",
+                    str(1e-20),
+                    "--max-target-seqs",
+                    "3",
+                    "--outfmt",
+                    "6",
+                    "qseqid",
+                    "sseqid",
+                    "pident",
+                    "evalue",
+                    "bitscore",
+                    "staxids",
+                    "-o",
+                    os.path.join(workdir, name),
+                ]
+                if self.scratch is not None:
+                    lst.extend(["--tmpdir", workdir])
+                if self.blocksize is not None:
+                    lst.extend(["--block-size", str(self.blocksize)])
+                try:
+                    jobs.run(lst, log = fout,
+                             timeout = self.timeouts.get("diamond", query))
+                except subprocess.TimeoutExpired:
+                    # no hits, the bins keep the lineage they have
+                    logging.warning("Diamond timed out, no lineages are assigned from this search")
+                    with open(os.path.join(workdir, name), "w"):
+                        pass
             logging.debug("Ran diamond")
         else:
             logging.info("Diamond output already exists ")
@@ -100,6 +134,7 @@ class diamond:
 
     def sample(self, output, n=200):
         logging.debug("Sampeling %d proteins from %s" % (n, self.faa))
+        from pyfaidx import Fasta
         try:
             faa = Fasta(self.faa)
         except ZeroDivisionError:
@@ -111,7 +146,7 @@ class diamond:
 
         keys = faa.keys()
         if len(keys) > n:
-            keys = sample(keys, n)
+            keys = sample(list(keys), n)
         with open(output, "a") as fout:
             for k in keys:
                 fout.write(f">{k}\n{str(faa[k])}\n")
@@ -128,12 +163,12 @@ class diamond:
         if tax in self.lineages.keys():
             return self.lineages[tax]
         else:
-            ncbi = NCBITaxa()
+            ncbi = get_ncbi()
             try:
                 self.lineages[tax] = ncbi.get_lineage(tax)
                 return self.lineages[tax]
             except ValueError:
-                print(f"Not able to fetch lineage for taxid {tax}")
+                logging.warning(f"Not able to fetch lineage for taxid {tax}")
                 return []
 
     def lineage_infer_protein(self, result):
@@ -153,9 +188,22 @@ class diamond:
         return majorityvote(lngs)
 
     
+def hitlist():
+    # module level, so parsed results can be pickled for the work queue
+    return defaultdict(list)
+
+
 class multidiamond(diamond):
-    def __init__(self,proteinfiles, names, outdir, db, ncores = 1, nsample = 200):
+    """
+    Pooled search of the proteins of many bins. nsample proteins of each
+    bin are searched, all of them if nsample is None
+    """
+    def __init__(self,proteinfiles, names, outdir, db, ncores = 1, nsample = 200, scratch = None, blocksize = None,
+                 timeouts = None):
         self.outdir = os.path.abspath(outdir)
+        self.scratch = scratch
+        self.blocksize = blocksize
+        self.timeouts = timeouts if timeouts is not None else jobs.timeouts()
         self.files = proteinfiles
         self.names = names
         self.samplefile = os.path.join(outdir, "samplefile.faa")
@@ -170,7 +218,7 @@ class multidiamond(diamond):
         with open(self.samplefile, "w") as f:
             f.write("")
         for fasta, name in zip(self.files, self.names):
-            self.sample(fasta, name, self.samplefile)
+            self.sample(fasta, name, self.samplefile, n = nsample)
         
         # then run 
         self.search(self.outfile, self.samplefile)
@@ -178,7 +226,8 @@ class multidiamond(diamond):
         self.lngs = self.vote_bins(self.result)
 
     def sample(self, fasta, name, output, n=200):
-        logging.debug("Sampeling %d proteins from %s" % (n, fasta))
+        logging.debug("Sampeling %s proteins from %s" % (n if n is not None else "all", fasta))
+        from pyfaidx import Fasta
         try:
             faa = Fasta(fasta)
         except ZeroDivisionError:
@@ -189,16 +238,14 @@ class multidiamond(diamond):
             return 0
 
         keys = faa.keys()
-        if len(keys) > n:
-            keys = sample(keys, n)
+        if n is not None and len(keys) > n:
+            keys = sample(list(keys), n)
         with open(output, "a") as fout:
             for k in keys:
                 fout.write(f">{name}_binseperator_{k}\n{str(faa[k])}\n")
     
     def parse_results(self, result):
-        def subdict():
-            return(defaultdict(list))
-        r = defaultdict(subdict)
+        r = defaultdict(hitlist)
         with open(result) as f:
             for line in f:
                 l = line.strip().split("\t")
@@ -218,3 +265,18 @@ class multidiamond(diamond):
             lngs[bin]["n"] = len(protlng)
 
         return(lngs)
+
+    def vote_contigs(self, binname):
+        """
+        lineage of each contig of a bin, voted from the proteins of the
+        contig found in the search. Protein names are contig_ORFNUMBER.
+        Only useful if the search was not sampled (nsample None)
+        """
+        protlng = self.lineage_infer_protein(self.result.get(binname, {}))
+        bycontig = defaultdict(list)
+        for protein, lng in protlng.items():
+            bycontig[protein.rsplit("_", 1)[0]].append(lng)
+        lngs = {}
+        for contig, plngs in bycontig.items():
+            lngs[contig] = {"lng": majorityvote(plngs), "n": len(plngs)}
+        return lngs
@@ -0,0 +1,265 @@
+"""
+Live progress of a run for operators. Every stage start and finish, the
+state of the job queues and each finished bin is written as one JSON
+line, either to a file or to a UNIX socket another process listens on
+(unix:<path>). Events are handed to a writer thread through a bounded
+queue, so a slow or stuck listener never holds up the run: its events are
+dropped instead. Optionally the state of the run is also written as
+Prometheus metrics for the textfile collector of node_exporter, renewed
+every interval seconds, so a stalled run can raise an alert.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from queue import Queue, Full, Empty
+from collections import defaultdict
+
+_log = None
+# events waiting for the writer
+BACKLOG = 10000
+# seconds a send to the socket may block before the listener is dropped
+SENDTIMEOUT = 5.0
+
+
+class eventlog:
+    """
+    Writes the events of a run and keeps the state the metrics are made of.
+
+    Parameters:
+
+    **path:** JSON lines file the events are appended to, unix:<path> of a listening socket or None for metrics only
+
+    **metrics:** .prom file for the textfile collector, None for no metrics
+
+    **interval:** seconds between two updates of the metrics file
+    """
+    def __init__(self, path, metrics=None, interval=15.0):
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last = self.started
+        self.sock = None
+        self.out = None
+        self.bins = 0
+        self.done = 0
+        self.failed = 0
+        # start times of the running stages by (stage, bin)
+        self.running = defaultdict(list)
+        self.stageseconds = defaultdict(float)
+        self.stagecount = defaultdict(int)
+        # latest queue state by scheduler
+        self.jobs = {}
+        self.closed = threading.Event()
+        self.ended = False
+        self.writer = None
+        self.lines = Queue(BACKLOG)
+        self.sender = None
+        self.dropped = 0
+
+    def open(self):
+        if self.path is not None and self.path.startswith("unix:"):
+            import socket
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.path[len("unix:"):])
+            self.sock.settimeout(SENDTIMEOUT)
+        elif self.path is not None:
+            self.out = open(self.path, "a", buffering=1)
+        if self.sock is not None or self.out is not None:
+            self.sender = threading.Thread(target=self.send, name="pygmes-events", daemon=True)
+            self.sender.start()
+        if self.metrics is not None:
+            self.writer = threading.Thread(target=self.update, name="pygmes-metrics", daemon=True)
+            self.writer.start()
+        return self
+
+    def emit(self, event, **fields):
+        now = time.time()
+        fields["time"] = round(now, 3)
+        fields["event"] = event
+        line = json.dumps(fields) + "\n"
+        with self.lock:
+            self.last = now
+            self.track(event, fields)
+        if self.sender is None:
+            return
+        # called from the scheduler and all stage threads, so never block
+        try:
+            self.lines.put_nowait(line)
+        except Full:
+            with self.lock:
+                self.dropped += 1
+                warn = self.dropped == 1
+            if warn:
+                logging.warning("Events are written slower than they come, dropping events for %s" % self.path)
+
+    def send(self):
+        """
+        write the queued events until close puts None
+        """
+        while True:
+            line = self.lines.get()
+            if line is None:
+                return
+            if self.sock is None and self.out is None:
+                continue
+            try:
+                if self.sock is not None:
+                    self.sock.sendall(line.encode())
+                else:
+                    self.out.write(line)
+            except OSError as e:
+                # includes a listener that stopped reading (socket.timeout),
+                # the run goes on without events
+                logging.warning("Could not send events to %s, stopping them: %s" % (self.path, e))
+                self.closeoutputs()
+
+    def closeoutputs(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+    def track(self, event, fields):
+        key = (fields.get("stage"), fields.get("bin"))
+        if event == "start":
+            self.running[key].append(fields["time"])
+        elif event == "finish":
+            if len(self.running[key]) > 0:
+                self.running[key].pop(0)
+            if len(self.running[key]) == 0:
+                del self.running[key]
+            self.stageseconds[key[0]] += fields.get("wall", 0.0)
+            self.stagecount[key[0]] += 1
+        elif event == "run":
+            self.bins += fields.get("bins", 0)
+        elif event == "bin":
+            self.done += 1
+            if fields.get("software") is None:
+                self.failed += 1
+        elif event == "jobs":
+            self.jobs[fields.get("stage")] = fields
+
+    def eta(self, now):
+        """
+        seconds until all bins are done at the rate bins finished so far
+        """
+        if self.done == 0 or self.bins <= self.done:
+            return None
+        return (now - self.started) / self.done * (self.bins - self.done)
+
+    def prometheus(self):
+        now = time.time()
+        lines = []
+
+        def metric(name, kind, helptext, values):
+            lines.append("# HELP pygmes_{} {}".format(name, helptext))
+            lines.append("# TYPE pygmes_{} {}".format(name, kind))
+            for labels, value in values:
+                lbl = ",".join(['{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels])
+                lines.append("pygmes_{}{} {}".format(name, "{" + lbl + "}" if lbl else "", value))
+
+        with self.lock:
+            running = defaultdict(int)
+            oldest = 0.0
+            for (stage, binname), starts in self.running.items():
+                running[stage] += len(starts)
+                oldest = max(oldest, now - min(starts))
+            queued = sum([j.get("queued", 0) for j in self.jobs.values()])
+            jobsrunning = sum([j.get("running", 0) for j in self.jobs.values()])
+            cores = sum([j.get("cores", 0) for j in self.jobs.values()])
+            metric("up", "gauge", "1 while the run goes on, 0 once it ended", [([], 0 if self.ended else 1)])
+            metric("start_time_seconds", "gauge", "Start of the run", [([], round(self.started, 3))])
+            metric("last_event_time_seconds", "gauge", "Time of the latest event", [([], round(self.last, 3))])
+            metric("bins", "gauge", "Bins of the run", [([], self.bins)])
+            metric("bins_done", "gauge", "Bins with final results", [([], self.done)])
+            metric("bins_failed", "gauge", "Bins without proteins", [([], self.failed)])
+            eta = self.eta(now)
+            if eta is not None:
+                metric("eta_seconds", "gauge", "Estimated seconds until all bins are done", [([], round(eta, 1))])
+            metric("stages_running", "gauge", "Stages running now",
+                   [([("stage", s)], n) for s, n in sorted(running.items())])
+            metric("oldest_running_stage_seconds", "gauge", "Age of the longest running stage", [([], round(oldest, 1))])
+            # one series per running stage, bounded by the number of jobs that run at once
+            metric("running_stage_seconds", "gauge", "Age of each running stage of a bin",
+                   [([("stage", stage), ("bin", binname)], round(now - min(starts), 1))
+                    for (stage, binname), starts in sorted(self.running.items()) if binname is not None])
+            metric("stage_seconds_total", "counter", "Wall seconds of finished stages",
+                   [([("stage", s)], round(w, 3)) for s, w in sorted(self.stageseconds.items())])
+            metric("stages_total", "counter", "Finished stages",
+                   [([("stage", s)], n) for s, n in sorted(self.stagecount.items())])
+            metric("jobs_queued", "gauge", "Jobs waiting to start", [([], queued)])
+            metric("jobs_running", "gauge", "Jobs running", [([], jobsrunning)])
+            metric("cores_in_use", "gauge", "Cores given to running jobs", [([], cores)])
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        # the collector must never see a half written file
+        tmp = "{}.{}.tmp".format(self.metrics, os.getpid())
+        with open(tmp, "w") as fout:
+            fout.write(self.prometheus())
+        os.replace(tmp, self.metrics)
+
+    def update(self):
+        while True:
+            try:
+                self.write_metrics()
+            except OSError as e:
+                logging.debug("Could not write metrics to %s: %s" % (self.metrics, e))
+            if self.closed.wait(self.interval):
+                return
+
+    def close(self):
+        self.ended = True
+        self.closed.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.write_metrics()
+        if self.sender is not None:
+            # make room for the end marker if the listener is stuck
+            while True:
+                try:
+                    self.lines.put_nowait(None)
+                    break
+                except Full:
+                    try:
+                        self.lines.get_nowait()
+                    except Empty:
+                        pass
+            self.sender.join()
+        self.closeoutputs()
+        if self.dropped > 0:
+            logging.warning("%d events could not be written to %s" % (self.dropped, self.path))
+
+
+def configure(path, metrics=None, interval=15.0):
+    """
+    send the events of all following stages of this process to path
+    """
+    global _log
+    _log = eventlog(path, metrics, interval).open()
+    return _log
+
+
+def emit(event, **fields):
+    """
+    record an event, if events are on
+    """
+    log = _log
+    if log is not None:
+        log.emit(event, **fields)
+
+
+def finish():
+    global _log
+    if _log is None:
+        return
+    log = _log
+    emit("end", bins=log.bins, done=log.done, wall=round(time.time() - log.started, 3))
+    _log = None
+    log.close()
@@ -1,23 +1,29 @@
 import logging
 import os
 import subprocess
+from pygmes import jobs
+from pygmes import timings
 import glob
 import re
-from pyfaidx import Fasta
-from pyfaidx import FastaIndexingError
-from random import sample
+import time
 from collections import defaultdict
 from pygmes.diamond import diamond
 from pygmes.printlngs import print_lngs
-from ete3 import NCBITaxa
+from pygmes.scratch import staging
+from pygmes.modelindex import parse_info
+from pygmes.modelrepo import modelrepo
+from pygmes.composition import rank_models, stratified_subsample, contig_lengths
+from pygmes.scoring import SCORERS, gtf_stats
+from pygmes.taxonomy import translate
 import shutil
 
 
+class PygmesError(Exception):
+    """
+    raised when pygmes can not go on, the command line reports it and exits
+    """
 
-import urllib.request
 
-
-url = "http://paulsaary.de/gmes/"
 def create_dir(d):
     if not os.path.isdir(d):
         try:
@@ -32,8 +38,7 @@ def delete_folder(d):
             try:
                 shutil.rmtree(d)
             except Exception as e:
-                logging.warning("Could not delete folder: %s" % d)
-                print(e)
+                logging.warning("Could not delete folder: %s\n%s" % (d, e))
 
 def touch(fname, mode=0o666, dir_fd=None, **kwargs):
     flags = os.O_CREAT | os.O_APPEND
@@ -42,9 +47,11 @@ def touch(fname, mode=0o666, dir_fd=None, **kwargs):
             dir_fd=None if os.supports_fd else dir_fd, **kwargs)
 
 class gmes:
-    def __init__(self, fasta, outdir, ncores=1):
+    def __init__(self, fasta, outdir, ncores=1, scratch=None, repo=None, timeouts=None):
         self.fasta = os.path.abspath(fasta)
         self.outdir = os.path.abspath(outdir)
+        # node local folder for the GeneMark-ES working files
+        self.scratch = scratch
         self.logfile = os.path.join(self.outdir, "pygmes.log")
         self.loggtf = os.path.join(self.outdir, "pygmes_gtf.log")
         # make sure the output folder exists
@@ -57,13 +64,20 @@ class gmes:
         self.finalgtf = False
         self.bedfile = False
         self.tax = []
+        self.support = 0
         self.modelinfomap = {}
+        # local repository of the pretrained models, created when needed
+        self.repo = repo
+        # wall clock budgets of the GeneMark-ES runs
+        self.timeouts = timeouts if timeouts is not None else jobs.timeouts()
+        self.timedout = False
         if ncores == 1:
             logging.warning("You are running GeneMark-ES with a single core. This will be slow. We recommend using 8-16 cores.")
 
     def selftraining(self):
         failpath = os.path.join(self.outdir, "tried_already")
         if os.path.exists(failpath):
+            self.timedout = os.path.exists(os.path.join(self.outdir, "timed_out"))
             logging.info("Self-training skipped, as we did this before and it failed")
             self.gtf2faa()
             return
@@ -86,16 +100,28 @@ class gmes:
             self.fasta,
         ]
         try:
-            with open(self.logfile, "a") as fout:
-                subprocess.run(" ".join(lst), cwd=self.outdir, check=True, shell=True,
-                            stdout = fout, stderr = fout)
+            with open(self.logfile, "a") as fout, \
+                    staging(self.outdir, self.scratch, ["genemark.gtf", "output/gmhmm.mod"]) as workdir:
+                jobs.run(lst, cwd=workdir, check=True, log = fout,
+                         timeout = self.timeouts.get("selftraining", self.fasta))
         except subprocess.CalledProcessError:
             touch(failpath)
             logging.info("GeneMark-ES in self-training mode has failed")
+        except subprocess.TimeoutExpired:
+            self.expired(failpath)
+            logging.info("GeneMark-ES in self-training mode has timed out")
         # predict and then clean
         self.gtf2faa()
         self.clean_gmes_files()
 
+    def expired(self, failpath):
+        # a killed run may leave a partial GTF behind, which must not be used
+        self.timedout = True
+        if os.path.exists(self.gtf):
+            os.remove(self.gtf)
+        touch(failpath)
+        touch(os.path.join(self.outdir, "timed_out"))
+
     def clean_gmes_files(self):
         # clean if there are files to clean
         # this just keeps the foodprint lower
@@ -105,7 +131,11 @@ class gmes:
             delete_folder(p)
 
 
-    def prediction(self, model):
+    def prediction(self, model, proteins=True):
+        """
+        predict genes with model. Without proteins only the GTF is made,
+        for candidate models that are scored from their GTF
+        """
         self.model = model
         self.modelname = os.path.basename(model).replace(".mod","")
         failpath = os.path.join(self.outdir, "tried_already")
@@ -114,7 +144,8 @@ class gmes:
             return
         if os.path.exists(self.gtf):
             logging.debug("GTF file already exists, skipping")
-            self.gtf2faa()
+            if proteins:
+                self.gtf2faa()
             return
         logging.debug("Starting prediction")
         lst = [
@@ -128,18 +159,23 @@ class gmes:
             self.fasta,
         ]
         try:
-            with open(self.logfile, "a") as fout:
-                subprocess.run(" ".join(lst), cwd=self.outdir, check=True, shell=True,
-                            stdout = fout, stderr = fout)
+            with open(self.logfile, "a") as fout, \
+                    staging(self.outdir, self.scratch, ["genemark.gtf"]) as workdir:
+                jobs.run(lst, cwd=workdir, check=True, log = fout,
+                         timeout = self.timeouts.get("prediction", self.fasta))
         except subprocess.CalledProcessError:
             logging.info("GeneMark-ES in prediction mode has failed")
             touch(failpath)
+        except subprocess.TimeoutExpired:
+            self.expired(failpath)
+            logging.info("GeneMark-ES in prediction mode has timed out")
         # predict and then clean
-        self.gtf2faa()
+        if proteins:
+            self.gtf2faa()
         self.clean_gmes_files()
 
     def gtf2faa(self):
-        lst = ["get_sequence_from_GTF.pl", "genemark.gtf", self.fasta]
+        lst = ["get_sequence_from_GTF.pl", self.gtf, self.fasta]
         if not os.path.exists(self.gtf):
             logging.debug("There is no GTF file")
             return
@@ -147,9 +183,9 @@ class gmes:
             logging.debug("Protein file already exists, skipping")
         else:
             try:
-                with open(self.loggtf, "a") as fout:
-                    subprocess.run(" ".join(lst), cwd=self.outdir, check=True, shell=True,
-                                stdout = fout, stderr = fout)
+                with open(self.loggtf, "a") as fout, \
+                        staging(self.outdir, self.scratch, ["prot_seq.faa"]) as workdir:
+                    jobs.run(lst, cwd=workdir, check=True, log = fout)
             except subprocess.CalledProcessError:
                 logging.warning("could not get proteins from gtf")
         # rename the proteins, to be compatibale with CAT
@@ -229,13 +265,13 @@ class gmes:
             faa = self.protfaa
         if gtf is None:
             gtf = self.gtf
+        from pyfaidx import Fasta, FastaIndexingError
         try:
             faa = Fasta(faa)
         except FastaIndexingError:
             return
         except Exception as e:
-            logging.debug("Unhandled pyfaidx Fasta error")
-            print(e)
+            logging.debug("Unhandled pyfaidx Fasta error: %s" % e)
             return
         # load gtf
         beds = self.parse_gtf(gtf)
@@ -246,11 +282,8 @@ class gmes:
         with open(self.finalfaa, "w") as fout:
             for record in faa:
                 if record.name not in beds.keys():
-                    logging.warning("The protein was not found in the gtf file:")
-                    print("protein: %s" % record.name)
-                    print("GTF file: %s" % gtf)
-                    logging.warning("stopping here, this is a bug in pygmes or an issue with GeneMark-ES")
-                    exit()
+                    raise PygmesError("The protein %s was not found in the gtf file %s, "
+                                      "this is a bug in pygmes or an issue with GeneMark-ES" % (record.name, gtf))
                 contig = beds[record.name]['chrom']
                 orfcounter[contig] += 1
                 # we use 1 as the first number, instead of the cool 0
@@ -281,7 +314,7 @@ class gmes:
                         return True
                 j = j - 1
 
-    def run_complete(self, models, diamonddb):
+    def run_complete(self, models, diamonddb, **premodelargs):
         self.selftraining()
         if self.check_success():
             logging.info("Ran GeneMark-ES successfully")
@@ -291,74 +324,198 @@ class gmes:
         else:
             logging.info("Using pre-trained models")
             self.fetchinfomap()
-            self.premodel(models)
+            self.premodel(models, **premodelargs)
             if self.bestpremodel:
                 self.bestpremodel.estimate_tax(diamonddb)
                 self.premodeltax = self.bestpremodel.tax
                 # print lineage of model compared to the infered tax
-                print_lngs(self.modelinfomap[self.bestpremodel.modelname],
+                print_lngs(self.modelinfomap.get(self.bestpremodel.modelname, []),
                            self.premodeltax)
+                firstbest = self.bestpremodel
                 localmodals = self.infer_model(self.premodeltax)
-                self.premodel(localmodals, stage=2)
+                self.premodel(localmodals, stage=2, **premodelargs)
+                if not self.bestpremodel:
+                    logging.info("No model of the inferred lineage worked, keeping %s" % firstbest.modelname)
+                    self.bestpremodel = firstbest
                 self.bestpremodel.estimate_tax(diamonddb)
                 self.premodeltax = self.bestpremodel.tax
                 # print lineage of model compared to the infered tax
-                print_lngs(self.modelinfomap[self.bestpremodel.modelname],
+                print_lngs(self.modelinfomap.get(self.bestpremodel.modelname, []),
                            self.premodeltax)
                 # set the final values of of the protein prediction step
                 self.finalfaa = self.bestpremodel.finalfaa
                 self.bedfile = self.bestpremodel.bedfile
                 self.tax = self.bestpremodel.tax
+                self.support = self.bestpremodel.support
             # self.prediction()
 
     def estimate_tax(self, db):
         ddir = os.path.join(self.outdir, "diamond")
         create_dir(ddir)
-        d = diamond(self.protfaa, ddir, db, sample=200, ncores = self.ncores)
+        d = diamond(self.protfaa, ddir, db, sample=200, ncores = self.ncores, scratch = self.scratch,
+                    timeouts = self.timeouts)
         self.tax = d.lineage
+        self.support = d.support
 
-    def premodel(self, models, stage=1):
+    def premodel(self, models, stage=1, topk=None, tournament=None, tournament_bp=2000000,
+                 validate=False, score="aa"):
+        """
+        predict proteins with the models in the folder models and set the
+        one with the highest score as bestpremodel. score is a key of
+        scoring.SCORERS, by default the number of amino acids
+
+        topk: only use the topk models closest to the genome in composition
+
+        tournament: first run all models on a length stratified subsample
+        of at most tournament_bp and only this number of finalists on the
+        full genome. With validate all models are still run on the full
+        genome to check if the tournament picked the same model
+        """
         logging.debug("On bin: %s" % self.fasta)
         logging.debug("Running the pre Model stage %d" % stage)
         logging.debug("Using model directory: %s", models)
         self.bestpremodel = False
-        modelfiles = glob.glob(os.path.join(models, "*.mod"))
-        subgmes = []
-        for model in modelfiles:
-            logging.debug("Using model %s" % os.path.basename(model))
-            name = os.path.basename(model)
-            odir = os.path.join(self.outdir, "{}_premodels".format(stage), name)
-            g = gmes(self.fasta, odir, ncores = self.ncores)
-            g.prediction(model)
+        modelfiles = sorted(glob.glob(os.path.join(models, "*.mod")))
+        if topk is not None and len(modelfiles) > topk:
+            modelfiles = self.rank_premodels(modelfiles, stage, topk)
+        finalists = None
+        if tournament is not None and len(modelfiles) > tournament:
+            finalists = self.tournament(modelfiles, stage, tournament, tournament_bp, score)
+        candidates = modelfiles
+        if finalists is not None and not validate:
+            modelfiles = finalists
+
+        start = time.time()
+        subgmes = self.predict_models(modelfiles, self.fasta,
+                                      os.path.join(self.outdir, "{}_premodels".format(stage)))
+        fulltime = time.time() - start
+
+        ranked = self.rank_runs(subgmes, score)
+        if finalists is not None and len(ranked) > 0:
+            self.report_tournament(ranked, finalists, candidates, fulltime, validate)
+            ranked = [r for r in ranked if r[1].model in finalists]
+        # set the best model as the model with the highest score, proteins
+        # are only extracted and renamed for this one
+        for value, g in ranked:
+            g.gtf2faa()
             if g.check_success():
-                subgmes.append(g)
-
-        if len(subgmes) == 0:
+                self.bestpremodel = g
+                break
+        if self.bestpremodel:
+            logging.info("Best model set as: %s" % os.path.basename(self.bestpremodel.model))
+        else:
             logging.warning("Could not predict any proteins in this file")
+
+    def predict_models(self, modelfiles, fasta, folder):
+        """
+        run a prediction with each model on fasta, each in its own
+        subfolder of folder. Returns the runs that made a GTF file
+        """
+        runs = []
+        for model in modelfiles:
+            logging.debug("Using model %s" % os.path.basename(model))
+            odir = os.path.join(folder, os.path.basename(model))
+            g = gmes(fasta, odir, ncores = self.ncores, scratch = self.scratch, timeouts = self.timeouts)
+            with timings.stage("prediction", model = os.path.basename(model)) as s:
+                g.prediction(model, proteins = False)
+            g.runtime = s.record["wall"]
+            if os.path.exists(g.gtf):
+                runs.append(g)
+        return runs
+
+    def rank_runs(self, runs, score="aa"):
+        """
+        score the runs from their GTF files, best first. Runs without
+        genes are left out
+        """
+        scorer = SCORERS[score]
+        genomebp = {}
+        scored = []
+        for g in runs:
+            if g.fasta not in genomebp:
+                genomebp[g.fasta] = sum(contig_lengths(g.fasta).values()) if score == "density" else 0
+            stats = gtf_stats(g.gtf)
+            if stats["genes"] == 0:
+                continue
+            scored.append((scorer(stats, genomebp[g.fasta]), g))
+        scored.sort(key=lambda x: (-x[0], x[1].model))
+        return scored
+
+    def tournament(self, modelfiles, stage, finalists, maxbp, score="aa"):
+        """
+        run all models on a subsample of the contigs and return the
+        finalists, or None if the genome is too small to gain anything
+        """
+        folder = os.path.join(self.outdir, "{}_tournament".format(stage))
+        create_dir(folder)
+        genomebp = sum(contig_lengths(self.fasta).values())
+        if genomebp <= maxbp:
+            logging.debug("Genome is smaller than the tournament subsample, skipping the tournament")
+            return None
+        subfasta = os.path.join(folder, "subsample.fa")
+        bp = stratified_subsample(self.fasta, subfasta, maxbp)
+        start = time.time()
+        ranked = self.rank_runs(self.predict_models(modelfiles, subfasta, folder), score)
+        self.tournamenttime = time.time() - start
+        if len(ranked) == 0:
+            logging.info("No model predicted proteins on the subsample, using all models")
+            return None
+        chosen = [g.model for value, g in ranked[:finalists]]
+        logging.info("Tournament of %d models on %d of %d bp, finalists: %s" %
+                     (len(modelfiles), bp, genomebp, ", ".join([os.path.basename(m) for m in chosen])))
+        with open(os.path.join(folder, "tournament.tsv"), "w") as fout:
+            fout.write("model\tscore\tseconds\tfinalist\n")
+            for value, g in ranked:
+                fout.write("{}\t{}\t{:.1f}\t{}\n".format(os.path.basename(g.model), value, g.runtime,
+                                                       g.model in chosen))
+        return chosen
+
+    def report_tournament(self, ranked, finalists, candidates, fulltime, validate):
+        """
+        log the speedup of the tournament and, if all models were run on the
+        full genome, if the tournament chose the same model
+        """
+        if validate:
+            estimate = fulltime
+            runtime = self.tournamenttime + sum([g.runtime for s, g in ranked if g.model in finalists])
+            agree = ranked[0][1].model in finalists
+            logging.info("Tournament validation: best full model %s was %s the finalists" %
+                         (os.path.basename(ranked[0][1].model), "among" if agree else "NOT among"))
         else:
-            aminoacidcount = []
-            for g in subgmes:
-                fa = Fasta(g.protfaa)
-                i = 0
-                for seq in fa:
-                    i += len(seq)
-                aminoacidcount.append(i)
-            # set the best model as the model leading to the most amino acids
-            idx = aminoacidcount.index(max(aminoacidcount))
-            self.bestpremodel = subgmes[idx]
-            logging.info("Best model set as: %s" % os.path.basename(self.bestpremodel.model))
+            # estimate the full evaluation from the runtime of the finalists
+            estimate = fulltime / max(1, len(ranked)) * len(candidates)
+            runtime = self.tournamenttime + fulltime
+        if runtime > 0:
+            logging.info("Tournament speedup %.1fx (%.0fs instead of about %.0fs)" %
+                         (estimate / runtime, runtime, estimate))
+
+    def rank_premodels(self, modelfiles, stage, topk):
+        """
+        rank the models by the similarity of their trinucleotide profile to
+        the genome and keep the topk. The ranking is logged and written
+        to ranking.tsv in the premodel folder
+        """
+        ranking, genomegc = rank_models(self.fasta, modelfiles)
+        rankdir = os.path.join(self.outdir, "{}_premodels".format(stage))
+        create_dir(rankdir)
+        logging.info("Ranked %d models by composition, keeping %d (genome GC %.3f)" % (len(ranking), topk, genomegc))
+        with open(os.path.join(rankdir, "ranking.tsv"), "w") as fout:
+            fout.write("rank\tmodel\tdistance\tgc\tselected\n")
+            for i, (dist, modelgc, modfile) in enumerate(ranking):
+                name = os.path.basename(modfile)
+                logging.debug("%d. %s distance %.4f GC %.3f" % (i + 1, name, dist, modelgc))
+                fout.write("{}\t{}\t{:.5f}\t{:.4f}\t{}\n".format(i + 1, name, dist, modelgc, i < topk))
+        return [modfile for dist, modelgc, modfile in ranking[:topk]]
 
     def fetchinfomap(self):
         """
         function to make sure the information of all models
         is known to the class
         """
+        if self.repo is None:
+            self.repo = modelrepo()
         if len(self.modelinfomap) == 0:
-            info = self.fetch_info("{}info.csv".format(url))
-            for line in info.split("\n"):
-                l = line.split(",")
-                if len(l) == 3:
-                    self.modelinfomap[l[0]] = l[2].split("-")
+            self.modelinfomap, self.modelquality = parse_info(self.repo.info())
 
     def infer_model(self, tax, n=3):
         """
@@ -367,76 +524,34 @@ class gmes:
         precomputed models that already exists
         for this we choose the model that shares the most
         taxonomic element with the predicted lineage
-        If multiple modles have similar fit, we just again chose the best one
+        If multiple modles have similar fit, we chose the n with the highest
+        quality, using the lineage index of all models
         """
         self.fetchinfomap()
 
-        candidates = self.score_models(self.modelinfomap, tax)
-
-        if len(candidates) > n:
-            candidates = sample(candidates, n)
-        # for each candidate, try to download the model into a file
+        depth, candidates = self.repo.index().query(tax, n)
+        logging.debug("Models sharing %d lineage levels: %s" % (depth, ", ".join(candidates)))
+        # link the candidates from the local repository, missing ones are
+        # fetched concurrently unless we are offline
         modeldir = os.path.join(self.outdir, "models")
-        create_dir(modeldir)
-        for model in candidates:
-            self.fetch_model(modeldir, url, model)
+        self.repo.materialize(candidates, modeldir)
 
         return modeldir
 
-    def fetch_model(self, folder, url, name):
-        url = "{}/models/{}.mod".format(url, name)
-        modelfile = os.path.join(folder, "{}.mod".format(name))
-        response = urllib.request.urlopen(url)
-        data = response.read()  # a `bytes` object
-        content = data.decode(
-            "utf-8"
-        )  # a `str`; this step can't be used if data is binary
-        with open(modelfile, "w") as mod:
-            mod.writelines(content)
-
-    def fetch_info(self, url):
-        response = urllib.request.urlopen(url)
-        data = response.read()  # a `bytes` object
-        infocsv = data.decode(
-            "utf-8"
-        )  # a `str`; this step can't be used if data is binary
-        return infocsv
-
-    def score_models(self, infomap, lng):
-        scores = defaultdict(int)
-
-        for model, mlng in infomap.items():
-            for a, b in zip(lng, mlng):
-                if int(a) == int(b):
-                    scores[model] += 1
-        # get all models with the highest score
-        maxscore = max([v for k, v in scores.items()])
-        candidates = []
-        for m, s in scores.items():
-            if s == maxscore:
-                candidates.append(m)
-        return candidates
-
     def writetax(self):
         """
         write infered taxonomy in a machine and human readble format
         """
         logging.info("Translating lineage")
-        ncbi = NCBITaxa()
         taxf = os.path.join(self.outdir, "lineage.txt")
+        lng = self.tax
+        nms, ranks = translate([lng])
+        # first line is taxids in machine readable
+        s = "-".join([str(i) for i in lng])
+        lines = ["#taxidlineage: {}\n".format(s), "taxid\tncbi_rank\tncbi_name\n"]
+        for taxid in lng:
+            name = nms.get(taxid, "unnamed")
+            lines.append(f"{taxid}\t{ranks[taxid]}\t{name}\n")
         with open(taxf, "w") as fout:
-           # get the information
-            lng = self.tax
-            nms = ncbi.get_taxid_translator(lng)
-            ranks = ncbi.get_rank(lng)
-            # first line is taxids in machine readable
-            s = "-".join([str(i) for i in lng])
-            fout.write("#taxidlineage: {}\n".format(s))
-            fout.write("taxid\tncbi_rank\tncbi_name\n")
-            for taxid in lng:
-                if taxid in nms.keys():
-                    name = nms[taxid]
-                else:
-                    name = "unnamed"
-                fout.write(f"{taxid}\t{ranks[taxid]}\t{name}\n") 
+            fout.write("".join(lines))
         logging.info("Wrote lineage to %s" % taxf)
@@ -0,0 +1,186 @@
+"""
+Runs the external tools and keeps track of the resources they use.
+
+Every tool call goes through run, which hands it to the runner (see
+pygmes.runner) driving all tools from one asyncio event loop and reaping
+them with wait4 so their resource usage is known. The usage is added to the job
+that is accounted in the calling thread, so the scheduler can learn
+how much memory a stage really takes.
+"""
+import os
+import time
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+
+_current = threading.local()
+# tool each thread is waiting for, by thread id
+waiting = {}
+
+
+@contextmanager
+def accounting():
+    """
+    collect the resource usage of all tools run by this thread inside
+    the context. Yields a dict with the peak RSS (bytes) of the largest
+    process, the summed CPU seconds, the 512 byte blocks read (inblock)
+    and written (oublock) by all processes and the seconds the thread
+    waited for them
+    """
+    usage = {"maxrss": 0, "cpu": 0.0, "processes": 0, "inblock": 0, "oublock": 0, "wait": 0.0}
+    previous = getattr(_current, "usage", None)
+    _current.usage = usage
+    try:
+        yield usage
+    finally:
+        _current.usage = previous
+        if previous is not None:
+            previous["maxrss"] = max(previous["maxrss"], usage["maxrss"])
+            for key in ["cpu", "processes", "inblock", "oublock", "wait"]:
+                previous[key] += usage[key]
+
+
+def account(rusage):
+    usage = getattr(_current, "usage", None)
+    if usage is None:
+        return
+    # ru_maxrss is in kilobytes on linux
+    usage["maxrss"] = max(usage["maxrss"], rusage.ru_maxrss * 1024)
+    usage["cpu"] += rusage.ru_utime + rusage.ru_stime
+    usage["processes"] += 1
+    usage["inblock"] += rusage.ru_inblock
+    usage["oublock"] += rusage.ru_oublock
+
+
+def killgroup(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def name(args):
+    return os.path.basename(args[0])
+
+
+_runner = None
+_runnerlock = threading.Lock()
+
+
+def shared():
+    """
+    the runner shared by all tools of this process, created on first use
+    """
+    global _runner
+    with _runnerlock:
+        if _runner is None:
+            # asyncio is only imported once a tool runs
+            from pygmes.runner import runner
+            _runner = runner()
+        return _runner
+
+
+def run(args, cwd=None, check=False, log=None, timeout=None, grace=10):
+    """
+    run a tool on the shared runner and wait for it. Like subprocess.run
+    this raises CalledProcessError (with check, also with exit status 127
+    if the tool can not be started) and TimeoutExpired. The
+    resource usage is accounted to the calling thread.
+
+    After timeout seconds the process group gets SIGTERM, and SIGKILL if
+    it is still alive grace seconds later
+    """
+    future = shared().submit(list(args), cwd, log, timeout, grace)
+    ident = threading.get_ident()
+    waiting[ident] = name(args)
+    start = time.time()
+    try:
+        r = future.result()
+    except OSError as e:
+        # the tool could not be started, e.g. it is not installed. Like the
+        # shell, report this as exit status 127
+        logging.warning("Could not run %s: %s" % (name(args), e))
+        if check:
+            raise subprocess.CalledProcessError(127, args)
+        return subprocess.CompletedProcess(args, 127)
+    except BaseException:
+        # e.g. KeyboardInterrupt, stop the tool as well
+        future.cancel()
+        raise
+    finally:
+        waiting.pop(ident, None)
+        usage = getattr(_current, "usage", None)
+        if usage is not None:
+            usage["wait"] += time.time() - start
+    account(r.rusage)
+    logging.debug("%s: exit %d, %.1fs CPU, %.0f MB peak RSS" %
+                  (name(args), r.returncode, r.rusage.ru_utime + r.rusage.ru_stime, r.rusage.ru_maxrss / 1024))
+    if r.expired:
+        raise subprocess.TimeoutExpired(args, timeout)
+    if check and r.returncode != 0:
+        logging.debug("Last output of %s:\n%s" % (name(args), "".join(r.tail[-5:])))
+        raise subprocess.CalledProcessError(r.returncode, args)
+    return subprocess.CompletedProcess(args, r.returncode)
+
+
+def parse_duration(value):
+    """
+    seconds from a duration like 90, 90s, 30m or 2h
+    """
+    units = {"s": 1, "m": 60, "h": 3600}
+    value = str(value).strip().lower()
+    if len(value) > 0 and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+class timeouts:
+    """
+    Wall clock budgets of the external tools. The budget of a stage is
+    base + permb * Mb of input sequence, stages without a budget run
+    without a time limit.
+
+    Parameters:
+
+    **budgets:** dict of stage (selftraining, prediction, prodigal, diamond)
+    to seconds
+
+    **permb:** dict of stage to additional seconds per Mb of input
+    """
+    stages = ["selftraining", "prediction", "prodigal", "diamond"]
+
+    def __init__(self, budgets=None, permb=None):
+        self.budgets = budgets or {}
+        self.permb = permb or {}
+        for stage in list(self.budgets.keys()) + list(self.permb.keys()):
+            if stage not in self.stages:
+                raise ValueError("Unknown stage for a timeout: {} (use one of {})".format(
+                                 stage, ", ".join(self.stages)))
+
+    @classmethod
+    def from_options(cls, budgets=None, permb=None):
+        """
+        build the budgets from a list of STAGE=DURATION strings
+        """
+        def parse(values):
+            d = {}
+            for value in values or []:
+                if "=" not in value:
+                    raise ValueError("Timeouts are given as STAGE=DURATION, not {}".format(value))
+                stage, duration = value.split("=", 1)
+                d[stage.strip()] = parse_duration(duration)
+            return d
+        return cls(parse(budgets), parse(permb))
+
+    def get(self, stage, path=None):
+        """
+        budget in seconds of a stage running on the sequence file path,
+        or None for no limit. The size of the file is used as bp
+        """
+        if stage not in self.budgets and stage not in self.permb:
+            return None
+        seconds = self.budgets.get(stage, 0)
+        if stage in self.permb and path is not None and os.path.exists(path):
+            seconds += self.permb[stage] * os.path.getsize(path) / 1e6
+        return seconds
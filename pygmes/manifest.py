@@ -0,0 +1,90 @@
+import os
+import json
+import logging
+import hashlib
+
+MANIFEST_VERSION = 1
+
+
+def checksum(path, blocksize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def signature(path, sha256=None):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "sha256": sha256 if sha256 is not None else checksum(path)}
+
+
+class manifest:
+    """
+    Input bins of a metapygmes run, written to manifest.json in the
+    output folder. An incremental run compares the bins in the input
+    folder against it to find the bins that are new, changed or gone.
+    A bin with the same size and modification time is taken as unchanged
+    without reading it, otherwise its sha256 decides.
+
+    Parameters:
+
+    **path:** path to manifest.json
+    """
+    def __init__(self, path):
+        self.path = path
+        self.bins = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            with open(path) as fin:
+                data = json.load(fin)
+            if data.get("version") != MANIFEST_VERSION:
+                logging.warning("Manifest %s has version %s, treating all bins as new"
+                                % (path, data.get("version")))
+                self.exists = False
+            else:
+                self.bins = data["bins"]
+
+    def changes(self, files):
+        """
+        split the bin files into new, changed and unchanged ones and list
+        the names of bins that are no longer in files
+        """
+        new, changed, unchanged = [], [], []
+        names = set()
+        for f in files:
+            name = os.path.basename(f)
+            names.add(name)
+            old = self.bins.get(name)
+            if old is None:
+                new.append(f)
+                continue
+            st = os.stat(f)
+            if st.st_size == old["size"] and st.st_mtime_ns == old["mtime"]:
+                unchanged.append(f)
+                continue
+            sha256 = checksum(f)
+            if sha256 == old["sha256"]:
+                # touched but not changed, remember the new mtime
+                self.bins[name] = signature(f, sha256)
+                unchanged.append(f)
+            else:
+                changed.append(f)
+        removed = sorted([name for name in self.bins.keys() if name not in names])
+        return new, changed, unchanged, removed
+
+    def update(self, files, removed=[]):
+        for f in files:
+            self.bins[os.path.basename(f)] = signature(f)
+        for name in removed:
+            self.bins.pop(name, None)
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fout:
+            json.dump({"version": MANIFEST_VERSION, "bins": self.bins}, fout, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.exists = True
@@ -0,0 +1,97 @@
+import os
+import logging
+import shutil
+from pygmes.composition import read_markov
+from pygmes.exec import create_dir
+
+
+def model_vector(modfile):
+    """
+    coding hexamer frequencies of a GeneMark model, averaged over
+    the three phases and normalized to sum to one
+    """
+    markov = read_markov(modfile)
+    v = [sum(markov[k][:3]) / 3 for k in sorted(markov.keys())]
+    total = sum(v)
+    if total == 0:
+        return v
+    return [x / total for x in v]
+
+
+def distance(v1, v2):
+    if len(v1) != len(v2):
+        return float("inf")
+    return sum(abs(a - b) for a, b in zip(v1, v2))
+
+
+def cluster_models(modelfiles, method="markov", threshold=0.15, lineages=None):
+    """
+    greedy clustering of model files. Models are visited in the given
+    order and join the first representative they are close to, otherwise
+    they become a representative themselves.
+
+    method markov compares the coding hexamer tables (L1 distance below
+    threshold), method lineage groups models whose source bins have the
+    same lineage (lineages: dict of model file to lineage).
+
+    Returns a list of (model, representative, distance)
+    """
+    clusters = []
+    representatives = []
+    for modfile in modelfiles:
+        if method == "lineage":
+            key = tuple((lineages or {}).get(modfile, []))
+            match = None
+            # bins without a lineage are never merged
+            if len(key) > 0:
+                for rep, repkey in representatives:
+                    if repkey == key:
+                        match = rep
+                        break
+            if match is None:
+                representatives.append((modfile, key))
+                clusters.append((modfile, modfile, 0))
+            else:
+                clusters.append((modfile, match, 0))
+        else:
+            v = model_vector(modfile)
+            best = None
+            for rep, repv in representatives:
+                d = distance(v, repv)
+                if d < threshold and (best is None or d < best[1]):
+                    best = (rep, d)
+            if best is None:
+                representatives.append((modfile, v))
+                clusters.append((modfile, modfile, 0))
+            else:
+                clusters.append((modfile, best[0], best[1]))
+    return clusters
+
+
+def representative_models(modeldir, outdir, method="markov", threshold=0.15, order=None, lineages=None):
+    """
+    cluster the models in modeldir and place one representative per
+    cluster in outdir. order is a list of model files, the first model
+    of each cluster becomes its representative. The clustering is written
+    to clusters.tsv in outdir
+    """
+    modelfiles = order if order is not None else sorted(
+        [os.path.join(modeldir, f) for f in os.listdir(modeldir) if f.endswith(".mod")])
+    delete = [f for f in os.listdir(outdir) if f.endswith(".mod")] if os.path.exists(outdir) else []
+    create_dir(outdir)
+    for f in delete:
+        os.remove(os.path.join(outdir, f))
+    clusters = cluster_models(modelfiles, method, threshold, lineages)
+    reps = sorted(set([rep for model, rep, d in clusters]))
+    for rep in reps:
+        target = os.path.join(outdir, os.path.basename(rep))
+        try:
+            os.link(rep, target)
+        except OSError:
+            shutil.copy(rep, target)
+    with open(os.path.join(outdir, "clusters.tsv"), "w") as fout:
+        fout.write("model\trepresentative\tdistance\n")
+        for model, rep, d in clusters:
+            fout.write("{}\t{}\t{:.4f}\n".format(os.path.basename(model), os.path.basename(rep), d))
+    logging.info("Clustered %d models into %d clusters" % (len(modelfiles), len(reps)))
+    return reps
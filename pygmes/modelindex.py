@@ -0,0 +1,135 @@
+import os
+import json
+import logging
+import threading
+import hashlib
+
+this_dir, this_filename = os.path.split(__file__)
+INDEX_PATH = os.path.join(this_dir, "data", "model_index.json")
+
+# indices already loaded in this process, by checksum of the info table
+_loaded = {}
+
+
+def parse_info(info):
+    """
+    parse the info.csv of the model server.
+    Each line is name,description,lineage with the lineage as dash
+    separated taxids. An optional fourth column holds a quality score
+    used to break ties, higher is better.
+    """
+    infomap = {}
+    quality = {}
+    for line in info.split("\n"):
+        l = line.strip().split(",")
+        if len(l) < 3:
+            continue
+        infomap[l[0]] = l[2].split("-")
+        q = 0.0
+        if len(l) > 3:
+            try:
+                q = float(l[3])
+            except ValueError:
+                pass
+        quality[l[0]] = q
+    return infomap, quality
+
+
+class lineagetrie:
+    """
+    Prefix tree over the lineages of the pretrained models.
+
+    Every node keeps the best models of its subtree, ordered by quality
+    and name, so the deepest matching models for a lineage are found by
+    walking the lineage once.
+
+    Parameters:
+
+    **infomap:** dict of model name to lineage (list of taxids)
+
+    **quality:** dict of model name to quality score
+
+    **keep:** number of models remembered per node
+    """
+    def __init__(self, infomap=None, quality=None, keep=16):
+        self.keep = keep
+        self.root = {"c": {}, "b": []}
+        if infomap is not None:
+            self.build(infomap, quality or {})
+
+    def build(self, infomap, quality):
+        def key(model):
+            return (-quality.get(model, 0.0), model)
+
+        for model in sorted(infomap.keys(), key=key):
+            node = self.root
+            if len(node["b"]) < self.keep:
+                node["b"].append(model)
+            for taxid in infomap[model]:
+                taxid = str(int(taxid))
+                if taxid not in node["c"]:
+                    node["c"][taxid] = {"c": {}, "b": []}
+                node = node["c"][taxid]
+                if len(node["b"]) < self.keep:
+                    node["b"].append(model)
+
+    def query(self, lng, n=3):
+        """
+        return the depth of the deepest match and up to n models
+        sharing that part of the lineage
+        """
+        node = self.root
+        depth = 0
+        for taxid in lng:
+            child = node["c"].get(str(int(taxid)))
+            if child is None:
+                break
+            node = child
+            depth += 1
+        return depth, node["b"][:n]
+
+    def save(self, path, checksum):
+        # write and rename, so concurrent runs never read a partial index
+        tmp = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "w") as fout:
+            json.dump({"checksum": checksum, "keep": self.keep, "root": self.root}, fout)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fin:
+            d = json.load(fin)
+        t = cls(keep=d["keep"])
+        t.root = d["root"]
+        return t, d["checksum"]
+
+
+def load_index(info, path=INDEX_PATH):
+    """
+    get the lineage trie for the given info.csv content.
+    A persisted index is used if it was built from the same table,
+    otherwise it is rebuilt and saved for the next run.
+    """
+    checksum = hashlib.sha1(info.encode()).hexdigest()
+    if checksum in _loaded:
+        return _loaded[checksum]
+    trie = None
+    if os.path.exists(path):
+        try:
+            trie, stored = lineagetrie.load(path)
+            if stored != checksum:
+                logging.debug("Model index is outdated, rebuilding")
+                trie = None
+        except (ValueError, KeyError) as e:
+            logging.debug("Could not read model index: %s" % e)
+            trie = None
+    if trie is None:
+        infomap, quality = parse_info(info)
+        trie = lineagetrie(infomap, quality)
+        try:
+            trie.save(path, checksum)
+            logging.debug("Saved model index to %s" % path)
+        except OSError as e:
+            logging.debug("Could not save model index: %s" % e)
+    _loaded[checksum] = trie
+    return trie
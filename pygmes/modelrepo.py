@@ -0,0 +1,173 @@
+import os
+import logging
+import hashlib
+import shutil
+from pygmes.modelindex import load_index, parse_info
+
+DEFAULT_SOURCE = "http://paulsaary.de/gmes/"
+DEFAULT_REPO = os.environ.get("PYGMES_MODELS",
+                              os.path.join(os.path.expanduser("~"), ".cache", "pygmes", "models"))
+
+
+def valid_name(name):
+    """
+    a model name must be a plain file name, not a path or a hidden file
+    """
+    return len(name) > 0 and name == os.path.basename(name) and not name.startswith(".")
+
+
+class modelrepo:
+    """
+    Local content addressed repository of pretrained GeneMark-ES models.
+
+    Models are stored once under objects/ by their sha256 and refs/ maps a
+    model name to its object. info.csv is a copy of the model table of the
+    source. The source is the model server or any folder with the same
+    layout (info.csv and models/<name>.mod).
+
+    Parameters:
+
+    **path:** folder of the local repository
+
+    **source:** URL or folder to fetch missing models from
+
+    **offline:** never touch the source, use only what is in the repository
+
+    **threads:** number of concurrent downloads
+    """
+    def __init__(self, path=None, source=None, offline=False, threads=8):
+        self.path = os.path.abspath(path if path is not None else DEFAULT_REPO)
+        self.source = source if source is not None else DEFAULT_SOURCE
+        self.offline = offline
+        self.threads = threads
+        self.infofile = os.path.join(self.path, "info.csv")
+        for d in ["objects", "refs"]:
+            os.makedirs(os.path.join(self.path, d), exist_ok=True)
+
+    def read_source(self, rel):
+        """
+        return the content of a file of the source as bytes
+        """
+        if self.offline:
+            raise IOError("Offline, not fetching %s" % rel)
+        if os.path.isdir(self.source):
+            with open(os.path.join(self.source, rel), "rb") as fin:
+                return fin.read()
+        import urllib.request
+        url = "{}/{}".format(self.source.rstrip("/"), rel)
+        logging.debug("Fetching %s" % url)
+        with urllib.request.urlopen(url) as response:
+            return response.read()
+
+    def write_atomic(self, path, data):
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as fout:
+            fout.write(data)
+        os.replace(tmp, path)
+
+    def info(self, refresh=False):
+        """
+        content of info.csv. It is fetched from the source if missing
+        or if refresh is set. Returns an empty string if it is not available
+        """
+        if refresh or not os.path.exists(self.infofile):
+            try:
+                self.write_atomic(self.infofile, self.read_source("info.csv"))
+            except (IOError, OSError) as e:
+                logging.warning("Could not fetch the model table: %s" % e)
+        if not os.path.exists(self.infofile):
+            return ""
+        with open(self.infofile) as fin:
+            return fin.read()
+
+    def index(self):
+        return load_index(self.info(), os.path.join(self.path, "model_index.json"))
+
+    def ref(self, name):
+        if not valid_name(name):
+            raise ValueError("Invalid model name %r" % name)
+        return os.path.join(self.path, "refs", name)
+
+    def object(self, name):
+        """
+        path to the model file or None if the model is not in the repository
+        """
+        if not valid_name(name):
+            return None
+        try:
+            with open(self.ref(name)) as fin:
+                digest = fin.read().strip()
+        except FileNotFoundError:
+            return None
+        path = os.path.join(self.path, "objects", digest[:2], digest)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def add(self, name, data):
+        digest = hashlib.sha256(data).hexdigest()
+        folder = os.path.join(self.path, "objects", digest[:2])
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, digest)
+        if not os.path.exists(path):
+            self.write_atomic(path, data)
+        self.write_atomic(self.ref(name), digest.encode())
+        return path
+
+    def fetch_one(self, name):
+        if self.object(name) is not None:
+            return True
+        try:
+            self.add(name, self.read_source("models/{}.mod".format(name)))
+            return True
+        except (IOError, OSError) as e:
+            logging.warning("Could not fetch model %s: %s" % (name, e))
+            return False
+
+    def fetch(self, names):
+        """
+        make sure the given models are in the repository, missing ones
+        are fetched concurrently. Returns the names that are available
+        """
+        # the names come from the model table of the source, so they must
+        # not point outside the repository
+        for name in names:
+            if not valid_name(name):
+                logging.warning("Skipping model with invalid name %r" % name)
+        names = [name for name in names if valid_name(name)]
+        missing = [name for name in names if self.object(name) is None]
+        if len(missing) > 0 and not self.offline:
+            logging.debug("Fetching %d models" % len(missing))
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, self.threads)) as pool:
+                list(pool.map(self.fetch_one, missing))
+        return [name for name in names if self.object(name) is not None]
+
+    def materialize(self, names, folder):
+        """
+        place the given models into folder as <name>.mod, linking
+        to the repository where possible
+        """
+        os.makedirs(folder, exist_ok=True)
+        available = self.fetch(names)
+        for name in available:
+            target = os.path.join(folder, "{}.mod".format(name))
+            if os.path.exists(target):
+                continue
+            try:
+                os.link(self.object(name), target)
+            except OSError:
+                shutil.copy(self.object(name), target)
+        for name in set(names) - set(available):
+            logging.warning("Model %s is not available in %s" % (name, self.path))
+        return available
+
+    def sync(self):
+        """
+        fetch the model table and every model listed in it
+        """
+        infomap, quality = parse_info(self.info(refresh=True))
+        available = self.fetch(list(infomap.keys()))
+        self.index()
+        logging.info("%d of %d models are in %s" % (len(available), len(infomap), self.path))
+        return available
@@ -1,6 +1,7 @@
 
+import os
 import logging
-from ete3 import NCBITaxa
+from pygmes.taxonomy import translate
 
 def compare_taxa(tax1, tax2):
     score = 0
@@ -119,45 +120,53 @@ def print_lngs(tax1, tax2):
     space = "".join(space)
     longspace = "".join([" "] * (len(root)))
     
-    #print dendrogram
-    print("")
-    print("Infered lineage compared to the model lineage:")
+    # the dendrogram goes to the log as a single message
+    lines = ["Infered lineage compared to the model lineage:"]
     if len(tax1r) > 0:
-        print(label1, end ="")
-        print(space, end = "  ")
-        print(tax1r)
-        print(longspace, end = "/\n")
+        lines.append("{}{}  {}".format(label1, space, tax1r))
+        lines.append("{}/".format(longspace))
     else:
-        print(label1)
-        print("")
-    print(root)
+        lines.append(label1)
+        lines.append("")
+    lines.append(root)
     if len(tax2r) > 0:
-        print(longspace, end = "\\\n")
-        print(label3, end ="")
-        print(space, end = "  ")
-        print(tax2r)
+        lines.append("{}\\".format(longspace))
+        lines.append("{}{}  {}".format(label3, space, tax2r))
     else:
-        print("")
-        print(label3)
-    print("\n")
+        lines.append("")
+        lines.append(label3)
+    logging.info("\n".join(lines) + "\n")
 
 def write_lngs(lngs, outfile):
     """
     write infered taxonomy in a machine and human readble format
     """
     logging.info("Translating lineage")
-    ncbi = NCBITaxa()
+    # one lookup for the taxids of all bins instead of two per bin
+    nms, ranks = translate([lngi['lng'] for lngi in lngs.values()])
+    lines = ["bin\ttaxid\tncbi_rank\tncbi_name\tbasedon\n"]
+    for binname, lngi in lngs.items():
+        nprots = lngi['n']
+        for taxid in lngi['lng']:
+            name = nms.get(taxid, "unnamed")
+            lines.append(f"{binname}\t{taxid}\t{ranks[taxid]}\t{name}\t{nprots}\n")
     with open(outfile, "w") as fout:
-        fout.write("bin\ttaxid\tncbi_rank\tncbi_name\tbasedon\n")
-        for binname, lngi in lngs.items():
-            lng = lngi['lng']
-            nprots = lngi['n']
-            nms = ncbi.get_taxid_translator(lng)
-            ranks = ncbi.get_rank(lng)
-            for taxid in lng:
-                if taxid in nms.keys():
-                    name = nms[taxid]
-                else:
-                    name = "unnamed"
-                fout.write(f"{binname}\t{taxid}\t{ranks[taxid]}\t{name}\t{nprots}\n") 
-        logging.info("Wrote lineage to %s" % outfile)
+        fout.write("".join(lines))
+    logging.info("Wrote lineage to %s" % outfile)
+
+
+def read_lngs(infile):
+    """
+    read a file written by write_lngs back into the lineage dict
+    """
+    lngs = {}
+    if not os.path.exists(infile):
+        return lngs
+    with open(infile) as fin:
+        fin.readline()
+        for line in fin:
+            l = line.rstrip("\n").split("\t")
+            if l[0] not in lngs:
+                lngs[l[0]] = {"lng": [], "n": int(l[4])}
+            lngs[l[0]]["lng"].append(int(l[1]))
+    return lngs
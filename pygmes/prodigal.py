@@ -1,41 +1,50 @@
 import logging
 import os
-import subprocess
+from pygmes import jobs
 import re
+from pygmes.scratch import staging
+from pygmes.exec import PygmesError
 
 class prodigal:
-    def __init__(self, seq, outdir, ncores):
+    def __init__(self, seq, outdir, ncores, scratch=None, timeouts=None):
         self.seq =seq
         self.outdir = outdir
+        self.scratch = scratch
+        self.timeouts = timeouts if timeouts is not None else jobs.timeouts()
         self.logfile = os.path.join(outdir, "prodigal.log")
-        if ncores == 1:
-            logging.warning("You are running Prodigal with a single core. This will be slow. We recommend using 8-16 cores.")
         self.faa = self.run(ncores)
         self.bed = self.make_bed()
 
     def run(self, cores=1):
         logging.debug("Launching prodigal now: %s" % self.seq)
-        co = os.path.join(self.outdir, "genecoord.bgk")
         faa = os.path.join(self.outdir, "prot.faa")
-        lst = ["prodigal",
-            "-i", self.seq,
-            "-p", "meta",
-           "-o", co,"-a", faa]
         try:
             # do not rerun for now if we already attempted the training once
             if not os.path.exists(faa):
-                with open(self.logfile, "w") as fout:
-                    subprocess.run(" ".join(lst), cwd=self.outdir, check=True, shell=True,
-                                stdout = fout, stderr = fout)
+                with open(self.logfile, "w") as fout, \
+                        staging(self.outdir, self.scratch, ["genecoord.bgk", "prot.faa"]) as workdir:
+                    lst = ["prodigal",
+                        "-i", self.seq,
+                        "-p", "meta",
+                       "-o", os.path.join(workdir, "genecoord.bgk"),
+                       "-a", os.path.join(workdir, "prot.faa")]
+                    jobs.run(lst, cwd=workdir, check=True, log = fout,
+                             timeout = self.timeouts.get("prodigal", self.seq))
             else:
                 logging.debug("Prodigal output already exists")
         except Exception as e:
-            logging.warning("Prodigal failed on this bin")
+            logging.warning("Prodigal failed on this bin: %s" % e)
+            # a timed out or failed run may leave a partial faa behind,
+            # which must neither be used nor skip the next attempt
+            if os.path.exists(faa):
+                os.remove(faa)
         return(faa)
     
     def make_bed(self):
         # parser for rpodigals faa using header information
         bedpath = os.path.join(self.outdir, "prot.bed")
+        if not os.path.exists(self.faa):
+            return None
         reg = re.compile("([\w\d.\-\+]+)_[0-9]+")
         with open(self.faa) as fin, open(bedpath, "w") as fout:
             for line in fin:
@@ -50,8 +59,7 @@ class prodigal:
                 if m is not None:
                     chrom = m.group(1)
                 else:
-                    logging.warning("Could not extract chromsome name from protein header. This is a bug in pygmes. Please report this on our github.")
-                    exit(1)
+                    raise PygmesError("Could not extract chromsome name from protein header. This is a bug in pygmes. Please report this on our github.")
                 
                 # start 
                 start = segment[1].strip()
@@ -71,8 +79,8 @@ class prodigal:
         return bedpath
 
     def check_success(self):
-        if os.stat(self.faa).st_size == 0:
-            return False
         if not os.path.exists(self.faa):
             return False
+        if os.stat(self.faa).st_size == 0:
+            return False
         return True
@@ -0,0 +1,204 @@
+"""
+Where pygmes spends its own CPU time. With profiling on, every stage
+recorded by pygmes.timings also runs under cProfile, timed with the CPU
+time of its thread, so waiting for the external tools does not show up.
+A stage nested in another one pauses the profile of its parent. At the
+end one <stage>.pstats per stage is written, with the profiles of all
+bins added up.
+
+Since python 3.12 cProfile records the calls of all threads. There, a
+stage is only profiled while no other thread is inside a stage, and the
+profile of a stage that overlapped a stage of another thread is dropped.
+With several jobs at once most stages are then only sampled.
+
+Next to it a sampling thread takes the stacks of all threads that are
+inside a stage and writes them as stacks.collapsed, which flamegraph.pl
+or speedscope read. Samples of a thread waiting for a tool end in a
+"[wait <tool>]" frame instead of the Python frames of the wait, so wall
+time in the tools and in Python can be told apart.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import defaultdict
+from pygmes import jobs
+
+_profiler = None
+# cProfile records all threads, not only the one that enabled it
+ALLTHREADS = sys.version_info >= (3, 12)
+
+
+class profiler:
+    """
+    Profiles the stages of a run and writes the results to outdir.
+
+    Parameters:
+
+    **outdir:** folder for the .pstats files and stacks.collapsed
+
+    **interval:** seconds between two stack samples
+    """
+    def __init__(self, outdir, interval=0.01):
+        self.outdir = outdir
+        self.interval = interval
+        self.lock = threading.Lock()
+        # finished cProfile profiles by stage name
+        self.profiles = defaultdict(list)
+        # stage each thread is in, by thread id
+        self.active = {}
+        self.stacks = defaultdict(int)
+        self.nsamples = 0
+        # profiles that also recorded other threads
+        self.dropped = 0
+        self.running = threading.Event()
+        self.sampler = None
+
+    def start(self):
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        self.running.set()
+        self.sampler = threading.Thread(target=self.sample, name="pygmes-profiler", daemon=True)
+        self.sampler.start()
+        return self
+
+    def enter(self, stage):
+        """
+        start profiling stage in the calling thread, pausing its parent
+        """
+        import cProfile
+        parent = stage.parent
+        if getattr(parent, "profile", None) is not None:
+            parent.profile.disable()
+        stage.profile = None
+        stage.shared = False
+        with self.lock:
+            others = [s for ident, s in self.active.items() if ident != threading.get_ident()]
+            self.active[threading.get_ident()] = stage
+            if ALLTHREADS:
+                # a profile running now would also record this thread
+                for other in others:
+                    while other is not None:
+                        other.shared = True
+                        other = other.parent
+        if ALLTHREADS and len(others) > 0:
+            return
+        profile = cProfile.Profile(time.thread_time)
+        try:
+            profile.enable()
+            stage.profile = profile
+        except ValueError:
+            # only one cProfile may be active at a time since python 3.12,
+            # the stages of other threads are then only sampled
+            pass
+
+    def exit(self, stage):
+        profile = getattr(stage, "profile", None)
+        if profile is not None:
+            profile.disable()
+        parent = stage.parent
+        with self.lock:
+            if profile is not None and getattr(stage, "shared", False):
+                self.dropped += 1
+            elif profile is not None:
+                self.profiles[stage.name].append(profile)
+            if parent is not None:
+                self.active[threading.get_ident()] = parent
+            else:
+                self.active.pop(threading.get_ident(), None)
+        if getattr(parent, "profile", None) is not None:
+            parent.profile.enable()
+
+    def sample(self):
+        while self.running.is_set():
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                active = list(self.active.items())
+            for ident, stage in active:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = collapse(frame, jobs.waiting.get(ident, "tool"))
+                root = stage.name if stage.binname is None else "{};{}".format(stage.name, stage.binname)
+                with self.lock:
+                    self.stacks["{};{}".format(root, stack)] += 1
+                    self.nsamples += 1
+
+    def stop(self):
+        """
+        stop sampling and write the profiles
+        """
+        import pstats
+        self.running.clear()
+        if self.sampler is not None:
+            self.sampler.join()
+        with self.lock:
+            profiles = dict(self.profiles)
+            stacks = dict(self.stacks)
+        if self.dropped > 0:
+            logging.info("%d stage profiles overlapped stages of other threads and were dropped, "
+                         "those stages are only in stacks.collapsed" % self.dropped)
+        written = 0
+        for name, lst in profiles.items():
+            stats = None
+            for profile in lst:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profile)
+                    else:
+                        stats.add(profile)
+                except TypeError:
+                    # a profile without any calls
+                    continue
+            if stats is not None:
+                stats.dump_stats(os.path.join(self.outdir, "{}.pstats".format(name)))
+                written += 1
+        with open(os.path.join(self.outdir, "stacks.collapsed"), "w") as fout:
+            fout.write("".join(["{} {}\n".format(stack, n) for stack, n in sorted(stacks.items())]))
+        logging.info("Profiles of %d stages and %d stack samples written to %s" %
+                     (written, self.nsamples, self.outdir))
+
+
+def label(code):
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def collapse(frame, tool=None):
+    """
+    ; separated stack of frame, outermost first. The frames below
+    jobs.run are replaced by the tool being waited for
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "run" and code.co_filename.endswith(os.path.join("pygmes", "jobs.py")):
+            frames = ["[wait {}]".format(tool)]
+        frames.append(label(code))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def configure(outdir, interval=0.01):
+    """
+    profile all following stages of this process into outdir
+    """
+    global _profiler
+    from pygmes import timings
+    _profiler = profiler(outdir, interval).start()
+    timings.profile(_profiler)
+    return _profiler
+
+
+def finish():
+    """
+    write the profiles, if profiling is on
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    from pygmes import timings
+    timings.profile(None)
+    _profiler.stop()
+    _profiler = None
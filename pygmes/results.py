@@ -0,0 +1,63 @@
+import os
+from pygmes.composition import read_fasta
+from pygmes.taxonomy import translate
+
+
+def read_bed(bed):
+    """
+    gene coordinates of a bed file written by pygmes as
+    (contig, start, stop, strand, protein) tuples
+    """
+    genes = []
+    if bed is None or not os.path.exists(bed):
+        return genes
+    with open(bed) as fin:
+        for line in fin:
+            l = line.rstrip("\n").split("\t")
+            if len(l) < 5:
+                continue
+            genes.append((l[0], int(l[1]), int(l[2]), l[3], l[4]))
+    return genes
+
+
+class binresult:
+    """
+    Final result of one bin, handed to library users as soon as the bin
+    is done, with the proteins and genes already read.
+
+    Parameters:
+
+    **name:** name of the bin
+
+    **software:** predictor whose proteins were chosen (GeneMark-ES, hybrid, prodigal) or None
+
+    **faa:** path to the final proteins, loaded into proteins as (name, sequence) tuples
+
+    **bed:** path to the gene coordinates, loaded into genes as (contig, start, stop, strand, protein) tuples
+
+    **lineage:** taxids of the inferred lineage from the root down
+
+    **support:** number of proteins the lineage is based on
+
+    **status:** outcome of each stage
+    """
+    def __init__(self, name, software, faa=None, bed=None, lineage=None, support=0, status=None, fasta=None):
+        self.name = name
+        self.software = software
+        self.fasta = fasta
+        self.lineage = lineage if lineage is not None else []
+        self.support = support
+        self.status = dict(status) if status is not None else {}
+        self.proteins = list(read_fasta(faa)) if faa is not None and os.path.exists(faa) else []
+        self.genes = read_bed(bed)
+
+    def named_lineage(self):
+        """
+        (taxid, rank, name) of each taxon of the lineage
+        """
+        names, ranks = translate([self.lineage])
+        return [(taxid, ranks.get(taxid, "no rank"), names.get(taxid, "unnamed")) for taxid in self.lineage]
+
+    def __repr__(self):
+        return "binresult({}, {}, {} proteins, lineage {})".format(
+            self.name, self.software, len(self.proteins), "-".join([str(t) for t in self.lineage]))
@@ -0,0 +1,186 @@
+"""
+The asyncio event loop that runs the external tools, see pygmes.jobs
+"""
+import os
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+from pygmes.jobs import killgroup, name
+
+
+def exitcode(status):
+    """
+    exit code of a wait status, negative for a signal like subprocess
+    """
+    if hasattr(os, "waitstatus_to_exitcode"):
+        return os.waitstatus_to_exitcode(status)
+    # python < 3.9
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    raise ValueError("invalid wait status: %d" % status)
+
+
+class result:
+    """
+    Outcome of a tool run by the runner
+    """
+    def __init__(self, args, returncode, rusage, tail, expired=False):
+        self.args = args
+        self.returncode = returncode
+        self.rusage = rusage
+        self.tail = tail
+        self.expired = expired
+
+
+class runner:
+    """
+    Runs the external tools from a single asyncio event loop in a
+    background thread. Tools are started from argv lists without a shell,
+    each in its own process group. Their output is streamed line by line
+    into the log file while they run.
+
+    Exits are watched with a pidfd where the kernel supports it and the
+    process is reaped with wait4, so the resource usage is known.
+
+    Parameters:
+
+    **maxjobs:** number of tools that may run at once (default: no limit)
+    """
+    def __init__(self, maxjobs=None):
+        self.maxjobs = maxjobs
+        self.loop = asyncio.new_event_loop()
+        self.tasks = set()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.serve, name="pygmes-runner", daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.maxjobs) if self.maxjobs else None
+        self.loop.call_soon(self.started.set)
+        self.loop.run_forever()
+
+    def submit(self, args, cwd=None, log=None, timeout=None, grace=10):
+        """
+        start a tool, returns a concurrent.futures.Future of its result
+        """
+        return asyncio.run_coroutine_threadsafe(self.execute(args, cwd, log, timeout, grace), self.loop)
+
+    def limit(self, maxjobs):
+        """
+        change the number of tools that may run at once, tools that
+        already wait keep the old limit
+        """
+        def update():
+            self.maxjobs = maxjobs
+            self.semaphore = asyncio.Semaphore(maxjobs) if maxjobs else None
+        self.loop.call_soon_threadsafe(update)
+
+    def cancel(self):
+        """
+        stop all running and waiting tools
+        """
+        def cancel_all():
+            for task in list(self.tasks):
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel_all)
+
+    async def execute(self, args, cwd, log, timeout, grace):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            if self.semaphore is None:
+                return await self.spawn(args, cwd, log, timeout, grace)
+            async with self.semaphore:
+                return await self.spawn(args, cwd, log, timeout, grace)
+        finally:
+            self.tasks.discard(task)
+
+    async def wait(self, pid):
+        """
+        wait for pid to exit without blocking the loop and reap it
+        """
+        try:
+            fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            return await self.loop.run_in_executor(None, os.wait4, pid, 0)
+        exited = self.loop.create_future()
+        self.loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            self.loop.remove_reader(fd)
+            os.close(fd)
+        return os.wait4(pid, 0)
+
+    async def stream(self, fd, log, tail):
+        reader = asyncio.StreamReader(limit=2 ** 20)
+        transport, protocol = await self.loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # a line longer than the limit, take what is there
+                    line = await reader.read(2 ** 20)
+                if not line:
+                    break
+                text = line.decode(errors="replace")
+                tail.append(text)
+                if len(tail) > 20:
+                    tail.pop(0)
+                if log is not None:
+                    log.write(text)
+                    log.flush()
+        finally:
+            transport.close()
+
+    async def spawn(self, args, cwd, log, timeout, grace):
+        rfd, wfd = os.pipe()
+        try:
+            p = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=wfd, stderr=wfd,
+                                 start_new_session=True)
+        except BaseException:
+            os.close(rfd)
+            raise
+        finally:
+            os.close(wfd)
+        tail = []
+        streaming = self.loop.create_task(self.stream(rfd, log, tail))
+        exited = self.loop.create_task(self.wait(p.pid))
+        expired = False
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(exited), timeout)
+            except asyncio.TimeoutError:
+                expired = True
+                logging.warning("%s exceeded its budget of %.0fs, stopping it" % (name(args), timeout))
+                killgroup(p.pid, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(asyncio.shield(exited), grace)
+                except asyncio.TimeoutError:
+                    killgroup(p.pid, signal.SIGKILL)
+            pid, status, rusage = await exited
+        except asyncio.CancelledError:
+            logging.debug("Stopping %s" % name(args))
+            killgroup(p.pid, signal.SIGKILL)
+            await exited
+            streaming.cancel()
+            raise
+        # wait4 reaped the process, so Popen must not wait for it again
+        p.returncode = exitcode(status)
+        if expired:
+            # children that ignored SIGTERM or were orphaned by it
+            killgroup(p.pid, signal.SIGKILL)
+        try:
+            # orphaned children may keep the pipe open
+            await asyncio.wait_for(streaming, 10)
+        except asyncio.TimeoutError:
+            pass
+        return result(args, p.returncode, rusage, tail, expired)
@@ -0,0 +1,280 @@
+import os
+import json
+import math
+import logging
+import threading
+from pygmes import timings
+from pygmes import events
+
+
+def solve(a, b):
+    """
+    solve the linear system a x = b by gaussian elimination,
+    returns None if it is singular
+    """
+    n = len(b)
+    m = [list(a[i]) + [b[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(n):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                m[r] = [x - f * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+class costmodel:
+    """
+    Predicts the runtime of a stage on a bin from its size:
+
+        seconds = a * Mb ** b * (1 + contigs / 1000) ** c
+
+    The parameters of each stage are fitted by least squares in log
+    space to the timings of previous runs. Without enough timings the
+    defaults below are used, scaled to the timings that are known.
+
+    The peak memory of a stage is predicted as base + slope * Mb, fitted
+    to the peak RSS of previous runs and refitted whenever a job finishes.
+
+    Parameters:
+
+    **history:** path to a timings.jsonl file, new timings are appended
+    """
+    defaults = {
+        "prodigal": (5.0, 1.0, 0.0),
+        "selftraining": (120.0, 1.3, 0.2),
+        "premodel": (20.0, 1.1, 0.1),
+    }
+    # peak RSS in MB: base, per Mb of sequence
+    memorydefaults = {
+        "prodigal": (50.0, 5.0),
+        "selftraining": (500.0, 40.0),
+        "premodel": (300.0, 20.0),
+    }
+    # predicted memory is padded by this factor
+    memorymargin = 1.25
+
+    def __init__(self, history=None):
+        self.history = history
+        self.records = []
+        self.params = {}
+        self.memory = {}
+        self.lock = threading.Lock()
+        if history is not None and os.path.exists(history):
+            with open(history) as fin:
+                for line in fin:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue
+                    if all(k in r for k in ["stage", "bp", "ncontigs", "wall"]):
+                        self.records.append(r)
+        self.fit()
+        self.fit_memory()
+
+    def features(self, bp, ncontigs):
+        return [1.0, math.log(max(bp, 1000) / 1e6), math.log(1 + ncontigs / 1000)]
+
+    def fit(self):
+        stages = set([r["stage"] for r in self.records]) | set(self.defaults.keys())
+        for stage in stages:
+            records = [r for r in self.records if r["stage"] == stage and r["wall"] > 0]
+            a, b, c = self.defaults.get(stage, (10.0, 1.0, 0.0))
+            x = None
+            if len(set([r["bp"] for r in records])) >= 3:
+                # normal equations of log(seconds) = log(a) + b log(Mb) + c log(1 + contigs/1000)
+                rows = [self.features(r["bp"], r["ncontigs"]) for r in records]
+                y = [math.log(r["wall"]) for r in records]
+                ata = [[sum(row[i] * row[j] for row in rows) for j in range(3)] for i in range(3)]
+                aty = [sum(row[i] * v for row, v in zip(rows, y)) for i in range(3)]
+                x = solve(ata, aty)
+            if x is not None:
+                self.params[stage] = (math.exp(x[0]), x[1], x[2])
+            elif len(records) > 0:
+                # keep the default shape, but scale it to the observed timings
+                ratio = [r["wall"] / self.default_predict((a, b, c), r["bp"], r["ncontigs"]) for r in records]
+                self.params[stage] = (a * math.exp(sum([math.log(v) for v in ratio]) / len(ratio)), b, c)
+            else:
+                self.params[stage] = (a, b, c)
+
+    def fit_memory(self):
+        stages = set([r["stage"] for r in self.records]) | set(self.memorydefaults.keys())
+        for stage in stages:
+            points = [(r["bp"] / 1e6, r["maxrss"] / 1e6) for r in self.records
+                      if r["stage"] == stage and r.get("maxrss", 0) > 0]
+            base, slope = self.memorydefaults.get(stage, (500.0, 20.0))
+            if len(set([x for x, y in points])) >= 2:
+                n = len(points)
+                mx = sum([x for x, y in points]) / n
+                my = sum([y for x, y in points]) / n
+                sxx = sum([(x - mx) ** 2 for x, y in points])
+                slope = max(0.0, sum([(x - mx) * (y - my) for x, y in points]) / sxx)
+                # the line must not predict less than what was observed
+                base = max([y - slope * x for x, y in points])
+            elif len(points) > 0:
+                # scale the defaults up or down to the worst observation
+                ratio = max([y / (base + slope * x) for x, y in points])
+                base, slope = base * ratio, slope * ratio
+            self.memory[stage] = (base, slope)
+
+    def predict_memory(self, stage, bp, ncontigs=0):
+        """
+        predicted peak RSS of a stage in bytes
+        """
+        base, slope = self.memory.get(stage, self.memorydefaults.get(stage, (500.0, 20.0)))
+        return (base + slope * bp / 1e6) * 1e6 * self.memorymargin
+
+    def default_predict(self, params, bp, ncontigs):
+        a, b, c = params
+        f = self.features(bp, ncontigs)
+        return a * math.exp(b * f[1] + c * f[2])
+
+    def predict(self, stage, bp, ncontigs):
+        params = self.params.get(stage, self.defaults.get(stage, (10.0, 1.0, 0.0)))
+        return self.default_predict(params, bp, ncontigs)
+
+    def observe(self, r):
+        """
+        add the timing record of a finished job. It is appended to the
+        history unless the run records its timings there anyway
+        """
+        recorder = timings.current()
+        with self.lock:
+            self.records.append(r)
+            if r.get("maxrss", 0) > 0:
+                self.fit_memory()
+            if self.history is not None and (recorder is None or
+                    os.path.abspath(recorder.path) != os.path.abspath(self.history)):
+                with open(self.history, "a") as fout:
+                    fout.write(json.dumps(r) + "\n")
+
+
+class job:
+    """
+    A unit of work for the scheduler: one stage on one bin. task is the
+    same work as a picklable (function, args, kwargs) tuple for a worker
+    of a distributed run, done is called with the value it returns
+    """
+    def __init__(self, stage, name, bp, ncontigs, func, task=None, done=None):
+        self.stage = stage
+        self.name = name
+        self.bp = bp
+        self.ncontigs = ncontigs
+        self.func = func
+        self.task = task
+        self.done = done
+        self.cost = 0
+        self.memory = 0
+
+
+class scheduler:
+    """
+    Runs jobs in parallel, longest predicted job first (LPT), so large
+    bins do not end up running alone at the end of a stage.
+
+    With a memory budget a job only starts if its predicted peak memory
+    fits next to the running jobs. If the longest job does not fit, a
+    shorter one that does is started instead; a job larger than the whole
+    budget runs alone.
+
+    Parameters:
+
+    **ncores:** total number of cores
+
+    **jobcores:** cores used by each job, ncores // jobcores jobs run at once
+
+    **costs:** costmodel used to order the jobs and to record timings
+
+    **maxmemory:** memory budget in bytes for all running jobs (default: no limit)
+    """
+    def __init__(self, ncores=1, jobcores=None, costs=None, maxmemory=None):
+        self.ncores = ncores
+        self.jobcores = jobcores if jobcores is not None else ncores
+        self.workers = max(1, ncores // max(1, self.jobcores))
+        self.costs = costs if costs is not None else costmodel()
+        self.maxmemory = maxmemory
+
+    def run(self, jobs):
+        for j in jobs:
+            j.cost = self.costs.predict(j.stage, j.bp, j.ncontigs)
+        queue = sorted(jobs, key=lambda j: (-j.cost, j.name))
+        if len(queue) == 0:
+            return
+        logging.debug("Scheduling %d %s jobs on %d workers, predicted total %.0fs" %
+                      (len(queue), queue[0].stage, self.workers, sum([j.cost for j in queue])))
+        cond = threading.Condition()
+        errors = []
+        running = []
+        stage = queue[0].stage
+
+        def state():
+            # state of the queue for the event stream, taken holding cond
+            # and emitted after releasing it
+            return {"stage": stage, "queued": len(queue), "running": len(running),
+                    "cores": len(running) * self.jobcores}
+
+        def admit():
+            # first job in LPT order whose memory fits next to the running ones
+            used = sum([j.memory for j in running])
+            for j in queue:
+                j.memory = self.costs.predict_memory(j.stage, j.bp, j.ncontigs)
+                if len(running) == 0 or self.maxmemory is None or used + j.memory <= self.maxmemory:
+                    if self.maxmemory is not None and j.memory > self.maxmemory:
+                        logging.warning("%s on %s needs about %.1f GB, more than --max-memory, running it alone" %
+                                        (j.stage, j.name, j.memory / 1e9))
+                    return j
+            return None
+
+        def worker():
+            while True:
+                with cond:
+                    while True:
+                        if len(queue) == 0 or len(errors) > 0:
+                            return
+                        j = admit()
+                        if j is not None:
+                            break
+                        cond.wait()
+                    queue.remove(j)
+                    running.append(j)
+                    started = state()
+                events.emit("jobs", **started)
+                s = timings.stage(j.stage, j.name, bp=j.bp, ncontigs=j.ncontigs, predicted=j.cost)
+                try:
+                    with s:
+                        j.func()
+                except Exception as e:
+                    logging.warning("Job %s on %s failed: %s" % (j.stage, j.name, e))
+                    with cond:
+                        errors.append(e)
+                        running.remove(j)
+                        stopped = state()
+                        cond.notify_all()
+                    events.emit("jobs", **stopped)
+                    return
+                self.costs.observe(s.record)
+                with cond:
+                    running.remove(j)
+                    stopped = state()
+                    cond.notify_all()
+                events.emit("jobs", **stopped)
+
+        if self.workers == 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for i in range(min(self.workers, len(queue)))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        if len(errors) > 0:
+            raise errors[0]
+
+    def call(self, stage, func, *args, **kwargs):
+        """
+        run a single step over all bins, e.g. a pooled Diamond search
+        """
+        return func(*args, **kwargs)
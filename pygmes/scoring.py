@@ -0,0 +1,47 @@
+"""
+Scores to compare GeneMark-ES predictions of the same genome made with
+different models. All scores are computed from the CDS records of the
+GTF file, so no protein file needs to be read or indexed.
+Higher scores are better.
+"""
+import re
+from collections import defaultdict
+
+
+def gtf_stats(gtf):
+    """
+    number of genes, coding bp and codons of a GeneMark-ES GTF file
+    """
+    nre = re.compile(r'gene_id "([0-9]+_g)\";')
+    cds = defaultdict(int)
+    with open(gtf) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            l = line.split("\t")
+            if len(l) < 9 or l[2] != "CDS":
+                continue
+            m = nre.findall(l[8])
+            if len(m) == 0:
+                continue
+            cds[m[0]] += int(l[4]) - int(l[3]) + 1
+    return {"genes": len(cds),
+            "cdsbp": sum(cds.values()),
+            "aa": sum([v // 3 for v in cds.values()])}
+
+
+def total_aa(stats, genomebp):
+    return stats["aa"]
+
+
+def gene_count(stats, genomebp):
+    return stats["genes"]
+
+
+def coding_density(stats, genomebp):
+    if genomebp == 0:
+        return 0
+    return stats["cdsbp"] / genomebp
+
+
+SCORERS = {"aa": total_aa, "genes": gene_count, "density": coding_density}
@@ -0,0 +1,60 @@
+import os
+import logging
+import shutil
+import tempfile
+
+
+def publish(src, dst):
+    """
+    move a file into place atomically. If src is on another file system
+    it is first copied next to dst and then renamed
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = "{}.pygmes_tmp".format(dst)
+    shutil.move(src, tmp)
+    os.replace(tmp, dst)
+
+
+class staging:
+    """
+    Context manager giving a tool a working directory.
+
+    Without scratch the tool works in outdir directly, as always.
+    With scratch a private folder on the local disk is used instead and
+    only the files listed in keep (paths relative to the working directory)
+    are moved to outdir when the block finishes without an exception.
+    The scratch folder is always removed.
+
+    Parameters:
+
+    **outdir:** final output folder
+
+    **scratch:** node local folder (tmpfs/SSD) or None
+
+    **keep:** list of relative paths to publish to outdir
+    """
+    def __init__(self, outdir, scratch=None, keep=[]):
+        self.outdir = outdir
+        self.scratch = scratch
+        self.keep = keep
+        self.workdir = outdir
+
+    def __enter__(self):
+        if self.scratch is not None:
+            os.makedirs(self.scratch, exist_ok=True)
+            self.workdir = tempfile.mkdtemp(prefix="pygmes_", dir=self.scratch)
+            logging.debug("Staging %s in %s" % (self.outdir, self.workdir))
+        return self.workdir
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.scratch is None:
+            return False
+        try:
+            if exc_type is None:
+                for rel in self.keep:
+                    src = os.path.join(self.workdir, rel)
+                    if os.path.exists(src):
+                        publish(src, os.path.join(self.outdir, rel))
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return False
@@ -0,0 +1,144 @@
+import os
+import logging
+import sqlite3
+import zlib
+from pygmes.exec import create_dir
+
+
+class resultstore:
+    """
+    Single file container for the final results of pygmes --meta.
+
+    Proteins and bed records of each bin are stored compressed in one
+    row, so a single bin can be extracted with one indexed lookup instead
+    of walking thousands of small files.
+
+    Parameters:
+
+    **path:** path to the SQLite file
+
+    **readonly:** open an existing store without creating tables
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS bins (
+            name TEXT PRIMARY KEY,
+            fasta TEXT,
+            software TEXT,
+            nprot INTEGER,
+            lng TEXT,
+            lngn INTEGER,
+            faa BLOB,
+            bed BLOB
+        )""",
+        """CREATE TABLE IF NOT EXISTS status (
+            bin TEXT,
+            stage TEXT,
+            status TEXT,
+            PRIMARY KEY (bin, stage)
+        )""",
+    ]
+
+    def __init__(self, path, readonly=False):
+        self.path = os.path.abspath(path)
+        if readonly:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(self.path)
+            self.con = sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True)
+        else:
+            create_dir(os.path.dirname(self.path))
+            self.con = sqlite3.connect(self.path)
+            for statement in self.schema:
+                self.con.execute(statement)
+            self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_bin(self, name, fasta=None, faa=None, bed=None, software=None,
+                nprot=None, lng=None, status=None):
+        """
+        add or replace a bin. faa and bed are paths to the final files,
+        lng is a dict with the keys lng and n as produced by multidiamond
+        """
+        def readblob(path):
+            if path is None or not os.path.exists(path):
+                return None
+            with open(path, "rb") as fin:
+                return zlib.compress(fin.read())
+
+        lngstr = None
+        lngn = None
+        if lng is not None:
+            lngstr = "-".join([str(x) for x in lng['lng']])
+            lngn = lng['n']
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO bins VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (name, fasta, software, nprot, lngstr, lngn,
+                              readblob(faa), readblob(bed)))
+            self.con.execute("DELETE FROM status WHERE bin = ?", (name,))
+            if status is not None:
+                self.con.executemany("INSERT INTO status VALUES (?, ?, ?)",
+                                     [(name, k, str(v)) for k, v in status.items()])
+
+    def remove(self, name):
+        with self.con:
+            self.con.execute("DELETE FROM bins WHERE name = ?", (name,))
+            self.con.execute("DELETE FROM status WHERE bin = ?", (name,))
+
+    def names(self):
+        return [r[0] for r in self.con.execute("SELECT name FROM bins ORDER BY name")]
+
+    def get(self, name):
+        """
+        return the metadata of a bin as a dict or None if the bin is unknown
+        """
+        row = self.con.execute("SELECT fasta, software, nprot, lng, lngn FROM bins WHERE name = ?",
+                               (name,)).fetchone()
+        if row is None:
+            return None
+        lng = []
+        if row[3]:
+            lng = [int(x) for x in row[3].split("-")]
+        status = dict(self.con.execute("SELECT stage, status FROM status WHERE bin = ?", (name,)))
+        return {"name": name, "fasta": row[0], "software": row[1], "nprot": row[2],
+                "lng": lng, "n": row[4], "status": status}
+
+    def _blob(self, name, column):
+        row = self.con.execute("SELECT {} FROM bins WHERE name = ?".format(column),
+                               (name,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode()
+
+    def faa(self, name):
+        return self._blob(name, "faa")
+
+    def bed(self, name):
+        return self._blob(name, "bed")
+
+    def extract(self, name, outdir):
+        """
+        write faa, bed and lineage of a single bin to outdir
+        """
+        info = self.get(name)
+        if info is None:
+            logging.warning("Bin %s is not in the store" % name)
+            return False
+        create_dir(outdir)
+        for ext, content in [("faa", self.faa(name)), ("bed", self.bed(name))]:
+            if content is None:
+                continue
+            with open(os.path.join(outdir, "{}.{}".format(name, ext)), "w") as fout:
+                fout.write(content)
+        with open(os.path.join(outdir, "{}.lineage.txt".format(name)), "w") as fout:
+            fout.write("#taxidlineage: {}\n".format("-".join([str(x) for x in info['lng']])))
+            fout.write("software\t{}\n".format(info['software']))
+            for stage, status in info['status'].items():
+                fout.write("{}\t{}\n".format(stage, status))
+        return True
@@ -0,0 +1,302 @@
+import os
+import sys
+import io
+import json
+import mmap
+import array
+import logging
+import threading
+from bisect import bisect_left
+
+# taxa.sqlite to use instead of the ete3 default (~/.etetoolkit/taxa.sqlite)
+DBFILE = os.environ.get("PYGMES_TAXDB")
+# snapshot made by 'pygmes taxonomy build', used instead of ete3 if present
+SNAPSHOT = os.environ.get("PYGMES_TAXONOMY")
+DEFAULT_SNAPSHOT = os.path.join(os.path.expanduser("~"), ".cache", "pygmes", "taxonomy")
+
+SNAPSHOT_VERSION = 1
+
+_local = threading.local()
+_lock = threading.Lock()
+_snapshots = {}
+
+
+def set_dbfile(dbfile):
+    """
+    use the NCBI taxonomy in dbfile from now on
+    """
+    global DBFILE, SNAPSHOT
+    DBFILE = os.path.abspath(dbfile) if dbfile is not None else None
+    SNAPSHOT = None
+    logging.debug("Using the taxonomy in %s" % DBFILE)
+
+
+def set_snapshot(path):
+    """
+    use the taxonomy snapshot in path from now on
+    """
+    global SNAPSHOT
+    SNAPSHOT = os.path.abspath(path) if path is not None else None
+    logging.debug("Using the taxonomy snapshot in %s" % SNAPSHOT)
+
+
+def snapshot_path():
+    """
+    folder of the snapshot to use or None to use ete3. The default
+    snapshot is only used if it exists and no taxa.sqlite was chosen
+    """
+    if SNAPSHOT is not None:
+        return SNAPSHOT
+    if DBFILE is None and os.path.exists(os.path.join(DEFAULT_SNAPSHOT, "meta.json")):
+        return DEFAULT_SNAPSHOT
+    return None
+
+
+def get_ncbi():
+    """
+    taxonomy to translate taxids with. A snapshot is read only and shared
+    by all threads. Otherwise a NCBITaxa instance of the calling thread:
+    opening the database is slow and sqlite connections can not be shared
+    between threads, so each thread keeps its own
+    """
+    path = snapshot_path()
+    if path is not None:
+        with _lock:
+            if path not in _snapshots:
+                _snapshots[path] = snapshot(path)
+            return _snapshots[path]
+    ncbi = getattr(_local, "ncbi", None)
+    if ncbi is None or getattr(_local, "dbfile", None) != DBFILE:
+        # ete3 takes long to import, so only when the taxonomy is needed
+        from ete3 import NCBITaxa
+        ncbi = NCBITaxa(dbfile=DBFILE) if DBFILE is not None else NCBITaxa()
+        _local.ncbi = ncbi
+        _local.dbfile = DBFILE
+    return ncbi
+
+
+def translate(lngs):
+    """
+    names and ranks of all taxids in the lineages lngs, looked up at once
+    """
+    taxids = set()
+    for lng in lngs:
+        taxids.update(lng)
+    taxids = sorted(taxids)
+    if len(taxids) == 0:
+        return {}, {}
+    ncbi = get_ncbi()
+    return ncbi.get_taxid_translator(taxids), ncbi.get_rank(taxids)
+
+
+def uint32():
+    for code in ["I", "L"]:
+        if array.array(code).itemsize == 4:
+            return code
+    raise RuntimeError("No 32 bit unsigned integer array type")
+
+
+def mapped(path, code, byteorder):
+    """
+    read only view of an array file. The pages are shared with every other
+    process mapping the same file. Files of another byte order are copied
+    """
+    with open(path, "rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size == 0:
+            return array.array(code)
+        if byteorder != sys.byteorder and array.array(code).itemsize > 1:
+            a = array.array(code)
+            a.frombytes(fin.read())
+            a.byteswap()
+            return a
+        m = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(m).cast(code)
+
+
+class snapshot:
+    """
+    NCBI taxonomy as flat arrays indexed by taxid, made by build().
+
+    parents.bin holds the parent of each taxid (0 for unused taxids),
+    ranks.bin an index into the rank table of meta.json and names.bin the
+    offsets of the scientific names in names.txt. merged.bin holds the
+    sorted merged taxids and their new taxids. All arrays are memory mapped,
+    so a lineage is a walk over at most a few dozen array entries and
+    concurrent workers share the same pages. Implements the parts of
+    ete3.NCBITaxa pygmes uses.
+
+    Parameters:
+
+    **path:** folder written by build()
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fin:
+            self.meta = json.load(fin)
+        if self.meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Taxonomy snapshot %s has version %s, rebuild it with 'pygmes taxonomy build'"
+                             % (path, self.meta.get("version")))
+        order = self.meta["byteorder"]
+        code = uint32()
+        self.rankset = self.meta["ranks"]
+        self.parents = mapped(os.path.join(path, "parents.bin"), code, order)
+        self.ranks = mapped(os.path.join(path, "ranks.bin"), "B", order)
+        self.offsets = mapped(os.path.join(path, "names.bin"), code, order)
+        self.names = mapped(os.path.join(path, "names.txt"), "B", order)
+        merged = mapped(os.path.join(path, "merged.bin"), code, order)
+        n = len(merged) // 2
+        self.mergedold = merged[:n]
+        self.mergednew = merged[n:]
+
+    def translate(self, taxid):
+        """
+        current taxid of taxid or None if it is unknown
+        """
+        if 0 < taxid < len(self.parents) and self.parents[taxid] != 0:
+            return taxid
+        i = bisect_left(self.mergedold, taxid)
+        if i < len(self.mergedold) and self.mergedold[i] == taxid:
+            return self.mergednew[i]
+        return None
+
+    def get_lineage(self, taxid):
+        """
+        taxids from the root to taxid, like NCBITaxa.get_lineage
+        """
+        t = self.translate(int(taxid))
+        if t is None:
+            raise ValueError("%s taxid not found" % taxid)
+        parents = self.parents
+        lng = [t]
+        while t != 1:
+            t = parents[t]
+            # a chain that reaches a taxid without a row or loops comes
+            # from an inconsistent taxdump
+            if not 0 < t < len(parents) or parents[t] == 0 or len(lng) > len(parents):
+                raise ValueError("%s taxid not found" % taxid)
+            lng.append(t)
+        lng.reverse()
+        return lng
+
+    def get_rank(self, taxids):
+        """
+        rank of each known taxid
+        """
+        ranks = {}
+        for taxid in taxids:
+            t = self.translate(int(taxid))
+            if t is not None:
+                ranks[taxid] = self.rankset[self.ranks[t]]
+        return ranks
+
+    def get_taxid_translator(self, taxids):
+        """
+        scientific name of each known taxid
+        """
+        names = {}
+        for taxid in taxids:
+            t = self.translate(int(taxid))
+            if t is not None:
+                names[taxid] = bytes(self.names[self.offsets[t]:self.offsets[t + 1]]).decode("utf-8")
+        return names
+
+
+def read_dmp(fin):
+    """
+    fields of each line of a NCBI .dmp file
+    """
+    for line in fin:
+        yield line.rstrip("\t|\n").split("\t|\t")
+
+
+def open_dmp(taxdump, name):
+    """
+    open name from a taxdump.tar.gz or a folder with the .dmp files
+    """
+    if os.path.isdir(taxdump):
+        path = os.path.join(taxdump, name)
+        if name == "merged.dmp" and not os.path.exists(path):
+            return io.StringIO()
+        return open(path, encoding="utf-8", errors="replace")
+    import tarfile
+    tar = tarfile.open(taxdump, "r:gz")
+    try:
+        member = tar.extractfile(name)
+    except KeyError:
+        if name == "merged.dmp":
+            return io.StringIO()
+        raise
+    return io.TextIOWrapper(member, encoding="utf-8", errors="replace")
+
+
+def build(taxdump, outdir):
+    """
+    convert the NCBI taxdump (taxdump.tar.gz or a folder with nodes.dmp,
+    names.dmp and merged.dmp) into a snapshot in outdir
+    """
+    os.makedirs(outdir, exist_ok=True)
+    code = uint32()
+    logging.info("Reading nodes")
+    nodes = []
+    ranks = {}
+    with open_dmp(taxdump, "nodes.dmp") as fin:
+        for l in read_dmp(fin):
+            rank = ranks.setdefault(l[2], len(ranks))
+            nodes.append((int(l[0]), int(l[1]), rank))
+    if len(ranks) > 255:
+        raise ValueError("Too many ranks in %s" % taxdump)
+    size = max([n[0] for n in nodes]) + 1
+    parents = array.array(code, bytes(4 * size))
+    rankarray = array.array("B", bytes(size))
+    for taxid, parent, rank in nodes:
+        parents[taxid] = parent
+        rankarray[taxid] = rank
+    del nodes
+
+    logging.info("Reading names")
+    names = {}
+    with open_dmp(taxdump, "names.dmp") as fin:
+        for l in read_dmp(fin):
+            if l[3] == "scientific name":
+                names[int(l[0])] = l[1].encode("utf-8")
+    offsets = array.array(code, bytes(4 * (size + 1)))
+    blob = bytearray()
+    for taxid in range(size):
+        offsets[taxid] = len(blob)
+        if taxid in names:
+            blob += names[taxid]
+    offsets[size] = len(blob)
+
+    merged = []
+    with open_dmp(taxdump, "merged.dmp") as fin:
+        for l in read_dmp(fin):
+            merged.append((int(l[0]), int(l[1])))
+    merged.sort()
+    mergedarray = array.array(code, [m[0] for m in merged] + [m[1] for m in merged])
+
+    # write all files first and meta.json last, so a snapshot is only
+    # seen once it is complete
+    def write(name, data):
+        tmp = os.path.join(outdir, name + ".tmp")
+        with open(tmp, "wb") as fout:
+            fout.write(data)
+        os.replace(tmp, os.path.join(outdir, name))
+
+    metafile = os.path.join(outdir, "meta.json")
+    if os.path.exists(metafile):
+        os.remove(metafile)
+    write("parents.bin", parents.tobytes())
+    write("ranks.bin", rankarray.tobytes())
+    write("names.bin", offsets.tobytes())
+    write("names.txt", bytes(blob))
+    write("merged.bin", mergedarray.tobytes())
+    meta = {"version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "ranks": [r for r, i in sorted(ranks.items(), key=lambda x: x[1])],
+            "ntaxa": len(names),
+            "nmerged": len(merged),
+            "source": os.path.abspath(taxdump)}
+    write("meta.json", json.dumps(meta, indent=2).encode())
+    logging.info("Wrote taxonomy snapshot with %d taxa to %s" % (len(names), outdir))
+    return outdir
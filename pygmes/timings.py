@@ -0,0 +1,189 @@
+"""
+Where a run spends its time. Each stage, on each bin, is recorded with
+its wall time, the CPU time of pygmes and of the tools it ran, the time
+spent waiting for the tools, the peak RSS of the tools and the bytes read
+and written, as one JSON line in timings.jsonl next to metadata.tsv.
+"""
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from pygmes.jobs import accounting
+from pygmes import events
+
+_recorder = None
+_profiler = None
+_current = threading.local()
+
+
+def threadio():
+    """
+    bytes read and written by the calling thread so far
+    """
+    try:
+        with open("/proc/thread-self/io") as fin:
+            io = dict(line.split(": ") for line in fin.read().splitlines())
+        return int(io["rchar"]), int(io["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+class recorder:
+    """
+    Collects the stage records of a run and appends them to path.
+
+    Parameters:
+
+    **path:** JSON lines file the records are appended to
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            with open(self.path, "a") as fout:
+                fout.write(json.dumps(record) + "\n")
+
+    def summary(self, n=5):
+        """
+        log the stages and bins that took longest. Nested stages are
+        already contained in their parents and are not counted
+        """
+        stages = defaultdict(float)
+        bins = defaultdict(float)
+        for r in self.records:
+            if r.get("parent") is not None:
+                continue
+            stages[r["stage"]] += r["wall"]
+            if r.get("bin") is not None:
+                bins[r["bin"]] += r["wall"]
+        if len(stages) == 0:
+            return
+        logging.info("Slowest stages: %s" % ", ".join(["%s %.1fs" % (s, w) for s, w in
+                     sorted(stages.items(), key=lambda x: -x[1])[:n]]))
+        if len(bins) > 0:
+            logging.info("Slowest bins: %s" % ", ".join(["%s %.1fs" % (b, w) for b, w in
+                         sorted(bins.items(), key=lambda x: -x[1])[:n]]))
+        logging.info("Timings written to %s" % self.path)
+
+
+def configure(path):
+    """
+    record all following stages of this process in path
+    """
+    global _recorder
+    _recorder = recorder(path)
+    return _recorder
+
+
+def current():
+    return _recorder
+
+
+def profile(profiler):
+    """
+    hand every following stage to profiler (see pygmes.profiling), None
+    stops profiling
+    """
+    global _profiler
+    _profiler = profiler
+
+
+class collect:
+    """
+    context manager that collects the records of all stages the calling
+    thread stops inside it, e.g. to send them from a worker to the
+    coordinator of a distributed run
+    """
+    def __enter__(self):
+        self.parent = getattr(_current, "records", None)
+        self.records = []
+        _current.records = self.records
+        return self.records
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.records = self.parent
+        if self.parent is not None:
+            self.parent.extend(self.records)
+        return False
+
+
+class stage:
+    """
+    Records one stage, as a context manager or with start and stop.
+    Stages started inside another stage of the same thread are nested:
+    they inherit the bin of their parent and name it in the record.
+    Extra keyword arguments are stored in the record.
+
+    Parameters:
+
+    **name:** name of the stage, e.g. prodigal or diamond_1
+
+    **binname:** bin the stage works on, None for stages over all bins
+    """
+    def __init__(self, name, binname=None, **fields):
+        self.name = name
+        self.binname = binname
+        self.fields = fields
+        self.record = None
+
+    def start(self):
+        self.parent = getattr(_current, "stage", None)
+        if self.binname is None and self.parent is not None:
+            self.binname = self.parent.binname
+        _current.stage = self
+        self.profiler = _profiler
+        if self.profiler is not None:
+            self.profiler.enter(self)
+        events.emit("start", stage=self.name, bin=self.binname,
+                    parent=self.parent.name if self.parent is not None else None)
+        self.accounting = accounting()
+        self.usage = self.accounting.__enter__()
+        self.wall = time.time()
+        self.cpu = time.thread_time()
+        self.io = threadio()
+        return self
+
+    def stop(self, error=None):
+        wall = time.time() - self.wall
+        cpu = time.thread_time() - self.cpu
+        rchar, wchar = threadio()
+        self.accounting.__exit__(None, None, None)
+        if self.profiler is not None:
+            self.profiler.exit(self)
+        _current.stage = self.parent
+        self.record = {"stage": self.name,
+                       "bin": self.binname,
+                       "parent": self.parent.name if self.parent is not None else None,
+                       "start": round(self.wall, 3),
+                       "wall": wall,
+                       "cpu": cpu,
+                       "childcpu": self.usage["cpu"],
+                       "wait": self.usage["wait"],
+                       "maxrss": self.usage["maxrss"],
+                       "read": rchar - self.io[0],
+                       "write": wchar - self.io[1],
+                       "childread": self.usage["inblock"] * 512,
+                       "childwrite": self.usage["oublock"] * 512}
+        self.record.update(self.fields)
+        if error is not None:
+            self.record["error"] = error
+        events.emit("finish", stage=self.name, bin=self.binname, wall=round(wall, 3), cpu=round(cpu, 3),
+                    wait=round(self.usage["wait"], 3), error=error)
+        if _recorder is not None:
+            _recorder.add(self.record)
+        records = getattr(_current, "records", None)
+        if records is not None:
+            records.append(self.record)
+        return self.record
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop(None if exc_type is None else exc_type.__name__)
+        return False
@@ -0,0 +1,58 @@
+import os
+import logging
+from pygmes.composition import contig_lengths
+
+
+def length_index(fasta, outdir):
+    """
+    contig lengths of fasta as a dict. The index is kept in
+    outdir/contigs.tsv and only rebuilt if the fasta is newer
+    """
+    indexfile = os.path.join(outdir, "contigs.tsv")
+    if os.path.exists(indexfile) and os.path.getmtime(indexfile) >= os.path.getmtime(fasta):
+        lengths = {}
+        with open(indexfile) as fin:
+            for line in fin:
+                l = line.rstrip("\n").split("\t")
+                if len(l) == 2:
+                    lengths[l[0]] = int(l[1])
+        return lengths
+    lengths = contig_lengths(fasta)
+    tmp = "{}.tmp".format(indexfile)
+    with open(tmp, "w") as fout:
+        for name, length in lengths.items():
+            fout.write("{}\t{}\n".format(name, length))
+    os.replace(tmp, indexfile)
+    return lengths
+
+
+def n50(lengths):
+    lengths = sorted(lengths, reverse=True)
+    half = sum(lengths) / 2
+    total = 0
+    for l in lengths:
+        total += l
+        if total >= half:
+            return l
+    return 0
+
+
+def triage(lengths, min_contig=5000, min_bp=1000000, min_n50=2000):
+    """
+    predict if GeneMark-ES self-training can succeed on a genome with the
+    given contig lengths. GeneMark-ES only trains on contigs of at least
+    min_contig bp, so we need min_bp in those contigs and an N50 of at
+    least min_n50. Returns the decision and the numbers it is based on
+    """
+    values = list(lengths.values())
+    info = {"trainbp": sum([l for l in values if l >= min_contig]),
+            "n50": n50(values)}
+    if info["trainbp"] < min_bp:
+        info["triage"] = "hopeless (<{} bp in contigs >={} bp)".format(min_bp, min_contig)
+    elif info["n50"] < min_n50:
+        info["triage"] = "hopeless (N50 <{})".format(min_n50)
+    else:
+        info["triage"] = "train"
+    logging.debug("Triage: %d bp in contigs >= %d, N50 %d: %s" %
+                  (info["trainbp"], min_contig, info["n50"], info["triage"]))
+    return info["triage"] == "train", info
@@ -0,0 +1,460 @@
+"""
+Work queue on a shared file system, so the bins of one metapygmes run can
+be processed by workers on many nodes. The queue is a SQLite file next to
+the results, no broker is needed: the coordinator adds the tasks of a
+stage, `pygmes worker` processes claim them with a lease they renew while
+the task runs, and tasks whose lease runs out because their worker died
+are handed to the next worker.
+
+SQLite locking needs a file system with working POSIX locks (NFSv4,
+Lustre, GPFS, BeeGFS). The clocks of the nodes should be synchronized.
+"""
+import os
+import time
+import json
+import socket
+import pickle
+import random
+import logging
+import sqlite3
+import threading
+from pygmes import timings
+from pygmes import events
+from pygmes.scheduler import costmodel
+import pygmes.version as version
+
+LEASE = 300.0
+MAXATTEMPTS = 3
+
+
+class workqueue:
+    """
+    Tasks of a distributed run in a SQLite file.
+
+    A task is a pickled (function, args, kwargs, fields) tuple, its result
+    the pickled return value. fields are stored in the timing record of
+    the task, None if the coordinator records the stage itself. Tasks are added in batches, one per stage, and
+    claimed largest predicted runtime first. A running task whose lease
+    expired is claimable again, up to MAXATTEMPTS times.
+
+    Parameters:
+
+    **path:** path to the queue file, created if needed
+
+    **lease:** seconds a claimed task stays with its worker without a heartbeat
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            batch TEXT,
+            stage TEXT,
+            name TEXT,
+            priority REAL,
+            state TEXT,
+            payload BLOB,
+            result BLOB,
+            records TEXT,
+            error TEXT,
+            worker TEXT,
+            lease REAL,
+            attempts INTEGER DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS taskstate ON tasks (state, priority)",
+        """CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY,
+            host TEXT,
+            pid INTEGER,
+            slots INTEGER,
+            started REAL,
+            heartbeat REAL
+        )""",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ]
+
+    def __init__(self, path, lease=LEASE):
+        self.path = os.path.abspath(path)
+        self.lease = lease
+        self.local = threading.local()
+        with self.transaction() as con:
+            for statement in self.schema:
+                con.execute(statement)
+
+    def connection(self):
+        # sqlite connections can not be shared between threads
+        con = getattr(self.local, "con", None)
+        if con is None:
+            # the rollback journal, WAL needs shared memory between the nodes
+            con = sqlite3.connect(self.path, timeout=600, isolation_level=None)
+            con.execute("PRAGMA journal_mode=DELETE")
+            self.local.con = con
+        return con
+
+    def transaction(self):
+        queue = self
+
+        class transaction:
+            def __enter__(self):
+                self.con = queue.connection()
+                # take the write lock right away, so two workers can not
+                # claim the same task
+                self.con.execute("BEGIN IMMEDIATE")
+                return self.con
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                self.con.execute("COMMIT" if exc_type is None else "ROLLBACK")
+                return False
+        return transaction()
+
+    def set(self, key, value):
+        with self.transaction() as con:
+            con.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get(self, key, default=None):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def put(self, batch, tasks):
+        """
+        add tasks, a list of (stage, name, priority, task)
+        """
+        with self.transaction() as con:
+            con.execute("DELETE FROM tasks WHERE batch = ?", (batch,))
+            con.executemany("INSERT INTO tasks (batch, stage, name, priority, state, payload) "
+                            "VALUES (?, ?, ?, ?, 'queued', ?)",
+                            [(batch, stage, name, priority, pickle.dumps(task))
+                             for stage, name, priority, task in tasks])
+
+    def expired(self, con, now):
+        """
+        queue the running tasks whose lease ran out again, or fail them
+        after MAXATTEMPTS attempts
+        """
+        con.execute("UPDATE tasks SET state = 'failed', error = 'lease expired ' || attempts || ' times' "
+                    "WHERE state = 'running' AND lease < ? AND attempts >= ?", (now, MAXATTEMPTS))
+        rows = con.execute("SELECT id, stage, name, worker FROM tasks WHERE state = 'running' AND lease < ?",
+                           (now,)).fetchall()
+        for taskid, stage, name, worker in rows:
+            logging.warning("Task %s on %s of worker %s timed out, queueing it again" % (stage, name, worker))
+            con.execute("UPDATE tasks SET state = 'queued', worker = NULL WHERE id = ?", (taskid,))
+
+    def expire(self):
+        """
+        handle the tasks whose lease ran out, also when no worker claims
+        """
+        with self.transaction() as con:
+            self.expired(con, time.time())
+
+    def claim(self, worker):
+        """
+        claim the queued task with the highest priority, after queueing
+        tasks whose lease ran out again. Returns (id, stage, name, task) or None
+        """
+        now = time.time()
+        with self.transaction() as con:
+            self.expired(con, now)
+            row = con.execute("SELECT id, stage, name, payload FROM tasks WHERE state = 'queued' "
+                              "ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE tasks SET state = 'running', worker = ?, lease = ?, attempts = attempts + 1 "
+                        "WHERE id = ?", (worker, now + self.lease, row[0]))
+        return row[0], row[1], row[2], pickle.loads(row[3])
+
+    def heartbeat(self, worker, taskids=[]):
+        """
+        renew the leases of the tasks of worker, returns the ids of the
+        tasks it still holds
+        """
+        now = time.time()
+        held = []
+        with self.transaction() as con:
+            con.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, worker))
+            for taskid in taskids:
+                c = con.execute("UPDATE tasks SET lease = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                                (now + self.lease, taskid, worker))
+                if c.rowcount > 0:
+                    held.append(taskid)
+        return held
+
+    def finish(self, worker, taskid, result=None, records=None, error=None):
+        """
+        store the result of a task, unless another worker took it over
+        """
+        with self.transaction() as con:
+            c = con.execute("UPDATE tasks SET state = ?, result = ?, records = ?, error = ? "
+                            "WHERE id = ? AND worker = ? AND state = 'running'",
+                            ("failed" if error is not None else "done",
+                             pickle.dumps(result) if error is None else None,
+                             json.dumps(records or []), error, taskid, worker))
+            return c.rowcount > 0
+
+    def progress(self, batch):
+        """
+        number of tasks of batch in each state
+        """
+        return dict(self.connection().execute("SELECT state, count(*) FROM tasks WHERE batch = ? GROUP BY state",
+                                              (batch,)).fetchall())
+
+    def results(self, batch):
+        """
+        (name, result, records, error) of each finished task of batch
+        """
+        rows = self.connection().execute("SELECT id, name, result, records, error FROM tasks "
+                                         "WHERE batch = ? ORDER BY id", (batch,)).fetchall()
+        return [(r[1], pickle.loads(r[2]) if r[2] is not None else None, json.loads(r[3] or "[]"), r[4])
+                for r in rows]
+
+    def register(self, worker, slots):
+        now = time.time()
+        with self.transaction() as con:
+            con.execute("INSERT OR REPLACE INTO workers VALUES (?, ?, ?, ?, ?, ?)",
+                        (worker, socket.gethostname(), os.getpid(), slots, now, now))
+
+    def live_workers(self):
+        since = time.time() - self.lease
+        return self.connection().execute("SELECT count(*) FROM workers WHERE heartbeat >= ?",
+                                         (since,)).fetchone()[0]
+
+    def reset(self, settings={}):
+        """
+        start a new run: drop the tasks of earlier runs and store the
+        settings the workers need, e.g. the taxonomy to use
+        """
+        with self.transaction() as con:
+            con.execute("DELETE FROM tasks")
+            con.execute("DELETE FROM meta")
+            con.execute("INSERT INTO meta VALUES ('version', ?)", (json.dumps(version.__version__),))
+            for key, value in settings.items():
+                con.execute("INSERT INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def close(self):
+        """
+        tell the workers that no more tasks will come
+        """
+        self.set("closed", True)
+
+
+def wait_for_queue(path, timeout, poll=1.0):
+    """
+    wait until the coordinator created the queue at path and started its
+    run. Returns False if that did not happen within timeout seconds
+    """
+    start = time.time()
+    while True:
+        if os.path.exists(path) and workqueue(path).get("version") is not None:
+            return True
+        if time.time() - start > timeout:
+            return False
+        time.sleep(poll)
+
+
+class distributed:
+    """
+    Drop in for the scheduler that runs the jobs of a stage as tasks of a
+    work queue and waits until workers on any node have done all of them,
+    which makes every stage a barrier. The bins in the coordinator are
+    updated with the state the workers return.
+
+    Parameters:
+
+    **queue:** workqueue to put the tasks into
+
+    **costs:** costmodel used to order the tasks and to record timings
+
+    **poll:** seconds between checks of the queue
+    """
+    def __init__(self, queue, costs=None, poll=5.0):
+        self.queue = queue
+        self.costs = costs if costs is not None else costmodel()
+        self.poll = poll
+        self.batches = 0
+
+    def wait(self, batch, ntasks, stage):
+        """
+        wait until all tasks of batch are done or failed. Fails if no
+        worker was alive for longer than a lease
+        """
+        last = None
+        noworkers = None
+        while True:
+            # leases of dead workers run out even if no one claims
+            self.queue.expire()
+            progress = self.queue.progress(batch)
+            done = progress.get("done", 0) + progress.get("failed", 0)
+            workers = self.queue.live_workers()
+            events.emit("jobs", stage=stage, queued=progress.get("queued", 0), running=progress.get("running", 0),
+                        done=done, workers=workers)
+            if done >= ntasks:
+                return
+            if workers > 0:
+                noworkers = None
+            elif noworkers is None:
+                noworkers = time.time()
+            elif time.time() - noworkers > self.queue.lease:
+                raise RuntimeError("No live worker for {:.0f}s, {} of {} {} tasks are not done. "
+                                   "Start workers with: pygmes worker {}".format(
+                                       time.time() - noworkers, ntasks - done, ntasks, stage, self.queue.path))
+            if progress != last:
+                logging.info("%s: %d of %d tasks done, %d running on %d workers" %
+                             (stage, done, ntasks, progress.get("running", 0), workers))
+                last = progress
+            time.sleep(self.poll)
+
+    def submit(self, stage, tasks):
+        """
+        run tasks, a list of (name, priority, task), and return their
+        results in the same order
+        """
+        self.batches += 1
+        batch = "{}-{}".format(self.batches, stage)
+        self.queue.put(batch, [(stage, name, priority, task) for name, priority, task in tasks])
+        self.wait(batch, len(tasks), stage)
+        recorder = timings.current()
+        results = []
+        errors = []
+        for name, result, records, error in self.queue.results(batch):
+            if error is not None:
+                logging.warning("Task %s on %s failed: %s" % (stage, name, error))
+                errors.append(error)
+            for r in records:
+                if recorder is not None:
+                    recorder.add(r)
+                if r.get("parent") is None and r.get("bin") is not None:
+                    self.costs.observe(r)
+            results.append(result)
+        if len(errors) > 0:
+            raise RuntimeError("{} of {} {} tasks failed: {}".format(len(errors), len(tasks), stage, errors[0]))
+        return results
+
+    def run(self, jobs):
+        jobs = [j for j in jobs]
+        if len(jobs) == 0:
+            return
+        for j in jobs:
+            j.cost = self.costs.predict(j.stage, j.bp, j.ncontigs)
+        results = self.submit(jobs[0].stage, [(j.name, j.cost, j.task + ({"bp": j.bp, "ncontigs": j.ncontigs,
+                                               "predicted": j.cost},)) for j in jobs])
+        for j, result in zip(jobs, results):
+            if j.done is not None:
+                j.done(result)
+
+    def call(self, stage, func, *args, **kwargs):
+        """
+        run a single task over all bins, e.g. a pooled Diamond search
+        """
+        # the coordinator records the stage, the worker only nested ones
+        return self.submit(stage, [(None, 0, (func, args, kwargs, None))])[0]
+
+
+def execute(task, stage, name):
+    """
+    run a task and collect the timing records of its stages
+    """
+    func, args, kwargs, fields = task
+    with timings.collect() as records:
+        if fields is None:
+            result = func(*args, **kwargs)
+        else:
+            with timings.stage(stage, name, **fields):
+                result = func(*args, **kwargs)
+    return result, records
+
+
+class worker:
+    """
+    Claims and runs tasks of a work queue until the coordinator closes it.
+
+    Parameters:
+
+    **queue:** workqueue to take the tasks from
+
+    **slots:** number of tasks run at once
+
+    **idle:** exit after this many seconds without a task (default: wait until the queue is closed)
+
+    **poll:** seconds between checks for new tasks
+    """
+    def __init__(self, queue, slots=1, idle=None, poll=5.0):
+        self.queue = queue
+        self.slots = slots
+        self.idle = idle
+        self.poll = poll
+        self.id = "{}:{}:{}".format(socket.gethostname(), os.getpid(), int(time.time()))
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def configure(self):
+        """
+        use the settings of the coordinator that are not part of the tasks
+        """
+        from pygmes import taxonomy
+        if self.queue.get("version") not in [None, version.__version__]:
+            logging.warning("The coordinator runs pygmes %s, this worker %s" %
+                            (self.queue.get("version"), version.__version__))
+        if self.queue.get("taxdb") is not None:
+            taxonomy.set_dbfile(self.queue.get("taxdb"))
+        if self.queue.get("taxonomy") is not None:
+            taxonomy.set_snapshot(self.queue.get("taxonomy"))
+
+    def beat(self):
+        while not self.stopped.wait(self.queue.lease / 5):
+            with self.lock:
+                taskids = list(self.running)
+            try:
+                held = self.queue.heartbeat(self.id, taskids)
+            except sqlite3.Error as e:
+                logging.warning("Heartbeat failed: %s" % e)
+                continue
+            for taskid in set(taskids) - set(held):
+                logging.warning("Lost the lease of task %d to another worker" % taskid)
+
+    def slot(self):
+        last = time.time()
+        while not self.stopped.is_set():
+            claimed = self.queue.claim(self.id)
+            if claimed is None:
+                if self.queue.get("closed", False):
+                    return
+                if self.idle is not None and time.time() - last > self.idle:
+                    logging.info("No tasks for %.0fs, exiting" % self.idle)
+                    return
+                # spread the polls of many workers
+                time.sleep(self.poll * random.uniform(0.5, 1.5))
+                continue
+            taskid, stage, name, task = claimed
+            with self.lock:
+                self.running.add(taskid)
+            logging.info("Running %s on %s" % (stage, name if name is not None else "all bins"))
+            try:
+                result, records = execute(task, stage, name)
+                self.queue.finish(self.id, taskid, result, records)
+            except BaseException as e:
+                # also SystemExit and KeyboardInterrupt, so the coordinator
+                # does not wait for the lease to run out
+                logging.warning("Task %s on %s failed: %s" % (stage, name, e))
+                self.queue.finish(self.id, taskid, error="{}: {}".format(type(e).__name__, e))
+                if not isinstance(e, Exception):
+                    raise
+            finally:
+                with self.lock:
+                    self.running.discard(taskid)
+            last = time.time()
+
+    def run(self):
+        self.configure()
+        self.queue.register(self.id, self.slots)
+        logging.info("Worker %s waiting for tasks in %s" % (self.id, self.queue.path))
+        heartbeat = threading.Thread(target=self.beat, daemon=True)
+        heartbeat.start()
+        try:
+            if self.slots == 1:
+                self.slot()
+            else:
+                threads = [threading.Thread(target=self.slot) for i in range(self.slots)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+        finally:
+            self.stopped.set()
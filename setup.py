@@ -18,10 +18,12 @@ setuptools.setup(
     py_modules=["api"],
     entry_points={"console_scripts": ["pygmes = pygmes.api:main"]},
     install_requires=["ete3", "pyfaidx>=0.5.8"],
+    # the tool runner uses asyncio.current_task
+    python_requires=">=3.7",
     packages=setuptools.find_packages(),
     license="GPLv3",
     classifiers=[
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Operating System :: Unix",
     ],
@@ -0,0 +1,64 @@
+"""
+Shared fixtures. Runs of pygmes use the stub tools in benchmarks/bin and
+the tiny taxonomy of benchmarks/taxonomy.py, so neither GeneMark-ES,
+Prodigal, Diamond nor the NCBI taxonomy are needed.
+"""
+import os
+import sys
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+
+import e2e  # noqa: E402
+import synthetic  # noqa: E402
+import taxonomy  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def taxdb(tmp_path_factory):
+    return taxonomy.build(str(tmp_path_factory.mktemp("taxonomy")))
+
+
+@pytest.fixture(scope="session")
+def binset(tmp_path_factory):
+    """
+    folder with three prokaryotic and two eukaryotic bins
+    """
+    folder = str(tmp_path_factory.mktemp("bins"))
+    synthetic.make_bins(folder, 5, seed=1, eukfraction=0.4, meanbp=60000)
+    return folder
+
+
+@pytest.fixture(scope="session")
+def models(tmp_path_factory):
+    """
+    model repository and the local source it is filled from
+    """
+    folder = str(tmp_path_factory.mktemp("models"))
+    return os.path.join(folder, "repo"), e2e.models_source(folder)
+
+
+@pytest.fixture
+def pygmes(taxdb, models, tmp_path):
+    """
+    run the pygmes command line with the stub tools, returns the
+    CompletedProcess
+    """
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(BENCHMARKS, "bin") + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["TMPDIR"] = str(tmp_path)
+
+    def run(*args, meta=True):
+        argv = [str(a) for a in args]
+        if meta:
+            argv += ["--meta", "--db", os.path.join(str(tmp_path), "stub.dmnd"), "-n", "2", "--taxdb", taxdb,
+                     "--models-repo", models[0], "--models-source", models[1]]
+        p = subprocess.run([sys.executable, "-c", "from pygmes.api import main; main()"] + argv,
+                           env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        assert p.returncode == 0, p.stderr[-3000:]
+        return p
+    return run
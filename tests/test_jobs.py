@@ -0,0 +1,46 @@
+import sys
+import subprocess
+import pytest
+from pygmes import jobs
+
+
+@pytest.mark.parametrize("value, seconds", [("90", 90), (90, 90), ("90s", 90), ("1.5m", 90),
+                                            ("2h", 7200), (" 30M ", 1800)])
+def test_parse_duration(value, seconds):
+    assert jobs.parse_duration(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["", "m", "ten", "5d"])
+def test_parse_duration_invalid(value):
+    with pytest.raises(ValueError):
+        jobs.parse_duration(value)
+
+
+def test_timeouts(tmp_path):
+    fasta = tmp_path / "bin.fa"
+    fasta.write_bytes(b"A" * 2000000)
+    t = jobs.timeouts.from_options(["selftraining=2h", "prodigal=60"], ["selftraining=10m"])
+    assert t.get("selftraining", str(fasta)) == pytest.approx(7200 + 2 * 600)
+    assert t.get("selftraining") == 7200
+    assert t.get("prodigal", str(fasta)) == 60
+    assert t.get("diamond", str(fasta)) is None
+    assert jobs.timeouts().get("selftraining", str(fasta)) is None
+
+
+def test_timeouts_invalid():
+    with pytest.raises(ValueError, match="Unknown stage"):
+        jobs.timeouts.from_options(["training=1h"])
+    with pytest.raises(ValueError, match="STAGE=DURATION"):
+        jobs.timeouts.from_options(["1h"])
+
+
+def test_run_timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        jobs.run([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5, grace=1)
+
+
+def test_run_missing_tool():
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        jobs.run(["pygmes-no-such-tool"], check=True)
+    assert e.value.returncode == 127
+    assert jobs.run(["pygmes-no-such-tool"]).returncode == 127
@@ -0,0 +1,88 @@
+import os
+import json
+import shutil
+from pygmes.manifest import manifest, MANIFEST_VERSION
+from pygmes.store import resultstore
+
+
+def write(path, content):
+    with open(str(path), "w") as fout:
+        fout.write(content)
+    return str(path)
+
+
+def test_changes(tmp_path):
+    a = write(tmp_path / "a.fa", ">a\nACGT\n")
+    b = write(tmp_path / "b.fa", ">b\nACGT\n")
+    c = write(tmp_path / "c.fa", ">c\nACGT\n")
+    path = str(tmp_path / "manifest.json")
+    mf = manifest(path)
+    assert not mf.exists
+    mf.update([a, b, c])
+    mf.write()
+
+    write(b, ">b\nACGTACGT\n")
+    # same content, new modification time
+    os.utime(c, ns=(0, 0))
+    os.remove(a)
+    d = write(tmp_path / "d.fa", ">d\nACGT\n")
+    mf = manifest(path)
+    assert mf.exists
+    new, changed, unchanged, removed = mf.changes([b, c, d])
+    assert (new, changed, unchanged, removed) == ([d], [b], [c], ["a.fa"])
+    # the touched bin is remembered with its new modification time
+    assert mf.bins["c.fa"]["mtime"] == 0
+
+    mf.update([b, d], removed)
+    mf.write()
+    assert sorted(manifest(path).bins.keys()) == ["b.fa", "c.fa", "d.fa"]
+    assert manifest(path).changes([b, c, d]) == ([], [], [b, c, d], [])
+
+
+def test_other_version(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    with open(path, "w") as fout:
+        json.dump({"version": MANIFEST_VERSION + 1, "bins": {"a.fa": {}}}, fout)
+    mf = manifest(path)
+    assert not mf.exists
+    assert mf.bins == {}
+
+
+def rows(outdir, name):
+    """
+    lines of an output table without the header and the output folder
+    """
+    with open(os.path.join(str(outdir), name)) as fin:
+        return sorted([line.replace(str(outdir), "") for line in fin.readlines()[1:]])
+
+
+def test_incremental_merge(pygmes, binset, tmp_path):
+    names = sorted(os.listdir(binset))
+    bins = tmp_path / "bins"
+    bins.mkdir()
+    for name in names[:4]:
+        shutil.copy(os.path.join(binset, name), str(bins / name))
+    outdir = tmp_path / "incremental"
+    pygmes("-i", bins, "-o", outdir, "--store", "--incremental")
+
+    # one bin added, one removed and one shortened to its first contig
+    shutil.copy(os.path.join(binset, names[4]), str(bins / names[4]))
+    os.remove(str(bins / names[0]))
+    with open(str(bins / names[1])) as fin:
+        content = fin.read()
+    write(bins / names[1], ">" + content.split(">")[1])
+    log = pygmes("-i", bins, "-o", outdir, "--store", "--incremental").stderr
+    assert "1 new, 1 changed, 2 unchanged and 1 removed bins" in log
+
+    full = tmp_path / "full"
+    pygmes("-i", bins, "-o", full, "--store")
+    for name in ["lineages.tsv", "metadata.tsv"]:
+        assert rows(outdir, name) == rows(full, name)
+    with resultstore(str(outdir / "pygmes.sqlite"), readonly=True) as rs, \
+            resultstore(str(full / "pygmes.sqlite"), readonly=True) as expected:
+        assert rs.names() == expected.names() == sorted(os.listdir(str(bins)))
+        for name in rs.names():
+            assert rs.faa(name) == expected.faa(name)
+
+    log = pygmes("-i", bins, "-o", outdir, "--store", "--incremental").stderr
+    assert "All bins are up to date" in log
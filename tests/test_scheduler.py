@@ -0,0 +1,75 @@
+import time
+import threading
+import pytest
+from pygmes.scheduler import scheduler, costmodel, job
+
+
+def test_lpt_order():
+    started = []
+    sizes = {"small": 1e5, "large": 8e6, "medium": 2e6, "tie_b": 5e5, "tie_a": 5e5}
+    jobs = [job("selftraining", name, bp, 10, lambda name=name: started.append(name))
+            for name, bp in sizes.items()]
+    scheduler(ncores=1).run(jobs)
+    assert started == ["large", "medium", "tie_a", "tie_b", "small"]
+
+
+def test_contigs_raise_cost():
+    costs = costmodel()
+    assert costs.predict("selftraining", 1e6, 5000) > costs.predict("selftraining", 1e6, 10)
+
+
+def test_parallel_and_errors():
+    done = []
+
+    def fail():
+        raise ValueError("broken")
+    jobs = [job("prodigal", str(i), 1e6, 1, lambda i=i: done.append(i)) for i in range(4)]
+    scheduler(ncores=4, jobcores=1).run(jobs)
+    assert sorted(done) == [0, 1, 2, 3]
+    with pytest.raises(ValueError, match="broken"):
+        scheduler(ncores=2, jobcores=1).run([job("prodigal", "bad", 1e6, 1, fail)])
+
+
+class sizedmemory(costmodel):
+    """
+    a job needs as many bytes as its bin has bp
+    """
+    def predict_memory(self, stage, bp, ncontigs=0):
+        return bp
+
+
+def test_memory_admission():
+    lock = threading.Lock()
+    running = {}
+    overlaps = {}
+
+    def run(name, memory):
+        with lock:
+            overlaps[name] = (memory, sum(running.values()), len(running))
+            running[name] = memory
+        time.sleep(0.05)
+        with lock:
+            del running[name]
+
+    sizes = {"a": 6, "b": 5, "c": 4, "d": 3, "e": 2, "huge": 12}
+    jobs = [job("prodigal", name, bp, 1, lambda name=name, bp=bp: run(name, bp)) for name, bp in sizes.items()]
+    scheduler(ncores=4, jobcores=1, costs=sizedmemory(), maxmemory=10).run(jobs)
+    assert sorted(overlaps.keys()) == sorted(sizes.keys())
+    for name, (memory, others, nothers) in overlaps.items():
+        if name == "huge":
+            # larger than the budget, so it runs alone
+            assert nothers == 0
+        else:
+            assert memory + others <= 10
+    # the small jobs did run next to each other
+    assert max([n for memory, others, n in overlaps.values()]) > 0
+
+
+def test_memory_prediction():
+    costs = costmodel()
+    assert costs.predict_memory("selftraining", 2e6) == pytest.approx((500 + 40 * 2) * 1e6 * costs.memorymargin)
+    for bp, rss in [(1e6, 800e6), (3e6, 1600e6)]:
+        costs.records.append({"stage": "selftraining", "bp": bp, "maxrss": rss})
+    costs.fit_memory()
+    # fitted to the observations: 400 MB + 400 MB per Mb
+    assert costs.predict_memory("selftraining", 2e6) == pytest.approx(1200e6 * costs.memorymargin)
@@ -0,0 +1,86 @@
+import os
+from pygmes.store import resultstore
+
+
+def read(path):
+    with open(path) as fin:
+        return fin.read()
+
+
+def test_roundtrip(tmp_path):
+    faa = tmp_path / "bin.faa"
+    faa.write_text(">c1_1\nMKV\n>c1_2\nMLL\n")
+    bed = tmp_path / "bin.bed"
+    bed.write_text("c1\t1\t9\t+\tc1_1\nc1\t20\t29\t-\tc1_2\n")
+    path = str(tmp_path / "pygmes.sqlite")
+    with resultstore(path) as rs:
+        rs.add_bin("bin.fa", fasta="/data/bin.fa", faa=str(faa), bed=str(bed), software="prodigal",
+                   nprot=2, lng={"lng": [1, 131567, 2], "n": 2}, status={"prodigal": "ok"})
+        rs.add_bin("empty.fa", software=None, nprot=0)
+    with resultstore(path, readonly=True) as rs:
+        assert rs.names() == ["bin.fa", "empty.fa"]
+        assert rs.get("bin.fa") == {"name": "bin.fa", "fasta": "/data/bin.fa", "software": "prodigal", "nprot": 2,
+                                    "lng": [1, 131567, 2], "n": 2, "status": {"prodigal": "ok"}}
+        assert rs.faa("bin.fa") == read(str(faa))
+        assert rs.bed("bin.fa") == read(str(bed))
+        assert rs.faa("empty.fa") is None
+        assert rs.get("missing.fa") is None
+
+
+def test_replace_and_remove(tmp_path):
+    path = str(tmp_path / "pygmes.sqlite")
+    with resultstore(path) as rs:
+        rs.add_bin("bin.fa", software="prodigal", status={"prodigal": "ok", "diamond_1": "bacteria"})
+        rs.add_bin("bin.fa", software="GeneMark-ES", status={"selftraining": "ok"})
+        assert rs.get("bin.fa")["status"] == {"selftraining": "ok"}
+        rs.remove("bin.fa")
+        assert rs.names() == []
+
+
+def test_extract(tmp_path):
+    faa = tmp_path / "bin.faa"
+    faa.write_text(">c1_1\nMKV\n")
+    path = str(tmp_path / "pygmes.sqlite")
+    with resultstore(path) as rs:
+        rs.add_bin("bin.fa", faa=str(faa), software="prodigal", nprot=1,
+                   lng={"lng": [1, 2], "n": 1}, status={"prodigal": "ok"})
+    out = str(tmp_path / "out")
+    with resultstore(path, readonly=True) as rs:
+        assert rs.extract("bin.fa", out)
+        assert not rs.extract("missing.fa", out)
+    assert sorted(os.listdir(out)) == ["bin.fa.faa", "bin.fa.lineage.txt"]
+    assert read(os.path.join(out, "bin.fa.faa")) == ">c1_1\nMKV\n"
+    assert read(os.path.join(out, "bin.fa.lineage.txt")) == "#taxidlineage: 1-2\nsoftware\tprodigal\nprodigal\tok\n"
+
+
+def test_meta_run(pygmes, binset, tmp_path):
+    outdir = tmp_path / "out"
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    pygmes("-i", binset, "-o", outdir, "--store", "--scratch", scratch)
+    store = str(outdir / "pygmes.sqlite")
+    # the bin folders were on scratch and are gone
+    assert not os.path.exists(str(outdir / "bins"))
+    assert os.listdir(str(scratch)) == []
+    with resultstore(store, readonly=True) as rs:
+        names = rs.names()
+        assert names == sorted(os.listdir(binset))
+        for name in names:
+            info = rs.get(name)
+            expected = "GeneMark-ES" if name.startswith("euk") else "prodigal"
+            assert info["software"] == expected
+            assert info["nprot"] == rs.faa(name).count(">")
+    listing = pygmes("extract", store, "--list", meta=False).stdout.splitlines()
+    assert [line.split("\t")[0] for line in listing] == names
+    pygmes("extract", store, names[0], "-o", tmp_path / "extracted", meta=False)
+    assert os.path.exists(str(tmp_path / "extracted" / "{}.faa".format(names[0])))
+
+
+def test_meta_run_without_scratch(pygmes, binset, tmp_path):
+    outdir = tmp_path / "out"
+    pygmes("-i", binset, "-o", outdir, "--store")
+    with resultstore(str(outdir / "pygmes.sqlite"), readonly=True) as rs:
+        assert rs.names() == sorted(os.listdir(binset))
+    # the bin folders were in outdir and are gone, nothing was put into TMPDIR
+    assert os.listdir(str(outdir / "bins")) == []
+    assert [f for f in os.listdir(str(tmp_path)) if f.startswith("pygmes_bins_")] == []
@@ -0,0 +1,105 @@
+import os
+import tarfile
+import contextlib
+import pytest
+import taxonomy as tinytaxonomy
+from pygmes import taxonomy
+
+# old taxid, current taxid
+MERGED = [(4934, 4932), (469008, 562)]
+
+
+@pytest.fixture(scope="module")
+def taxonomies(tmp_path_factory):
+    """
+    ete3 NCBITaxa and a snapshot built from the same taxdump
+    """
+    from ete3 import NCBITaxa
+    folder = str(tmp_path_factory.mktemp("taxdump"))
+    with open(os.path.join(folder, "nodes.dmp"), "w") as fout:
+        for taxid, parent, rank, name in tinytaxonomy.NODES:
+            fout.write("{}\t|\t{}\t|\t{}\t|\n".format(taxid, parent, rank))
+    with open(os.path.join(folder, "names.dmp"), "w") as fout:
+        for taxid, parent, rank, name in tinytaxonomy.NODES:
+            fout.write("{}\t|\t{}\t|\t\t|\tscientific name\t|\n".format(taxid, name))
+            fout.write("{}\t|\t{} (synonym)\t|\t\t|\tsynonym\t|\n".format(taxid, name))
+    with open(os.path.join(folder, "merged.dmp"), "w") as fout:
+        for old, new in MERGED:
+            fout.write("{}\t|\t{}\t|\n".format(old, new))
+    dump = os.path.join(folder, "taxdump.tar.gz")
+    with tarfile.open(dump, "w:gz") as tar:
+        for f in ["nodes.dmp", "names.dmp", "merged.dmp"]:
+            tar.add(os.path.join(folder, f), arcname=f)
+    dbfile = os.path.join(folder, "taxa.sqlite")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        ncbi = NCBITaxa(dbfile=dbfile, taxdump_file=dump)
+    snap = taxonomy.snapshot(taxonomy.build(dump, os.path.join(folder, "snapshot")))
+    return ncbi, snap, folder
+
+
+def taxids():
+    return [n[0] for n in tinytaxonomy.NODES] + [old for old, new in MERGED]
+
+
+def test_lineages(taxonomies):
+    ncbi, snap, folder = taxonomies
+    for taxid in taxids():
+        assert snap.get_lineage(taxid) == ncbi.get_lineage(taxid)
+
+
+def test_names_and_ranks(taxonomies):
+    ncbi, snap, folder = taxonomies
+    assert snap.get_taxid_translator(taxids()) == ncbi.get_taxid_translator(taxids())
+    current = [n[0] for n in tinytaxonomy.NODES]
+    assert snap.get_rank(current) == ncbi.get_rank(current)
+    # ete3 gives no rank for merged taxids, the snapshot that of the new one
+    assert snap.get_rank([old for old, new in MERGED]) == {4934: "species", 469008: "species"}
+
+
+def test_unknown_taxid(taxonomies):
+    ncbi, snap, folder = taxonomies
+    with pytest.raises(ValueError):
+        ncbi.get_lineage(123456)
+    with pytest.raises(ValueError):
+        snap.get_lineage(123456)
+    assert snap.get_rank([123456]) == ncbi.get_rank([123456]) == {}
+    assert snap.get_taxid_translator([123456]) == {}
+
+
+def test_build_from_folder(taxonomies):
+    ncbi, snap, folder = taxonomies
+    other = taxonomy.snapshot(taxonomy.build(folder, os.path.join(folder, "fromfolder")))
+    for taxid in taxids():
+        assert other.get_lineage(taxid) == snap.get_lineage(taxid)
+
+
+def test_translate_uses_snapshot(taxonomies):
+    ncbi, snap, folder = taxonomies
+    taxonomy.set_snapshot(snap.path)
+    try:
+        names, ranks = taxonomy.translate([[1, 131567, 2759], [1, 131567, 2]])
+    finally:
+        taxonomy.set_snapshot(None)
+    assert names == {1: "root", 2: "Bacteria", 2759: "Eukaryota", 131567: "cellular organisms"}
+    assert ranks == {1: "no rank", 2: "superkingdom", 2759: "superkingdom", 131567: "no rank"}
+
+
+@pytest.mark.parametrize("nodes", [
+    # the parent 77 of taxid 5 has no row of its own
+    [(1, 1, "no rank"), (5, 77, "species")],
+    # 5 and 6 are each other's parent
+    [(1, 1, "no rank"), (5, 6, "species"), (6, 5, "genus")],
+])
+def test_inconsistent_taxdump(tmp_path, nodes):
+    folder = str(tmp_path)
+    with open(os.path.join(folder, "nodes.dmp"), "w") as fout:
+        for taxid, parent, rank in nodes:
+            fout.write("{}\t|\t{}\t|\t{}\t|\n".format(taxid, parent, rank))
+    with open(os.path.join(folder, "names.dmp"), "w") as fout:
+        for taxid, parent, rank in nodes:
+            fout.write("{}\t|\ttaxon {}\t|\t\t|\tscientific name\t|\n".format(taxid, taxid))
+    snap = taxonomy.snapshot(taxonomy.build(folder, os.path.join(folder, "snapshot")))
+    assert snap.get_lineage(1) == [1]
+    with pytest.raises(ValueError, match="5 taxid not found"):
+        snap.get_lineage(5)
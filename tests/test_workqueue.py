@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+import pytest
+from pygmes.workqueue import workqueue, distributed, worker, wait_for_queue, MAXATTEMPTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def double(x):
+    return 2 * x
+
+
+def interrupt():
+    raise KeyboardInterrupt()
+
+
+def task(func, *args):
+    return (func, args, {}, None)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return workqueue(str(tmp_path / "queue.sqlite"), lease=0.2)
+
+
+def test_claim_order(queue):
+    queue.put("b", [("s", "small", 1, task(double, 1)), ("s", "large", 5, task(double, 2)),
+                    ("s", "medium", 3, task(double, 3))])
+    claimed = [queue.claim("w")[2] for i in range(3)]
+    assert claimed == ["large", "medium", "small"]
+    assert queue.claim("w") is None
+
+
+def test_lease_expiry_and_takeover(queue):
+    queue.put("b", [("s", "bin", 1, task(double, 4))])
+    taskid = queue.claim("dead")[0]
+    assert queue.claim("alive") is None
+    time.sleep(0.3)
+    # the coordinator queues the task again without any worker claiming
+    queue.expire()
+    assert queue.progress("b") == {"queued": 1}
+    assert queue.claim("alive")[0] == taskid
+    # the late result of the first worker is ignored
+    assert not queue.finish("dead", taskid, 1)
+    assert queue.finish("alive", taskid, 8)
+    assert queue.results("b") == [("bin", 8, [], None)]
+
+
+def test_heartbeat_keeps_lease(queue):
+    queue.put("b", [("s", "bin", 1, task(double, 4))])
+    taskid = queue.claim("w")[0]
+    for i in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("w", [taskid]) == [taskid]
+    queue.expire()
+    assert queue.progress("b") == {"running": 1}
+
+
+def test_fails_after_attempts(queue):
+    queue.put("b", [("s", "bin", 1, task(double, 4))])
+    for i in range(MAXATTEMPTS):
+        assert queue.claim("w") is not None
+        time.sleep(0.3)
+        queue.expire()
+    assert queue.progress("b") == {"failed": 1}
+    assert queue.results("b")[0][3] == "lease expired {} times".format(MAXATTEMPTS)
+
+
+def test_submit_with_worker(queue):
+    d = distributed(queue, poll=0.05)
+    w = worker(queue, slots=2, poll=0.05)
+    t = threading.Thread(target=w.run)
+    t.start()
+    try:
+        assert d.submit("s", [("a", 1, task(double, 1)), ("b", 2, task(double, 2))]) == [2, 4]
+    finally:
+        queue.close()
+        t.join()
+
+
+def test_no_workers(queue):
+    d = distributed(queue, poll=0.05)
+    with pytest.raises(RuntimeError, match="No live worker"):
+        d.submit("s", [("a", 1, task(double, 1))])
+
+
+def test_interrupted_task_is_recorded(queue):
+    queue.put("b", [("s", "bin", 1, task(interrupt))])
+    w = worker(queue, poll=0.05)
+    with pytest.raises(KeyboardInterrupt):
+        w.slot()
+    assert queue.results("b") == [("bin", None, [], "KeyboardInterrupt: ")]
+    assert w.running == set()
+
+
+def test_worker_starts_first(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    p = subprocess.Popen([sys.executable, "-c", "from pygmes.api import main; main()", "worker", path,
+                          "--lease", "30"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        time.sleep(1.5)
+        assert p.poll() is None
+        queue = workqueue(path, lease=30)
+        queue.reset()
+        assert distributed(queue, poll=0.1).submit("s", [("a", 1, task(abs, -3))]) == [3]
+        queue.close()
+        assert p.wait(timeout=30) == 0
+    finally:
+        if p.poll() is None:
+            p.kill()
+
+
+def test_worker_gives_up(tmp_path):
+    assert not wait_for_queue(str(tmp_path / "queue.sqlite"), 0.2, poll=0.05)